@@ -0,0 +1,260 @@
+"""Benchmark the write and read hot paths, without a database server.
+
+The query cases fetch results from an embedded SQLite database (see
+`sqlrunner.backends`), as well as write them.
+
+Each case runs in its own process, so that its peak memory use isn't affected by other
+cases. Results are written as JSON, and can be compared against a baseline:
+
+    python -m benchmarks --output baseline.json
+    python -m benchmarks --baseline baseline.json
+
+The comparison fails if a case's time, or its peak memory use rises, by
+more than the tolerance.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import pathlib
+import platform
+import sys
+import tempfile
+import time
+
+import structlog
+
+from benchmarks import data
+from sqlrunner import analysis, backends, columnar, main, metrics
+
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+# Compression levels to benchmark, keyed by output file suffix. A level of None means
+# the default level.
+LEVELS = {
+    ".csv": [None],
+    ".csv.gz": [1, 6, 9],
+    ".csv.zst": [1, 3, 9],
+    ".csv.lz4": [0, 9],
+    ".parquet": [1, 3],
+    ".arrow": [None],
+}
+
+# The numbers of columns in the queries from which to generate column headers
+HEADER_COLUMNS = [10, 100, 1_000]
+
+TOLERANCE = 0.2
+
+
+def make_cases(sizes):
+    cases = []
+    for num_rows in sizes:
+        for suffix, levels in LEVELS.items():
+            for level in levels:
+                cases.append(
+                    {
+                        "kind": "write",
+                        "suffix": suffix,
+                        "level": level,
+                        "rows": num_rows,
+                    }
+                )
+        for suffix in [".csv", ".csv.gz", ".csv.zst", ".csv.lz4"]:
+            cases.append(
+                {"kind": "read", "suffix": suffix, "level": None, "rows": num_rows}
+            )
+        cases.append(
+            {"kind": "query", "suffix": ".csv", "level": None, "rows": num_rows}
+        )
+    for num_columns in HEADER_COLUMNS:
+        cases.append({"kind": "headers", "columns": num_columns})
+    return cases
+
+
+def case_name(case):
+    if case["kind"] == "headers":
+        return f"headers[columns={case['columns']}]"
+    level = "default" if case["level"] is None else case["level"]
+    return f"{case['kind']}[{case['suffix']},level={level},rows={case['rows']}]"
+
+
+def run_case(case, repeat):
+    """Run the case `repeat` times in this process, and return the best time."""
+    # Only log warnings and errors, so that the case's own output is readable
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING)
+    )
+    run = {"write": _write, "read": _read, "query": _query, "headers": _headers}[
+        case["kind"]
+    ]
+    pool = data.make_pool()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            timings = [run(case, pathlib.Path(tmp_dir), pool) for _ in range(repeat)]
+        except RuntimeError as e:
+            # For example, an optional dependency isn't installed
+            return {"skipped": str(e)}
+
+    seconds, num_bytes = min(timings)
+    result = {"seconds": round(seconds, 4), "bytes": num_bytes}
+    if "rows" in case:
+        result["rows"] = case["rows"]
+        result["rows_per_second"] = round(case["rows"] / seconds)
+    result["peak_rss_bytes"] = metrics.peak_rss_bytes()
+    return result
+
+
+def _write(case, tmp_dir, pool):
+    f_path = tmp_dir / f"results{case['suffix']}"
+    results = main._fetch_result_set(
+        data.FakeCursor(case["rows"], pool), main.BATCH_SIZE
+    )
+    start = time.perf_counter()
+    if columnar.get_format(f_path) is not None:
+        columnar.write_results(results, f_path, compression_level=case["level"])
+    else:
+        main.write_results(results, f_path, compression_level=case["level"])
+    return time.perf_counter() - start, f_path.stat().st_size
+
+
+def _read(case, tmp_dir, pool):
+    f_path = tmp_dir / f"results{case['suffix']}"
+    if not f_path.exists():
+        main.write_results(
+            main._fetch_result_set(
+                data.FakeCursor(case["rows"], pool), main.BATCH_SIZE
+            ),
+            f_path,
+        )
+    start = time.perf_counter()
+    for _ in main.read_dummy_data_file(f_path):
+        pass
+    return time.perf_counter() - start, f_path.stat().st_size
+
+
+def _query(case, tmp_dir, pool):
+    # Fetch the results from an embedded database (see `backends`), and write them
+    db_path = tmp_dir / "database.sqlite"
+    if not db_path.exists():
+        backends.load_results(
+            db_path,
+            "Results",
+            main._fetch_result_set(
+                data.FakeCursor(case["rows"], pool), main.BATCH_SIZE
+            ),
+        )
+    f_path = tmp_dir / f"results{case['suffix']}"
+    results = main.run_sql(
+        dsn=f"sqlite:///{db_path}", sql_query="SELECT * FROM Results"
+    )
+    start = time.perf_counter()
+    main.write_results(results, f_path)
+    return time.perf_counter() - start, f_path.stat().st_size
+
+
+def _headers(case, tmp_dir, pool):
+    sql_query = data.make_query(case["columns"])
+    # Otherwise every repeat after the first would time a cache hit
+    analysis._parse.cache_clear()
+    with analysis._derived_lock:
+        analysis._derived.clear()
+    start = time.perf_counter()
+    main.get_column_headers(sql_query)
+    return time.perf_counter() - start, len(sql_query.encode("utf-8"))
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions of the results against the baseline."""
+    regressions = []
+    for name, result in results["cases"].items():
+        base = baseline["cases"].get(name)
+        if base is None or "skipped" in result or "skipped" in base:
+            continue
+        if result["seconds"] > base["seconds"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: {result['seconds']}s (baseline {base['seconds']}s)"
+            )
+        if result["peak_rss_bytes"] > base["peak_rss_bytes"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: {result['peak_rss_bytes']} bytes peak RSS "
+                f"(baseline {base['peak_rss_bytes']} bytes peak RSS)"
+            )
+    return regressions
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=SIZES,
+        help="Numbers of rows to benchmark",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Run each case this many times, and record the best time",
+    )
+    parser.add_argument(
+        "-k",
+        dest="match",
+        help="Only run cases whose names contain this string",
+    )
+    parser.add_argument(
+        "--output",
+        type=pathlib.Path,
+        help="Path to the results file (default: stdout)",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=pathlib.Path,
+        help="Path to a results file to compare against",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=TOLERANCE,
+        help="Fraction by which a case can regress before the comparison fails",
+    )
+    return parser.parse_args(args)
+
+
+def run(args):
+    cases = [
+        case
+        for case in make_cases(args.sizes)
+        if args.match is None or args.match in case_name(case)
+    ]
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cases": {},
+    }
+    for case in cases:
+        # A new process for each case, so that peak memory use is the case's own
+        with concurrent.futures.ProcessPoolExecutor(1) as executor:
+            result = executor.submit(run_case, case, args.repeat).result()
+        results["cases"][case_name(case)] = result
+        print(case_name(case), json.dumps(result), file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output + "\n", encoding="utf-8")
+
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args(sys.argv[1:])))
@@ -0,0 +1,81 @@
+"""Synthetic results, for benchmarking without a database."""
+
+import datetime
+import decimal
+import random
+
+import pymssql
+
+
+# Rows are drawn, in order, from a pool of this many distinct rows, so that generating
+# results doesn't dominate what we measure, or the memory we use
+POOL_SIZE = 10_000
+
+COLUMNS = [
+    ("Patient_ID", pymssql.NUMBER),
+    ("Sex", pymssql.STRING),
+    ("Practice", pymssql.STRING),
+    ("DateOfBirth", pymssql.DATETIME),
+    ("Value", pymssql.DECIMAL),
+    ("Code", pymssql.STRING),
+]
+
+
+def make_pool(seed=0):
+    """Return a pool of rows with mixed ints, strings, datetimes, Decimals, and
+    NULLs."""
+    rng = random.Random(seed)
+    start = datetime.datetime(1920, 1, 1)
+    pool = []
+    for i in range(POOL_SIZE):
+        pool.append(
+            (
+                i,
+                rng.choice(["F", "M", None]),
+                "".join(
+                    rng.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZ", k=rng.randint(4, 24))
+                ),
+                start + datetime.timedelta(seconds=rng.randrange(100 * 365 * 86_400)),
+                decimal.Decimal(rng.randrange(-1_000_000, 1_000_000)).scaleb(-3),
+                # Most values of a code column are NULL
+                None if rng.random() < 0.8 else f"{rng.randrange(10**6):06}",
+            )
+        )
+    return pool
+
+
+class FakeCursor:
+    """A stand-in for a pymssql cursor, with one result set of `num_rows` rows."""
+
+    def __init__(self, num_rows, pool):
+        self.description = [
+            (name, type_code, None, None, None, None, None)
+            for name, type_code in COLUMNS
+        ]
+        self._num_rows = num_rows
+        self._pool = pool
+        self._position = 0
+
+    def fetchmany(self, size):
+        size = min(size, self._num_rows - self._position)
+        start = self._position % len(self._pool)
+        batch = self._pool[start : start + size]
+        while len(batch) < size:
+            batch += self._pool[: size - len(batch)]
+        self._position += size
+        return batch
+
+
+def make_query(num_columns):
+    """Return a query with a final SELECT of `num_columns` columns, drawn from a
+    temporary table and a join."""
+    columns = ",\n    ".join(
+        f"{'p' if i % 2 else 'o'}.Column{i} AS Alias{i}" for i in range(num_columns)
+    )
+    return (
+        "SELECT Patient_ID, Column0 INTO #patients FROM Patient;\n"
+        f"SELECT\n    {columns}\n"
+        "FROM #patients AS p\n"
+        "JOIN Observation AS o ON o.Patient_ID = p.Patient_ID\n"
+        "WHERE p.Patient_ID NOT IN (SELECT Patient_ID FROM PatientsWithTypeOneDissent)"
+    )
@@ -6,33 +6,17 @@ import sys
 
 import structlog
 
-from sqlrunner import __version__, main, utils
-
-
-# Configure structlog to output structured logs in JSON format. For more information,
-# see:
-# https://www.structlog.org/en/stable/standard-library.html#rendering-within-structlog
-structlog.configure(
-    processors=[
-        structlog.stdlib.filter_by_level,
-        structlog.stdlib.add_logger_name,
-        structlog.stdlib.add_log_level,
-        structlog.stdlib.PositionalArgumentsFormatter(),
-        structlog.processors.TimeStamper(fmt="iso"),
-        structlog.processors.StackInfoRenderer(),
-        structlog.processors.format_exc_info,
-        structlog.processors.UnicodeDecoder(),
-        structlog.processors.CallsiteParameterAdder(
-            {
-                structlog.processors.CallsiteParameter.FILENAME,
-                structlog.processors.CallsiteParameter.FUNC_NAME,
-                structlog.processors.CallsiteParameter.LINENO,
-            }
-        ),
-        structlog.processors.JSONRenderer(),
-    ],
-    wrapper_class=structlog.stdlib.BoundLogger,
-    logger_factory=structlog.stdlib.LoggerFactory(),
+from sqlrunner import (
+    __version__,
+    cache,
+    checkpoints,
+    columnar,
+    main,
+    metrics,
+    partitioning,
+    result_sets,
+    sharding,
+    utils,
 )
 
 
@@ -51,34 +35,287 @@ def parse_args(args, environ):
     parser.add_argument(
         "--output",
         type=pathlib.Path,
-        help="Path to the output CSV file",
+        action="append",
+        help=(
+            "Path to the output file "
+            "(.csv, .csv.gz, .csv.zst, .csv.lz4, .parquet, or .arrow). "
+            "If the path contains {n}, then each result set is written to its own "
+            "output file, with {n} replaced by the result set's number. "
+            "Can be given more than once, to write the results to several output "
+            "files from a single run"
+        ),
     )
     parser.add_argument(
         "--dummy-data-file",
         type=pathlib.Path,
         help="Path to the input dummy data file to be used as the output CSV file",
     )
+    parser.add_argument(
+        "--dummy-rows",
+        type=int,
+        help=(
+            "Without a dsn or a dummy data file, generate this many rows of synthetic "
+            "data, typed from the query, rather than a single row of NULLs"
+        ),
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=positive_int,
+        default=main.BATCH_SIZE,
+        help="Number of rows to fetch from the database at a time",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        help="Compression level for a compressed output file (default: per codec)",
+    )
+    parser.add_argument(
+        "--compression-threads",
+        type=int,
+        default=1,
+        help="Number of threads to compress the output file with (0: one per core)",
+    )
+    parser.add_argument(
+        "--row-group-size",
+        type=positive_int,
+        default=columnar.ROW_GROUP_SIZE,
+        help="Number of rows in each row group of a Parquet or Arrow IPC output file",
+    )
+    parser.add_argument(
+        "--columnar-compression",
+        default=columnar.COMPRESSION,
+        help="Compression codec for a Parquet or Arrow IPC output file",
+    )
+    parser.add_argument(
+        "--shard-rows",
+        type=positive_int,
+        help="Split the output file into shards of at most this many rows",
+    )
+    parser.add_argument(
+        "--shard-bytes",
+        type=positive_int,
+        help=(
+            "Split the output file into shards of about this many bytes "
+            "(of uncompressed CSV)"
+        ),
+    )
+    parser.add_argument(
+        "--shard-workers",
+        type=positive_int,
+        default=sharding.WORKERS,
+        help="Number of shards to write at once",
+    )
+    parser.add_argument(
+        "--result-set-workers",
+        type=positive_int,
+        default=result_sets.WORKERS,
+        help="Number of result sets to write at once",
+    )
+    parser.add_argument(
+        "--partition-column",
+        help=(
+            "Run the query as several partitions, each on its own connection, "
+            "partitioned by this column (for example, Patient_ID)"
+        ),
+    )
+    parser.add_argument(
+        "--partitions",
+        type=positive_int,
+        default=4,
+        help="Number of partitions to run the query as",
+    )
+    parser.add_argument(
+        "--partition-method",
+        choices=partitioning.METHODS,
+        default="modulo",
+        help="How to partition the partition column's values",
+    )
+    parser.add_argument(
+        "--resume-column",
+        help=(
+            "Record checkpoints, ordering by this column (whose values must be unique), "
+            "so that a rerun resumes from the last checkpoint"
+        ),
+    )
+    parser.add_argument(
+        "--checkpoint-rows",
+        type=int,
+        default=checkpoints.CHECKPOINT_ROWS,
+        help="Record a checkpoint after this many rows",
+    )
+    parser.add_argument(
+        "--checkpoint-seconds",
+        type=float,
+        default=checkpoints.CHECKPOINT_SECONDS,
+        help="Record a checkpoint after this many seconds",
+    )
+    parser.add_argument(
+        "--watermark-column",
+        help=(
+            "Extract incrementally: append only the rows whose value of this column "
+            "(which must only increase as rows are added) is greater than in the last "
+            "run"
+        ),
+    )
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="With --watermark-column, rewrite the output file with all the rows",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Fetch, serialize, and write results concurrently",
+    )
+    parser.add_argument(
+        "--materialize-shared",
+        action="store_true",
+        help=(
+            "Materialize subqueries and CTEs that the query repeats into temporary "
+            "tables, so that each is run once"
+        ),
+    )
+    parser.add_argument(
+        "--transform",
+        action="append",
+        default=[],
+        metavar="KIND:COLUMN,...:NUMBER",
+        help=(
+            "Transform the results before they are written: for example, "
+            "redact:count:7 redacts counts at or below 7, and round:count:5 rounds "
+            "counts to the nearest 5. Can be given more than once"
+        ),
+    )
+    parser.add_argument(
+        "--column-stats",
+        action="store_true",
+        help=(
+            "Write each column's statistics (NULLs, minimum, maximum, and distinct "
+            "values) and a checksum to a JSON file next to the output file"
+        ),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=pathlib.Path,
+        default=environ.get("SQLRUNNER_CACHE_DIR"),
+        help="Path to a directory in which to cache output files",
+    )
+    parser.add_argument(
+        "--cache-token",
+        default="",
+        help=(
+            "Data snapshot token, which is part of the cache key; "
+            "change it when the data change"
+        ),
+    )
+    parser.add_argument(
+        "--cache-max-bytes",
+        type=int,
+        default=cache.MAX_BYTES,
+        help="Maximum size of the cache, in bytes",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Neither read from nor write to the cache",
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="Run the query, even if it is cached, and cache the output file",
+    )
+    parser.add_argument(
+        "--parse-cache-dir",
+        type=pathlib.Path,
+        default=environ.get("SQLRUNNER_PARSE_CACHE_DIR"),
+        help="Path to a directory in which to cache parsed queries",
+    )
+    parser.add_argument(
+        "--heartbeat-rows",
+        type=int,
+        default=metrics.HEARTBEAT_ROWS,
+        help="Log a progress heartbeat after this many rows",
+    )
+    parser.add_argument(
+        "--heartbeat-seconds",
+        type=float,
+        default=metrics.HEARTBEAT_SECONDS,
+        help="Log a progress heartbeat after this many seconds",
+    )
     parser.add_argument(
         "--log-file",
         type=pathlib.Path,
         help="Path to the log file",
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=(
+            "Sample the run's threads, and write a collapsed-stack profile next to "
+            "the log file"
+        ),
+    )
     parser.add_argument(
         "--version", action="version", version=f"sqlrunner {__version__}"
     )
-    return vars(parser.parse_args(args))
+    args = vars(parser.parse_args(args))
+    # The first output file is the output file; any others are written from the same
+    # results (see `fanout`)
+    outputs = args["output"] or [None]
+    args["output"], args["extra_outputs"] = outputs[0], outputs[1:]
+    if args["profile"] and args["log_file"] is None:
+        parser.error("--profile requires --log-file")
+    return args
 
 
-def entrypoint():
-    args = parse_args(sys.argv[1:], os.environ)
+def positive_int(value):
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} isn't a positive integer")
+    return number
+
+
+def configure_logging(log_file):
+    # Configure structlog to output structured logs in JSON format. For more
+    # information, see:
+    # https://www.structlog.org/en/stable/standard-library.html#rendering-within-structlog
+    structlog.configure(
+        processors=[
+            # For example, the job that a daemon is running (see `daemon`)
+            structlog.contextvars.merge_contextvars,
+            structlog.stdlib.filter_by_level,
+            structlog.stdlib.add_logger_name,
+            structlog.stdlib.add_log_level,
+            structlog.stdlib.PositionalArgumentsFormatter(),
+            structlog.processors.TimeStamper(fmt="iso"),
+            structlog.processors.StackInfoRenderer(),
+            structlog.processors.format_exc_info,
+            structlog.processors.UnicodeDecoder(),
+            structlog.processors.CallsiteParameterAdder(
+                {
+                    structlog.processors.CallsiteParameter.FILENAME,
+                    structlog.processors.CallsiteParameter.FUNC_NAME,
+                    structlog.processors.CallsiteParameter.LINENO,
+                }
+            ),
+            structlog.processors.JSONRenderer(),
+        ],
+        wrapper_class=structlog.stdlib.BoundLogger,
+        logger_factory=structlog.stdlib.LoggerFactory(),
+    )
 
     handlers = [logging.StreamHandler(sys.stdout)]
-    if args["log_file"] is not None:
-        log_file = args["log_file"]
+    if log_file is not None:
         utils.touch(log_file)
         handlers.append(logging.FileHandler(log_file, "w"))
     logging.basicConfig(format="%(message)s", level=logging.INFO, handlers=handlers)
 
+
+def entrypoint():
+    args = parse_args(sys.argv[1:], os.environ)
+    # Configuring logging here, rather than at import time, means that importing
+    # this module has no side effects
+    configure_logging(args["log_file"])
     main.main(args)
 
 
@@ -0,0 +1,153 @@
+"""Parse each query once, and share the result.
+
+Generated queries can carry codelists with tens of thousands of literals, which take
+sqlglot seconds to parse. So, within a run, a query is parsed once, and the statements
+are shared by everything that needs them: deriving column headers, and rewriting the
+final SELECT to partition or resume it.
+
+If a cache directory is set, then the statements, and anything derived from them (such
+as column headers), are also cached on disk, keyed by a hash of the query and the
+version of sqlglot, so that a rerun doesn't parse the query at all. When the cache
+grows larger than its maximum size, the least recently used entries are evicted.
+
+The T1OO check isn't derived from the statements: it is a check of the query's text,
+including its comments, and so doesn't need parsing.
+"""
+
+import collections
+import contextlib
+import contextvars
+import functools
+import hashlib
+import importlib.metadata
+import json
+import os
+import tempfile
+import threading
+
+import structlog
+
+from sqlrunner import cache
+
+
+log = structlog.get_logger()
+
+# The default maximum size of the cache, in bytes
+MAX_BYTES = 1024**3
+
+# The maximum number of derived results to keep in memory
+DERIVED_SIZE = 64
+
+# The cache directory and its maximum size for the current run, or None. This is a
+# context variable, so that concurrent runs (see `daemon` and `batch`) can each have
+# their own cache directory.
+_cache = contextvars.ContextVar("parse_cache", default=None)
+
+# Derived results, keyed by (name, key), from the least to the most recently used. They
+# are shared by concurrent runs, so they are guarded by a lock.
+_derived = collections.OrderedDict()
+_derived_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def cache_dir(directory, max_bytes=MAX_BYTES):
+    """Cache parsed queries in the directory, or don't cache them on disk if it's
+    None, until the context exits."""
+    token = _cache.set(None if directory is None else (directory, max_bytes))
+    try:
+        yield
+    finally:
+        _cache.reset(token)
+
+
+def query_key(sql_query):
+    # sqlglot is imported lazily, so we get its version without importing it
+    version = importlib.metadata.version("sqlglot")
+    return hashlib.sha256(f"{version}\0{sql_query}".encode()).hexdigest()
+
+
+def parse(sql_query):
+    """Parse the query, and return its statements.
+
+    The statements are shared, so they mustn't be modified; copy them first.
+    """
+    return _parse(sql_query)
+
+
+@functools.lru_cache(maxsize=8)
+def _parse(sql_query):
+    from sqlglot import serde
+    from sqlglot.dialects import TSQL
+
+    key = query_key(sql_query)
+    dumped = _read(key, "statements")
+    if dumped is not None:
+        return tuple(serde.load(s) for s in dumped)
+
+    log.info("start_parsing_sql_query")
+    # filter out any empty expressions returned by parser
+    statements = tuple(s for s in TSQL().parse(sql_query) if s is not None)
+    log.info("finish_parsing_sql_query")
+    _write(key, "statements", [serde.dump(s) for s in statements])
+    return statements
+
+
+def load(sql_query, name):
+    """Return the result called `name` that was derived from the query, or None if
+    there isn't one."""
+    key = query_key(sql_query)
+    with _derived_lock:
+        if (name, key) in _derived:
+            _derived.move_to_end((name, key))
+            return _derived[name, key]
+    value = _read(key, name)
+    if value is not None:
+        _remember(name, key, value)
+    return value
+
+
+def store(sql_query, name, value):
+    """Store the result called `name` that was derived from the query. The result must
+    be serializable to JSON."""
+    key = query_key(sql_query)
+    _remember(name, key, value)
+    _write(key, name, value)
+
+
+def _remember(name, key, value):
+    with _derived_lock:
+        _derived[name, key] = value
+        _derived.move_to_end((name, key))
+        while len(_derived) > DERIVED_SIZE:
+            _derived.popitem(last=False)
+
+
+def _read(key, name):
+    if (settings := _cache.get()) is None:
+        return None
+    directory, _ = settings
+    entry = directory / f"{key}.{name}.json"
+    try:
+        # Update the entry's modification time, which records when it was last used
+        os.utime(entry)
+        value = json.loads(entry.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        log.info("parse_cache_miss", key=key, name=name)
+        return None
+    log.info("parse_cache_hit", key=key, name=name)
+    return value
+
+
+def _write(key, name, value):
+    if (settings := _cache.get()) is None:
+        return
+    directory, max_bytes = settings
+    directory.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file and then rename it, so that a concurrent run never
+    # sees a partial entry
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, delete=False, encoding="utf-8"
+    ) as f:
+        json.dump(value, f)
+    os.replace(f.name, directory / f"{key}.{name}.json")
+    cache.ResultCache(directory, max_bytes).evict()
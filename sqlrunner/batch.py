@@ -0,0 +1,238 @@
+"""Run a batch of queries concurrently, and write a summary of the batch.
+
+A project may have dozens of queries. Rather than run each in its own invocation, one
+after another, a batch runs them in one process, several at a time, over a shared pool
+of connections to each database (see `pool`).
+
+The queries are given either as a manifest, which is a JSON list of objects with an
+`input` SQL file, an `output` file, and optionally a list of other `args` (paths are
+relative to the manifest's directory), or as a glob of SQL files, each of which is
+written to a CSV file with the same stem in an output directory. For example:
+
+    python -m sqlrunner.batch --manifest queries.json --summary summary.json
+    python -m sqlrunner.batch --glob "queries/*.sql" --output-dir outputs -- \\
+        --dummy-rows 100
+
+Arguments after `--` are passed to every query.
+
+A query that fails doesn't stop the others. The summary records each query's status
+and how long it took. The longest queries are started first, so that the batch isn't
+left waiting for a long query that was started last. How long each query takes is
+read from the previous summary, if there is one.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import pathlib
+import sys
+import time
+
+import structlog
+
+from sqlrunner import __main__, main, pool, utils
+
+
+log = structlog.get_logger()
+
+# The maximum number of queries that run at the same time
+MAX_JOBS = 4
+
+
+def read_manifest(f_path):
+    """Return a list of queries, each as a list of command-line arguments, from the
+    manifest at the given path."""
+    queries = []
+    for entry in json.loads(main.read_text(f_path)):
+        try:
+            queries.append(
+                [entry["input"], "--output", entry["output"], *entry.get("args", [])]
+            )
+        except KeyError as e:
+            raise RuntimeError(f"Each query in the manifest needs an {e}") from e
+    return queries
+
+
+def glob_queries(pattern, output_dir):
+    """Return a list of queries, each as a list of command-line arguments, for the SQL
+    files that match the given pattern."""
+    return [
+        [str(f_path), "--output", str(output_dir / f"{f_path.stem}.csv")]
+        for f_path in sorted(pathlib.Path().glob(pattern))
+    ]
+
+
+def read_runtimes(summary_path):
+    """Return how long, in seconds, each query took, from the summary at the given
+    path, or an empty dict if there isn't one."""
+    if summary_path is None or not summary_path.exists():
+        return {}
+    summary = json.loads(main.read_text(summary_path))
+    # A query is identified by its output file, because the same input file may be
+    # run with different args
+    return {
+        query["output"]: query["seconds"]
+        for query in summary["queries"]
+        if query["status"] == "ok"
+    }
+
+
+def schedule(queries, runtimes):
+    """Return the indices of the queries, longest first. Queries that we haven't run
+    before might be long, so they are started before all the others."""
+    return sorted(
+        range(len(queries)),
+        key=lambda i: runtimes.get(str(queries[i]["output"]), float("inf")),
+        reverse=True,
+    )
+
+
+def run_batch(queries, *, max_jobs=MAX_JOBS, pool_size=pool.POOL_SIZE, runtimes=None):
+    """Run the queries, which are dicts of parsed args, and return a summary.
+
+    Queries are run in the order given by `schedule`, and the summary records them in
+    the order given here.
+    """
+    pools = pool.Pools(
+        main.connect_to_database,
+        session_state=main.session_state,
+        size=pool_size,
+    )
+    start = time.monotonic()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_jobs) as executor:
+            futures = {
+                i: utils.submit(executor, _run_query, queries[i], pools)
+                for i in schedule(queries, runtimes or {})
+            }
+            results = [futures[i].result() for i in range(len(queries))]
+    finally:
+        pools.close()
+
+    summary = {
+        "queries": results,
+        "succeeded": sum(result["status"] == "ok" for result in results),
+        "failed": sum(result["status"] == "error" for result in results),
+        "seconds": round(time.monotonic() - start, 3),
+    }
+    log.info(
+        "batch_summary",
+        succeeded=summary["succeeded"],
+        failed=summary["failed"],
+        seconds=summary["seconds"],
+    )
+    return summary
+
+
+def _run_query(args, pools):
+    result = {"input": str(args["input"]), "output": str(args["output"])}
+    with structlog.contextvars.bound_contextvars(query=result["input"]):
+        start = time.monotonic()
+        try:
+            log.info("start_query")
+            main.main(args, connect=pools.connect)
+        except Exception as e:
+            # A query that fails doesn't stop the others
+            log.exception("fail_query")
+            result.update(status="error", error=f"{type(e).__name__}: {e}")
+        else:
+            log.info("finish_query")
+            result.update(status="ok")
+        result["seconds"] = round(time.monotonic() - start, 3)
+    return result
+
+
+def _parse_query_args(argv, directory):
+    try:
+        args = __main__.parse_args(argv, os.environ)
+    except SystemExit as e:
+        raise RuntimeError(f"Invalid arguments: {argv}") from e
+    if args["log_file"] is not None:
+        raise RuntimeError("The batch writes every query's logs to its own output")
+    return utils.resolve_paths(args, directory)
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(prog="python -m sqlrunner.batch")
+    queries = parser.add_mutually_exclusive_group(required=True)
+    queries.add_argument(
+        "--manifest",
+        type=pathlib.Path,
+        help="Path to a JSON manifest of queries",
+    )
+    queries.add_argument(
+        "--glob",
+        help="Glob pattern for the input SQL files",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=pathlib.Path,
+        help="With --glob, path to the directory for the output CSV files",
+    )
+    parser.add_argument(
+        "--summary",
+        type=pathlib.Path,
+        help=(
+            "Path to the summary JSON file. If it exists, then the previous "
+            "summary's runtimes are used to start the longest queries first"
+        ),
+    )
+    parser.add_argument(
+        "--max-jobs",
+        type=__main__.positive_int,
+        default=MAX_JOBS,
+        help="Maximum number of queries that run at the same time",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=__main__.positive_int,
+        default=pool.POOL_SIZE,
+        help="Maximum number of connections to each database",
+    )
+    parser.add_argument(
+        "--log-file",
+        type=pathlib.Path,
+        help="Path to the log file",
+    )
+    parser.add_argument(
+        "query_args",
+        nargs=argparse.REMAINDER,
+        help="SQL Runner's command-line arguments for every query",
+    )
+    args = vars(parser.parse_args(args))
+    if args["glob"] is not None and args["output_dir"] is None:
+        parser.error("--glob requires --output-dir")
+    if args["query_args"][:1] == ["--"]:
+        args["query_args"] = args["query_args"][1:]
+    return args
+
+
+def entrypoint():
+    args = parse_args(sys.argv[1:])
+    __main__.configure_logging(args["log_file"])
+
+    if args["manifest"] is not None:
+        queries = read_manifest(args["manifest"])
+        directory = args["manifest"].parent.absolute()
+    else:
+        queries = glob_queries(args["glob"], args["output_dir"])
+        directory = pathlib.Path.cwd()
+    queries = [
+        _parse_query_args(argv + args["query_args"], directory) for argv in queries
+    ]
+
+    summary = run_batch(
+        queries,
+        max_jobs=args["max_jobs"],
+        pool_size=args["pool_size"],
+        runtimes=read_runtimes(args["summary"]),
+    )
+    if args["summary"] is not None:
+        utils.touch(args["summary"])
+        args["summary"].write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    entrypoint()  # pragma: no cover
@@ -0,0 +1,97 @@
+"""An on-disk cache of output files, keyed by query.
+
+The key is computed from the query, normalised with sqlglot so that changes to
+whitespace and comments don't change the key; the target database; a data snapshot
+token, which the user changes when the data change; and the output file's suffix. On a
+hit, the cached output file is copied to the output path without touching the database.
+
+When the cache grows larger than its maximum size, the least recently used entries are
+evicted.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import structlog
+
+from sqlrunner import analysis
+
+
+log = structlog.get_logger()
+
+# The default maximum size of the cache, in bytes
+MAX_BYTES = 10 * 1024**3
+
+
+def normalize_query(sql_query):
+    """Return the query with normalised whitespace and without comments.
+
+    If sqlglot can't parse the query, then return it with normalised whitespace.
+    """
+    import sqlglot
+
+    try:
+        statements = analysis.parse(sql_query)
+    except sqlglot.errors.ParseError:
+        return " ".join(sql_query.split())
+    return ";\n".join(s.sql(dialect="tsql", comments=False) for s in statements)
+
+
+def make_key(sql_query, database, token, suffix):
+    key = hashlib.sha256()
+    for part in [normalize_query(sql_query), database, token, suffix]:
+        key.update(part.encode("utf-8"))
+        # Separate the parts, so that they can't run together
+        key.update(b"\0")
+    return key.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def get(self, key, f_path):
+        """Copy the entry for the key to the given path, and return True; or, if there
+        isn't an entry for the key, return False."""
+        entry = self.directory / key
+        try:
+            # Update the entry's modification time, which records when it was last used
+            os.utime(entry)
+        except FileNotFoundError:
+            log.info("cache_miss", key=key)
+            return False
+
+        f_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(entry, f_path)
+        log.info("cache_hit", key=key)
+        return True
+
+    def put(self, key, f_path):
+        """Copy the file at the given path into the cache as the entry for the key."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Copy to a temporary file and then rename it, so that a concurrent `get` never
+        # sees a partial entry
+        with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as f:
+            tmp_path = f.name
+        shutil.copyfile(f_path, tmp_path)
+        os.replace(tmp_path, self.directory / key)
+        log.info("cache_put", key=key)
+        self.evict()
+
+    def evict(self):
+        """Evict the least recently used entries until the cache fits its maximum
+        size."""
+        entries = []
+        for entry in self.directory.iterdir():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            total -= size
+            log.info("cache_evict", key=entry.name)
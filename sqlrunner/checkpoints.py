@@ -0,0 +1,171 @@
+"""Resumable extraction, with checkpoints.
+
+The user declares an ordering column, whose values must be unique and not NULL (for
+example, `Patient_ID`). The final SELECT is ordered by this column, and every so often
+we record a checkpoint: the value of the column in the last row that was written, and
+the size of the output file once that row was flushed. For a compressed output file,
+we finish the current compressed stream (for example, the current gzip member) before
+recording a checkpoint, so that the output file is valid up to that size.
+
+If the run fails, then a rerun truncates the output file to the size recorded in the
+checkpoint, rewrites the final SELECT to select only rows after the value recorded in
+the checkpoint, and appends these rows to the output file. When the run finishes, the
+checkpoint is removed.
+"""
+
+import csv
+import json
+import time
+
+import structlog
+
+from sqlrunner import codecs, columnar, formatting, rewriting, utils
+
+
+log = structlog.get_logger()
+
+# Record a checkpoint after at least this many rows, or this many seconds, since the
+# last checkpoint, whichever comes first
+CHECKPOINT_ROWS = 1_000_000
+CHECKPOINT_SECONDS = 60
+
+
+def checkpoint_path(f_path):
+    """Return the path of the checkpoint for the given output file."""
+    return f_path.with_name(f"{f_path.name}.checkpoint.json")
+
+
+def keyset_query(sql_query, column, last_key=None):
+    """Rewrite the query so that the final SELECT is ordered by the column, and, if
+    `last_key` isn't None, selects only rows after `last_key`."""
+    from sqlglot import exp
+
+    prelude, final = rewriting.parse_final_select(sql_query, "resumed")
+    column = rewriting.parse_column(column)
+
+    final = final.order_by(column.copy(), append=False)
+    if last_key is not None:
+        literal = rewriting.literal(last_key)
+        final = final.where(exp.GT(this=column.copy(), expression=literal))
+    return rewriting.to_sql(sql_query, prelude + [final])
+
+
+def write_results(
+    get_results,
+    f_path,
+    *,
+    column,
+    fingerprint,
+    every_rows=CHECKPOINT_ROWS,
+    every_seconds=CHECKPOINT_SECONDS,
+    compression_level=None,
+    compression_threads=1,
+):
+    """Write results to the output file, recording checkpoints as we go.
+
+    `get_results(last_key)` returns results after `last_key`, or all results if
+    `last_key` is None. A checkpoint is only used if its `fingerprint` (which should
+    identify the query and the column) matches.
+    """
+    if f_path is None or columnar.get_format(f_path) is not None:
+        raise RuntimeError("Only CSV output files can be resumed")
+
+    checkpoint = _read_checkpoint(f_path, fingerprint)
+    if checkpoint is None:
+        # job-runner expects the output file to exist (see `main.write_results`)
+        utils.touch(f_path)
+        f_path.write_bytes(b"")
+        last_key, num_rows, offset = None, 0, 0
+    else:
+        last_key = checkpoint["last_key"]
+        num_rows = checkpoint["rows"]
+        offset = checkpoint["offset"]
+        # Discard anything that was written after the checkpoint
+        with open(f_path, "r+b") as f:
+            f.truncate(offset)
+        log.info("resume_from_checkpoint", last_key=last_key, rows=num_rows)
+
+    results = get_results(last_key)
+    try:
+        headers = next(results)
+    except StopIteration:
+        checkpoint_path(f_path).unlink(missing_ok=True)
+        return
+
+    name = column.split(".")[-1]
+    if name not in headers:
+        raise RuntimeError(f"The ordering column {name} isn't selected by the query")
+    key_index = list(headers).index(name)
+
+    f = None
+    rows_since_checkpoint = 0
+    last_checkpoint = time.monotonic()
+    log.info("start_writing_results")
+    try:
+        for batch in results:
+            if f is None:
+                f = codecs.open_output(
+                    f_path,
+                    level=compression_level,
+                    threads=compression_threads,
+                    append=offset > 0,
+                )
+                writer = csv.writer(f)
+                format_batch = formatting.make_formatter(headers, batch)
+                if offset == 0:
+                    writer.writerow(headers)
+            writer.writerows(format_batch(batch))
+            num_rows += len(batch)
+            rows_since_checkpoint += len(batch)
+            last_key = utils.key_to_json(batch[-1][key_index])
+
+            if (
+                rows_since_checkpoint >= every_rows
+                or time.monotonic() - last_checkpoint >= every_seconds
+            ):
+                # Closing the output file flushes it, and finishes the current
+                # compressed stream
+                f.close()
+                f = None
+                offset = f_path.stat().st_size
+                _write_checkpoint(
+                    f_path,
+                    fingerprint=fingerprint,
+                    last_key=last_key,
+                    rows=num_rows,
+                    offset=offset,
+                )
+                rows_since_checkpoint = 0
+                last_checkpoint = time.monotonic()
+    finally:
+        if f is not None:
+            f.close()
+
+    checkpoint_path(f_path).unlink(missing_ok=True)
+    log.info("finish_writing_results", rows=num_rows)
+
+
+def _read_checkpoint(f_path, fingerprint):
+    try:
+        checkpoint = json.loads(checkpoint_path(f_path).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+    # The output file could have been replaced or truncated since the checkpoint
+    if (
+        checkpoint["fingerprint"] != fingerprint
+        or not f_path.exists()
+        or f_path.stat().st_size < checkpoint["offset"]
+    ):
+        log.info("ignore_checkpoint")
+        return None
+    return checkpoint
+
+
+def _write_checkpoint(f_path, **checkpoint):
+    utils.write_json(checkpoint_path(f_path), checkpoint)
+    log.info(
+        "write_checkpoint",
+        last_key=checkpoint["last_key"],
+        rows=checkpoint["rows"],
+        offset=checkpoint["offset"],
+    )
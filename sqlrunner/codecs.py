@@ -0,0 +1,267 @@
+"""Compression codecs for output files (and for dummy data files).
+
+The codec is selected by the file's suffix. For example, `results.csv.gz` is written
+with gzip, and `results.csv` is written uncompressed. Because dummy data files are read
+with the same codecs, any output file can be read back as a dummy data file.
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import struct
+import sys
+import time
+import zlib
+
+from sqlrunner import metrics
+
+
+class Codec:
+    """A compression codec.
+
+    Subclasses open a binary file object that compresses what is written to it, or
+    decompresses what is read from it.
+    """
+
+    default_level = None
+
+    def open(self, f_path, mode, *, level=None, threads=1):
+        raise NotImplementedError
+
+
+class Uncompressed(Codec):
+    def open(self, f_path, mode, *, level=None, threads=1):
+        return open(f_path, mode)
+
+
+class Gzip(Codec):
+    default_level = 6
+
+    def open(self, f_path, mode, *, level=None, threads=1):
+        level = self.default_level if level is None else level
+        if "r" not in mode and _num_threads(threads) > 1:
+            return ParallelGzipFile(
+                f_path, mode, level=level, threads=_num_threads(threads)
+            )
+        return gzip.open(f_path, mode, compresslevel=level)
+
+
+class Zstd(Codec):
+    default_level = 3
+
+    def open(self, f_path, mode, *, level=None, threads=1):
+        from compression import zstd
+
+        if "r" in mode:
+            return zstd.open(f_path, mode)
+
+        level = self.default_level if level is None else level
+        options = {zstd.CompressionParameter.compression_level: level}
+        if _num_threads(threads) > 1:
+            options[zstd.CompressionParameter.nb_workers] = _num_threads(threads)
+        return zstd.open(f_path, mode, options=options)
+
+
+class Lz4(Codec):
+    default_level = 0
+
+    def open(self, f_path, mode, *, level=None, threads=1):
+        import lz4.frame
+
+        if "r" in mode:
+            return lz4.frame.open(f_path, mode)
+
+        level = self.default_level if level is None else level
+        return lz4.frame.open(f_path, mode, compression_level=level)
+
+
+# The number of bytes to decompress and recompress at a time (see `copy`)
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Codecs are keyed by the last two suffixes of the file's path.
+CODECS = {
+    ".csv": Uncompressed(),
+    ".csv.gz": Gzip(),
+    ".csv.zst": Zstd(),
+    ".csv.lz4": Lz4(),
+}
+
+
+def get_codec(f_path):
+    """Return the codec for the file at the given path.
+
+    Files with suffixes that aren't registered are uncompressed.
+    """
+    return CODECS.get("".join(f_path.suffixes[-2:]), CODECS[".csv"])
+
+
+def open_output(f_path, *, level=None, threads=1, append=False):
+    """Open the output file at the given path for writing text.
+
+    If `append` is True, then append to the file; for a compressed file, this starts a
+    new compressed stream (for example, a new gzip member) at the end of the file.
+
+    If the path is None, then return a context manager for stdout.
+    """
+    if f_path is None:
+        return contextlib.nullcontext(sys.stdout)
+
+    mode = "ab" if append else "wb"
+    f = get_codec(f_path).open(f_path, mode, level=level, threads=threads)
+    run_metrics = metrics.current()
+    if run_metrics is not None:
+        f = CountingFile(f, f_path, run_metrics)
+    return io.TextIOWrapper(f, encoding="utf-8", newline="")
+
+
+def open_input(f_path):
+    """Open the input file at the given path for reading text."""
+    f = get_codec(f_path).open(f_path, "rb")
+    return io.TextIOWrapper(f, encoding="utf-8", newline="")
+
+
+def copy(src_path, dst_path, *, level=None, threads=1):
+    """Copy the file at the source path to the destination path, without parsing it.
+
+    If both files have the same codec, then the bytes are copied as they are (on
+    Linux, `shutil.copyfile` copies them in the kernel); otherwise, the source file is
+    decompressed and recompressed a chunk at a time.
+    """
+    src_codec, dst_codec = get_codec(src_path), get_codec(dst_path)
+    if src_codec is dst_codec:
+        shutil.copyfile(src_path, dst_path)
+        return
+    with (
+        src_codec.open(src_path, "rb") as src,
+        dst_codec.open(dst_path, "wb", level=level, threads=threads) as dst,
+    ):
+        shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+
+def _num_threads(threads):
+    # Zero threads means one thread per core
+    return threads or os.cpu_count()
+
+
+class CountingFile(io.BufferedIOBase):
+    """Wrap a binary file object, for writing or appending, and count the bytes that
+    are written to it.
+
+    When the file is closed, we record the number of bytes that were written to it and
+    the number of bytes by which the file on disk grew; that is, the number of bytes
+    before and after compression.
+    """
+
+    def __init__(self, f, f_path, run_metrics):
+        self._f = f
+        self._f_path = f_path
+        self._metrics = run_metrics
+        # When appending, the file on disk already has some bytes
+        self._initial_size = f_path.stat().st_size
+        self.bytes_written = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._f.write(b)
+        self.bytes_written += len(b)
+        return len(b)
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            self._f.close()
+        compressed_bytes = self._f_path.stat().st_size - self._initial_size
+        self._metrics.add_output(self.bytes_written, compressed_bytes)
+
+
+class ParallelGzipFile(io.BufferedIOBase):
+    """A gzip file, for writing or appending, that compresses blocks of data in
+    parallel.
+
+    Like pigz, we split the data into blocks and compress each block on its own thread
+    (zlib releases the GIL). Each block is primed with the last 32KiB of the previous
+    block, so that compression ratios are close to those of a single thread, and ends
+    on a byte boundary, so that the compressed blocks can be concatenated into a single
+    deflate stream. The result is a standard gzip file.
+    """
+
+    BLOCK_SIZE = 128 * 1024
+    DICT_SIZE = 32 * 1024
+
+    def __init__(self, f_path, mode="wb", *, level, threads):
+        self._f = open(f_path, mode)
+        self._level = level
+        self._executor = concurrent.futures.ThreadPoolExecutor(threads)
+        # Bound the number of blocks in flight, so that memory use stays capped
+        self._max_pending = 2 * threads
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self._dictionary = b""
+        self._crc = 0
+        self._size = 0
+
+        # A gzip header with no file name, no extra flags, and an unknown OS
+        self._f.write(
+            struct.pack("<4sIBB", b"\x1f\x8b\x08\x00", int(time.time()), 0, 255)
+        )
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self.closed:
+            raise ValueError("write to closed file")
+        data = bytes(b)
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.BLOCK_SIZE:
+            self._submit(bytes(self._buffer[: self.BLOCK_SIZE]))
+            del self._buffer[: self.BLOCK_SIZE]
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+            while self._pending:
+                self._f.write(self._pending.popleft().result())
+            # An empty final block ends the deflate stream
+            compressor = zlib.compressobj(self._level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            self._f.write(compressor.flush(zlib.Z_FINISH))
+            self._f.write(struct.pack("<II", self._crc, self._size & 0xFFFFFFFF))
+        finally:
+            self._executor.shutdown()
+            self._f.close()
+            super().close()
+
+    def _submit(self, block):
+        if len(self._pending) >= self._max_pending:
+            self._f.write(self._pending.popleft().result())
+        future = self._executor.submit(
+            _compress_block, block, self._dictionary, self._level
+        )
+        self._pending.append(future)
+        self._dictionary = block[-self.DICT_SIZE :]
+
+
+def _compress_block(block, dictionary, level):
+    kwargs = {"zdict": dictionary} if dictionary else {}
+    compressor = zlib.compressobj(
+        level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, **kwargs
+    )
+    return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
@@ -0,0 +1,199 @@
+"""Column statistics, computed as results are written, and written to a sidecar file.
+
+Downstream checks (for example, disclosure checks) need the number of rows in an
+output file, and for each column, the number of NULLs, the minimum and maximum values,
+and the number of distinct values. Rather than have them read the output file again,
+we compute these as the results stream past the writer, and write them to a JSON file
+next to the output file. For `results.csv.gz`, this is `results.csv.gz.stats.json`.
+
+Memory use doesn't depend on the number of rows: the number of distinct values is
+estimated with a HyperLogLog sketch, which has a fixed size, and is accurate to within
+a few percent. The sidecar also records a checksum of the results: the SHA-256 hash of
+the results as an uncompressed CSV file, which, for a CSV output file, is the hash of
+the output file once it has been decompressed.
+"""
+
+import csv
+import decimal
+import hashlib
+import io
+import json
+import math
+
+import structlog
+
+from sqlrunner import formatting, utils
+
+
+log = structlog.get_logger()
+
+# Each HyperLogLog sketch has 2 ** PRECISION registers, and so uses that many bytes. The
+# standard error of the estimate is 1.04 / sqrt(2 ** PRECISION), or about 1.6%.
+PRECISION = 12
+
+
+def stats_path(f_path):
+    """Return the path of the column statistics for the given output file."""
+    return f_path.with_name(f"{f_path.name}.stats.json")
+
+
+def track(results, f_path):
+    """Pass through the results, computing column statistics, and write them to the
+    sidecar file for the output file once the results are exhausted."""
+    checksum = hashlib.sha256()
+    headers = next(results, None)
+    if headers is None:
+        _write(f_path, 0, checksum, [])
+        return
+    yield headers
+
+    columns = [ColumnStats(name) for name in headers]
+    buffer = io.StringIO(newline="")
+    writer = csv.writer(buffer)
+    format_batch = None
+    num_rows = 0
+
+    for batch in results:
+        if format_batch is None:
+            # As with `main.write_results`, the headers are only written if there is
+            # at least one batch
+            writer.writerow(headers)
+            format_batch = formatting.make_formatter(headers, batch)
+        writer.writerows(format_batch(batch))
+        checksum.update(buffer.getvalue().encode("utf-8"))
+        buffer.seek(0)
+        buffer.truncate()
+
+        num_rows += len(batch)
+        for column, values in zip(columns, zip(*batch)):
+            column.update(values)
+        yield batch
+
+    _write(f_path, num_rows, checksum, columns)
+
+
+class ColumnStats:
+    def __init__(self, name):
+        self.name = name
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        # Some values can't be compared with others of a different type; for example,
+        # in a column of a dummy data file. We stop comparing if so.
+        self._comparable = True
+        self._sketch = HyperLogLog()
+
+    def update(self, values):
+        """Update the statistics with a batch of the column's values."""
+        # Set operations, min, and max run in C, so a batch costs a few passes over
+        # its values rather than several Python operations per value
+        values = _from_strings(values)
+        distinct = set(values)
+        if None in distinct:
+            self.nulls += values.count(None)
+            distinct.discard(None)
+        if not distinct:
+            return
+
+        if self._comparable:
+            try:
+                low, high = min(distinct), max(distinct)
+                if self.min is not None:
+                    low, high = min(low, self.min), max(high, self.max)
+            except TypeError:
+                self._comparable = False
+                self.min = self.max = None
+            else:
+                self.min, self.max = low, high
+
+        self._sketch.update(distinct)
+
+    def summary(self):
+        return {
+            "name": self.name,
+            "nulls": self.nulls,
+            "min": _to_json(self.min),
+            "max": _to_json(self.max),
+            "distinct": self._sketch.estimate(),
+        }
+
+
+class HyperLogLog:
+    """Estimate the number of distinct values, in a fixed amount of memory.
+
+    See Flajolet et al. (2007), "HyperLogLog: the analysis of a near-optimal cardinality
+    estimation algorithm".
+    """
+
+    def __init__(self, precision=PRECISION):
+        self.precision = precision
+        self.registers = bytearray(2**precision)
+
+    def update(self, values):
+        """Add the values to the sketch."""
+        # This is called for each distinct value in each batch, so we look up names
+        # once, rather than once per value
+        blake2b = hashlib.blake2b
+        from_bytes = int.from_bytes
+        registers = self.registers
+        rest_bits = 64 - self.precision
+        rest_mask = (1 << rest_bits) - 1
+        for value in values:
+            # Values are hashed by their text, as they would be written to a CSV file,
+            # so that the estimate is the same from run to run, and for a dummy data
+            # file's strings as for the database's values
+            x = from_bytes(blake2b(str(value).encode(), digest_size=8).digest())
+            index = x >> rest_bits
+            # The position of the first 1 bit in the rest of the hash
+            rank = rest_bits - (x & rest_mask).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # For small numbers of values, linear counting is more accurate
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+
+def _from_strings(values):
+    # The values in a dummy data file are strings, and its NULLs are empty strings. So
+    # that its statistics match the database's, we read numeric strings as numbers.
+    if not any(isinstance(v, str) for v in values):
+        return values
+    values = [None if v == "" else v for v in values]
+    try:
+        return [_to_number(v) if isinstance(v, str) else v for v in values]
+    except decimal.InvalidOperation:
+        return values
+
+
+def _to_number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return decimal.Decimal(value)
+
+
+def _to_json(value):
+    if value is None or isinstance(value, int | float | str):
+        return value
+    # For example, a date, a datetime, a Decimal, or bytes, which are written as they
+    # would be to a CSV file
+    return str(formatting.format_any(value))
+
+
+def _write(f_path, num_rows, checksum, columns):
+    stats = {
+        "rows": num_rows,
+        "checksum": f"sha256:{checksum.hexdigest()}",
+        "columns": [column.summary() for column in columns],
+    }
+    f_path = stats_path(f_path)
+    utils.touch(f_path)
+    f_path.write_text(json.dumps(stats, indent=2), encoding="utf-8")
+    log.info("write_column_stats", path=str(f_path), rows=num_rows)
@@ -0,0 +1,175 @@
+"""Write results to a columnar file (Parquet or Arrow IPC).
+
+Unlike a CSV file, a columnar file records the type of each column, so that downstream
+jobs don't have to parse the values in each column to get their types back. The format
+is selected by the file's suffix.
+
+Rows are converted into columns one row group at a time, so that the whole result never
+sits in memory. Columnar formats need pyarrow, which is imported only when a columnar
+file is written.
+"""
+
+import contextlib
+
+import structlog
+
+from sqlrunner import utils
+
+
+log = structlog.get_logger()
+
+# The number of rows in each row group (Parquet) or record batch (Arrow IPC)
+ROW_GROUP_SIZE = 100_000
+
+# The compression codec for each column chunk (Parquet) or record batch (Arrow IPC)
+COMPRESSION = "zstd"
+
+
+class Format:
+    """A columnar file format.
+
+    Subclasses open a writer that has `write_table` and `close` methods.
+    """
+
+    def open(self, f_path, schema, *, compression, compression_level):
+        raise NotImplementedError
+
+
+class Parquet(Format):
+    def open(self, f_path, schema, *, compression, compression_level):
+        from pyarrow import parquet
+
+        return parquet.ParquetWriter(
+            f_path,
+            schema,
+            compression=compression,
+            compression_level=compression_level,
+        )
+
+
+class ArrowIPC(Format):
+    def open(self, f_path, schema, *, compression, compression_level):
+        import pyarrow
+
+        if compression == "none":
+            codec = None
+        else:
+            codec = pyarrow.Codec(compression, compression_level)
+        options = pyarrow.ipc.IpcWriteOptions(compression=codec)
+        return pyarrow.ipc.new_file(f_path, schema, options=options)
+
+
+FORMATS = {
+    ".parquet": Parquet(),
+    ".arrow": ArrowIPC(),
+}
+
+
+def get_format(f_path):
+    """Return the columnar format for the file at the given path, or None if the file
+    isn't a columnar file."""
+    if f_path is None:
+        return None
+    return FORMATS.get(f_path.suffix)
+
+
+def write_results(
+    results,
+    f_path,
+    *,
+    row_group_size=ROW_GROUP_SIZE,
+    compression=COMPRESSION,
+    compression_level=None,
+):
+    # job-runner expects the output file to exist (see `main.write_results`)
+    utils.touch(f_path)
+
+    try:
+        headers = next(results)
+    except StopIteration:
+        return
+
+    import pyarrow
+
+    type_codes = getattr(headers, "type_codes", [None] * len(headers))
+
+    def open_writer(rows):
+        # The schema is inferred from the first row group
+        schema = _infer_schema(pyarrow, headers, type_codes, rows)
+        writer = get_format(f_path).open(
+            f_path,
+            schema,
+            compression=compression,
+            compression_level=compression_level,
+        )
+        stack.callback(writer.close)
+        return schema, writer
+
+    log.info("start_writing_results")
+    schema, writer = None, None
+    rows = []
+    with contextlib.ExitStack() as stack:
+        for batch in results:
+            rows.extend(batch)
+            while len(rows) >= row_group_size:
+                if writer is None:
+                    schema, writer = open_writer(rows)
+                writer.write_table(_to_table(pyarrow, schema, rows[:row_group_size]))
+                del rows[:row_group_size]
+
+        if writer is None:
+            # Even if there are no rows, we write a file with a schema
+            schema, writer = open_writer(rows)
+        if rows:
+            writer.write_table(_to_table(pyarrow, schema, rows))
+    log.info("finish_writing_results")
+
+
+def _infer_schema(pyarrow, headers, type_codes, rows):
+    # We use the type codes when a column's type can't be inferred from its values;
+    # for example, because the values in the first row group are all NULL.
+    fallback_types = {
+        utils.STRING: pyarrow.string(),
+        utils.BINARY: pyarrow.binary(),
+        utils.NUMBER: pyarrow.float64(),
+        utils.DATETIME: pyarrow.timestamp("us"),
+        utils.DECIMAL: pyarrow.decimal128(38, 18),
+    }
+    columns = list(zip(*rows)) if rows else [[] for _ in headers]
+    fields = []
+    for name, type_code, values in zip(headers, type_codes, columns):
+        type_ = pyarrow.array(values).type
+        if pyarrow.types.is_null(type_):
+            type_ = fallback_types.get(type_code, pyarrow.string())
+        elif pyarrow.types.is_decimal128(type_):
+            # The precision is inferred from the largest value in the first row group,
+            # so we widen it to hold the values in later row groups, too
+            type_ = pyarrow.decimal128(38, type_.scale)
+        fields.append(pyarrow.field(name, type_))
+    return pyarrow.schema(fields)
+
+
+def _to_table(pyarrow, schema, rows):
+    columns = zip(*rows)
+    arrays = [
+        _to_array(pyarrow, field, values) for field, values in zip(schema, columns)
+    ]
+    return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+
+def _to_array(pyarrow, field, values):
+    # A column's values in a later row group may not fit the type that was inferred
+    # from the first row group: for example, a float in a column of integers, or a
+    # decimal with more decimal places. We can't change the type of a column once the
+    # file has been opened, so we raise an error rather than lose data.
+    try:
+        if pyarrow.types.is_integer(field.type):
+            # Converting floats straight to integers truncates them, whereas casting
+            # them checks that they are whole
+            return pyarrow.array(values).cast(field.type, safe=True)
+        return pyarrow.array(values, type=field.type)
+    except pyarrow.ArrowException as e:
+        raise RuntimeError(
+            f"The values of column {field.name} don't fit its type, {field.type}, "
+            f"which was inferred from the first row group: {e}"
+        ) from None
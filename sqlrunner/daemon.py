@@ -0,0 +1,178 @@
+"""Run SQL Runner as a long-running daemon, which accepts jobs on a Unix socket.
+
+Each invocation of SQL Runner pays for starting Python, for importing its dependencies,
+and for logging in to the database. When a project runs many small queries, one after
+another, these costs dominate. The daemon pays them once: it imports its dependencies
+when it starts, and it holds a pool of connections to each database (see `pool`).
+
+A job is a request for one invocation, given as the command-line arguments that SQL
+Runner would have been invoked with. Jobs run concurrently, up to a limit, and each is
+run by `main.main`, with the same T1OO check and the same output files as the
+command-line. To start the daemon, and to submit a job to it:
+
+    python -m sqlrunner.daemon serve --socket /tmp/sqlrunner.sock
+    python -m sqlrunner.daemon submit --socket /tmp/sqlrunner.sock -- \\
+        --output results.csv query.sql
+
+The protocol is one line of JSON in each direction. The request has the job's `argv`,
+and optionally the `cwd` against which relative paths are resolved and the `environ`
+(for example, with `DATABASE_URL`). The response has the job's `status` ("ok" or
+"error") and, if it failed, the `error`.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import pathlib
+import socket
+import socketserver
+import sys
+import threading
+
+import structlog
+
+from sqlrunner import __main__, main, pool, utils
+
+
+log = structlog.get_logger()
+
+# The maximum number of jobs that run at the same time
+MAX_JOBS = 4
+
+_job_ids = itertools.count(1)
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, *, max_jobs=MAX_JOBS, pool_size=pool.POOL_SIZE):
+        super().__init__(str(socket_path), Handler)
+        # Only the user who started the daemon can submit jobs to it
+        os.chmod(socket_path, 0o600)
+        self.jobs = threading.BoundedSemaphore(max_jobs)
+        self.pools = pool.Pools(
+            main.connect_to_database,
+            session_state=main.session_state,
+            size=pool_size,
+        )
+
+    def server_close(self):
+        super().server_close()
+        self.pools.close()
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        job_id = next(_job_ids)
+        with structlog.contextvars.bound_contextvars(job=job_id):
+            try:
+                request = json.loads(self.rfile.readline())
+                args = _parse_job_args(request)
+                with self.server.jobs:
+                    log.info("start_job")
+                    main.main(args, connect=self.server.pools.connect)
+            except Exception as e:
+                log.exception("fail_job")
+                response = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+            else:
+                log.info("finish_job")
+                response = {"status": "ok"}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+def _parse_job_args(request):
+    environ = {**os.environ, **request.get("environ", {})}
+    try:
+        args = __main__.parse_args(request["argv"], environ)
+    except SystemExit as e:
+        # argparse exits on invalid arguments, and on --help and --version
+        raise RuntimeError(f"Invalid arguments: {request['argv']}") from e
+    if args["log_file"] is not None:
+        raise RuntimeError("The daemon writes every job's logs to its own output")
+
+    # Resolve relative paths against the job's working directory, rather than the
+    # daemon's
+    return utils.resolve_paths(args, pathlib.Path(request.get("cwd", os.getcwd())))
+
+
+def serve(socket_path, *, max_jobs=MAX_JOBS, pool_size=pool.POOL_SIZE):
+    """Accept jobs on the socket until interrupted."""
+    _warm_up()
+    with Server(socket_path, max_jobs=max_jobs, pool_size=pool_size) as server:
+        log.info("start_serving", socket=str(socket_path))
+        try:
+            server.serve_forever()
+        finally:
+            pathlib.Path(socket_path).unlink(missing_ok=True)
+
+
+def submit(socket_path, argv, *, cwd=None, environ=None):
+    """Submit a job to the daemon, wait for it to finish, and return the response."""
+    request = {"argv": argv, "cwd": str(cwd or os.getcwd()), "environ": environ or {}}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
+
+
+def _warm_up():
+    # Import the dependencies that the command-line imports lazily, so that jobs
+    # don't pay for importing them
+    import pymssql  # noqa: F401
+    import sqlglot.optimizer.qualify_columns  # noqa: F401
+    from sqlglot.dialects import TSQL  # noqa: F401
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(prog="python -m sqlrunner.daemon")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Start the daemon")
+    serve_parser.add_argument("--socket", type=pathlib.Path, required=True)
+    serve_parser.add_argument(
+        "--max-jobs",
+        type=__main__.positive_int,
+        default=MAX_JOBS,
+        help="Maximum number of jobs that run at the same time",
+    )
+    serve_parser.add_argument(
+        "--pool-size",
+        type=__main__.positive_int,
+        default=pool.POOL_SIZE,
+        help="Maximum number of connections to each database",
+    )
+
+    submit_parser = subparsers.add_parser("submit", help="Submit a job to the daemon")
+    submit_parser.add_argument("--socket", type=pathlib.Path, required=True)
+    submit_parser.add_argument(
+        "argv",
+        nargs=argparse.REMAINDER,
+        help="SQL Runner's command-line arguments for the job",
+    )
+    return vars(parser.parse_args(args))
+
+
+def entrypoint():
+    args = parse_args(sys.argv[1:])
+    if args["command"] == "serve":
+        __main__.configure_logging(None)
+        serve(args["socket"], max_jobs=args["max_jobs"], pool_size=args["pool_size"])
+    else:
+        argv = args["argv"]
+        if argv[:1] == ["--"]:
+            argv = argv[1:]
+        # Pass on the environment variables that SQL Runner reads
+        environ = {
+            name: value
+            for name, value in os.environ.items()
+            if name == "DATABASE_URL" or name.startswith("SQLRUNNER_")
+        }
+        response = submit(args["socket"], argv, environ=environ)
+        print(json.dumps(response))
+        sys.exit(0 if response["status"] == "ok" else 1)
+
+
+if __name__ == "__main__":
+    entrypoint()  # pragma: no cover
@@ -0,0 +1,52 @@
+"""Write the same results to several output files, fetching them once.
+
+The same results are often wanted in several forms: for example, as `results.csv` for
+inspection, as `results.csv.gz` for archiving, and as `results.parquet`. If `--output` is
+given more than once, then each output file is written, with its own format and codec,
+by its own worker thread, from a single pass over the results.
+
+Each worker takes batches from its own bounded queue, so a batch is only fetched once
+every worker has room for it: the slowest output file sets the pace, and no more than a
+few batches per output file are held in memory.
+"""
+
+import concurrent.futures
+import contextlib
+import queue
+
+import structlog
+
+from sqlrunner import utils
+
+
+log = structlog.get_logger()
+
+# The maximum number of batches of rows that can wait to be written to each output file
+QUEUE_SIZE = 8
+
+
+def write_results(results, f_paths, write, *, queue_size=QUEUE_SIZE):
+    """Write the results to each path with `write(results, f_path)`."""
+    queues = [queue.Queue(queue_size) for _ in f_paths]
+    with concurrent.futures.ThreadPoolExecutor(len(f_paths)) as executor:
+        futures = [
+            utils.submit(executor, write, utils.iter_queue(q), f_path)
+            for q, f_path in zip(queues, f_paths)
+        ]
+        log.info("start_fanning_out", outputs=len(f_paths))
+        try:
+            for item in results:
+                # The results' batches are shared by the workers, which don't modify
+                # them
+                for q, future in zip(queues, futures):
+                    utils.put(q, item, future)
+        finally:
+            # Let every worker finish, whether or not we have finished fetching. A
+            # worker that has failed doesn't take any more items, and its exception
+            # is raised below.
+            for q, future in zip(queues, futures):
+                with contextlib.suppress(Exception):
+                    utils.put(q, utils.DONE, future)
+        for future in futures:
+            future.result()
+    log.info("finish_fanning_out", outputs=len(f_paths))
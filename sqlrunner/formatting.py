@@ -0,0 +1,84 @@
+"""Format values for CSV output files.
+
+The csv module turns each value into text with `str`, which suits most values: ints,
+floats, strings, and dates and datetimes (as ISO 8601). It doesn't suit Decimals,
+which `str` may turn into scientific notation (`1E-7`), or bytes, which `str` turns into
+Python literals (`b'\\x00'`). Decimals are formatted in fixed-point notation, and bytes
+as hexadecimal, as SQL Server formats them (`0x00`).
+
+A formatter is chosen for each column once, from the type code that the database
+reported for the column (if it reported one) and from the column's values in the first
+batch. Columns that don't need a formatter are left for the csv module, so the cost
+of formatting a batch is proportional to the number of values that need formatting,
+which is usually none.
+"""
+
+import decimal
+
+from sqlrunner import utils
+
+
+def format_decimal(value):
+    return format(value, "f")
+
+
+def format_bytes(value):
+    return "0x" + value.hex().upper()
+
+
+def format_any(value):
+    if isinstance(value, decimal.Decimal):
+        return format_decimal(value)
+    if isinstance(value, (bytes, bytearray)):
+        return format_bytes(value)
+    return value
+
+
+def make_formatter(headers, first_batch):
+    """Return a function that formats a batch of rows for a CSV file.
+
+    The function returns the batch itself if no column needs formatting.
+    """
+    type_codes = getattr(headers, "type_codes", [None] * len(headers))
+    formatters = []
+    for i, type_code in enumerate(type_codes):
+        formatter = _choose_formatter(type_code, [row[i] for row in first_batch])
+        if formatter is not None:
+            formatters.append((i, formatter))
+
+    if not formatters:
+        return lambda batch: batch
+
+    def format_batch(batch):
+        formatted = []
+        for row in batch:
+            row = list(row)
+            for i, formatter in formatters:
+                if row[i] is not None:
+                    row[i] = formatter(row[i])
+            formatted.append(row)
+        return formatted
+
+    return format_batch
+
+
+def _choose_formatter(type_code, values):
+    value = next((v for v in values if v is not None), None)
+    # pymssql's type objects (for example, `pymssql.DECIMAL`) compare equal to its type
+    # codes, so we compare rather than look them up
+    if type_code == utils.DECIMAL or isinstance(value, decimal.Decimal):
+        # The values in a column of Decimals have the column's scale. `str` only uses
+        # scientific notation for values with more than six decimal places, so if
+        # the column's scale is at most six, then we leave its values for the csv
+        # module.
+        if value is not None and -6 <= value.as_tuple().exponent <= 0:
+            return None
+        return format_decimal
+    if type_code == utils.BINARY or isinstance(value, (bytes, bytearray)):
+        return format_bytes
+    if type_code is None and value is None:
+        # The column's values are all NULL, so we can't tell
+        return format_any
+    # Other values, including strings from dummy data files, are left for the csv
+    # module
+    return None
@@ -0,0 +1,137 @@
+"""Incremental extraction, with watermarks.
+
+Many queries only gain rows between runs. The user declares a watermark column, whose
+values only increase as rows are added (for example, an ID or the date that a row was
+added), and after each run we record the high-water mark: the maximum value of the
+column in the results. The next run rewrites the final SELECT to select only rows whose
+value is greater than the high-water mark, and appends these rows to the output file.
+For a compressed output file, they are appended as a new compressed stream (for example,
+a new gzip member); for a sharded output file, they are written to new shards.
+
+The high-water mark is recorded in a state file next to the output file, with the size
+of the output file. If a run fails part-way through appending rows, then the next run
+truncates the output file to this size, so that the rows aren't appended twice.
+
+Rows whose watermark column is NULL are never selected by an incremental run. If the
+query, the watermark column, or the way the output file is written changes, or if the
+output file is missing, then the state file is ignored, and the output file is
+rewritten with all the results. The user can force this with a full refresh.
+"""
+
+import json
+
+import structlog
+
+from sqlrunner import rewriting, sharding, utils
+
+
+log = structlog.get_logger()
+
+
+def state_path(f_path):
+    """Return the path of the state file for the given output file."""
+    return f_path.with_name(f"{f_path.name}.watermark.json")
+
+
+def delta_query(sql_query, column, watermark=None):
+    """Rewrite the query so that the final SELECT selects only rows whose column is
+    greater than `watermark`, or return the query unchanged if `watermark` is None."""
+    from sqlglot import exp
+
+    if watermark is None:
+        return sql_query
+    prelude, final = rewriting.parse_final_select(sql_query, "extracted incrementally")
+    column = rewriting.parse_column(column)
+    final = final.where(exp.GT(this=column, expression=rewriting.literal(watermark)))
+    return rewriting.to_sql(sql_query, prelude + [final])
+
+
+def write_results(
+    get_results, f_path, *, column, fingerprint, write, full_refresh=False
+):
+    """Write new results to the output file, and record the high-water mark.
+
+    `get_results(watermark)` returns results whose column is greater than
+    `watermark`, or all results if `watermark` is None. `write(results, f_path,
+    append)` writes results to the output file, or appends them if `append` is True. A
+    state file is only used if its `fingerprint` (which should identify the query, the
+    column, and the way the output file is written) matches.
+    """
+    if f_path is None:
+        raise RuntimeError("Only output files can be extracted incrementally")
+
+    state = None if full_refresh else _read_state(f_path, fingerprint)
+    if state is None:
+        state = {"watermark": None, "headers": None, "rows": 0}
+    elif state["bytes"] is not None:
+        # Discard anything that was appended by a run that failed
+        with open(f_path, "r+b") as f:
+            f.truncate(state["bytes"])
+    append = state["watermark"] is not None
+    log.info("start_incremental_run", watermark=state["watermark"], append=append)
+
+    results = _track(get_results(state["watermark"]), column, state)
+    write(results, f_path, append)
+
+    # A sharded output file doesn't exist; its manifest does
+    state["bytes"] = f_path.stat().st_size if f_path.exists() else None
+    _write_state(f_path, fingerprint=fingerprint, **state)
+
+
+def _track(results, column, state):
+    """Pass through the results, updating the state's high-water mark and number of
+    rows."""
+    try:
+        headers = next(results)
+    except StopIteration:
+        return
+
+    if state["headers"] is not None and list(headers) != state["headers"]:
+        raise RuntimeError(
+            "The query's columns have changed since the last run; "
+            "run it with --full-refresh"
+        )
+    name = column.split(".")[-1]
+    if name not in headers:
+        raise RuntimeError(f"The watermark column {name} isn't selected by the query")
+    index = list(headers).index(name)
+    state["headers"] = list(headers)
+    yield headers
+
+    high = None
+    for batch in results:
+        batch_high = max(
+            (row[index] for row in batch if row[index] is not None), default=None
+        )
+        if batch_high is not None and (high is None or batch_high > high):
+            high = batch_high
+        state["rows"] += len(batch)
+        yield batch
+
+    # Only rows that are greater than the previous high-water mark were selected, so
+    # the new high-water mark, if there are new rows, is greater than the previous one
+    if high is not None:
+        state["watermark"] = utils.key_to_json(high)
+
+
+def _read_state(f_path, fingerprint):
+    try:
+        state = json.loads(state_path(f_path).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+    if state.pop("fingerprint") != fingerprint:
+        log.info("ignore_watermark", reason="fingerprint")
+        return None
+    if state["bytes"] is None:
+        exists = sharding.manifest_path(f_path).exists()
+    else:
+        exists = f_path.exists() and f_path.stat().st_size >= state["bytes"]
+    if not exists:
+        log.info("ignore_watermark", reason="output")
+        return None
+    return state
+
+
+def _write_state(f_path, **state):
+    utils.write_json(state_path(f_path), state)
+    log.info("write_watermark", watermark=state["watermark"], rows=state["rows"])
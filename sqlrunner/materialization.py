@@ -0,0 +1,220 @@
+"""Materialize subqueries and CTEs that a query repeats, so that they are run once.
+
+Queries often repeat the same fragments: the T1OO exclusion, and the same registration
+or codelist CTEs in each statement. The database runs each occurrence afresh. Instead,
+each fragment that occurs more than once is selected into a temporary table, with a
+clustered index, at the start of the query, and each occurrence is rewritten to select
+from the temporary table.
+
+A fragment is only materialized if it is the same wherever it occurs: it must only
+select from permanent tables that the query doesn't write to (not from temporary
+tables or CTEs, whose contents differ from place to place), it mustn't reference the
+tables of an outer query, and it mustn't call a nondeterministic function. Its columns
+must be named, so that they can be the columns of a temporary table.
+
+Temporary tables belong to a session, so fragments are materialized across the
+statements of a query, rather than across the queries of a batch.
+"""
+
+import itertools
+
+from sqlrunner import analysis, rewriting
+
+
+# The prefix of the names of the temporary tables that fragments are materialized into
+PREFIX = "#sqlrunner_shared_"
+
+# A fragment must occur at least this many times to be materialized
+MIN_OCCURRENCES = 2
+
+
+def materialize(sql_query):
+    """Return the query, rewritten so that repeated fragments are materialized.
+
+    If there aren't any repeated fragments, then the query is returned unchanged.
+    """
+    rewritten = analysis.load(sql_query, "materialized")
+    if rewritten is not None:
+        return rewritten
+
+    # The parsed statements are shared, so we copy them before rewriting them
+    statements = [s.copy() for s in analysis.parse(sql_query)]
+    excluded_tables = _written_tables(statements) | _cte_names(statements)
+
+    table_numbers = itertools.count(1)
+    materializations = []
+    while fragments := _repeated_fragments(
+        materializations + statements, excluded_tables
+    ):
+        # Each fragment is materialized before the fragments that contain it, which
+        # were materialized by previous iterations
+        new_materializations = []
+        for occurrences in fragments:
+            table = f"{PREFIX}{next(table_numbers)}"
+            columns = occurrences[0].named_selects
+            new_materializations.extend(_materialize(occurrences[0], table, columns))
+            for occurrence in occurrences:
+                occurrence.replace(_select_from(table, columns))
+        materializations[:0] = new_materializations
+
+    if materializations:
+        rewritten = rewriting.to_sql(sql_query, materializations + statements)
+    else:
+        rewritten = sql_query
+    analysis.store(sql_query, "materialized", rewritten)
+    return rewritten
+
+
+def _repeated_fragments(statements, excluded_tables):
+    """Return the occurrences of each repeated fragment, excluding fragments that are
+    within other repeated fragments."""
+    from sqlglot import exp
+
+    occurrences = {}
+    for statement in statements:
+        for node in statement.find_all(exp.Subquery, exp.CTE):
+            fragment = node.this
+            if isinstance(fragment, exp.Query) and _can_materialize(
+                fragment, excluded_tables
+            ):
+                key = fragment.sql(dialect="tsql", comments=False)
+                occurrences.setdefault(key, []).append(fragment)
+
+    repeated = [o for o in occurrences.values() if len(o) >= MIN_OCCURRENCES]
+    repeated_ids = {id(fragment) for o in repeated for fragment in o}
+    return [
+        o
+        for o in repeated
+        if not any(id(parent) in repeated_ids for parent in _ancestors(o[0]))
+    ]
+
+
+def _can_materialize(fragment, excluded_tables):
+    from sqlglot import exp
+
+    columns = fragment.named_selects
+    if any(name in ("", "*") for name in columns):
+        return False
+    if len({name.lower() for name in columns}) != len(columns):
+        return False
+
+    inner_names = {cte.alias_or_name.lower() for cte in fragment.find_all(exp.CTE)}
+    sources = set(inner_names)
+    for table in fragment.find_all(exp.Table):
+        if not _is_permanent(table):
+            return False
+        name = table.name.lower()
+        if name in excluded_tables and name not in inner_names:
+            return False
+        sources.update([name, table.alias_or_name.lower()])
+    for subquery in fragment.find_all(exp.Subquery):
+        sources.add(subquery.alias_or_name.lower())
+
+    # A column that is qualified with a table that the fragment doesn't select from
+    # references an outer query. (In T-SQL, an unqualified column refers to the
+    # fragment's own tables, if they have it.)
+    if any(
+        c.table and c.table.lower() not in sources
+        for c in fragment.find_all(exp.Column)
+    ):
+        return False
+
+    return not any(_is_nondeterministic(f) for f in fragment.find_all(exp.Func))
+
+
+def _is_permanent(table):
+    from sqlglot import exp
+
+    identifier = table.this
+    return (
+        isinstance(identifier, exp.Identifier)
+        and not identifier.args.get("temporary")
+        and not identifier.args.get("global_")
+    )
+
+
+def _is_nondeterministic(func):
+    from sqlglot import exp
+
+    if isinstance(func, (exp.Rand, exp.Uuid)):
+        return True
+    return isinstance(func, exp.Anonymous) and func.name.upper() in {
+        "CRYPT_GEN_RANDOM",
+        "NEWSEQUENTIALID",
+    }
+
+
+def _written_tables(statements):
+    """Return the names of the tables that the statements write to."""
+    from sqlglot import exp
+
+    names = set()
+    for statement in statements:
+        if isinstance(statement, exp.Query):
+            into = statement.args.get("into")
+            target = into.this if into else None
+        else:
+            target = statement.this
+        if isinstance(target, exp.Expression):
+            names.update(table.name.lower() for table in target.find_all(exp.Table))
+    return names
+
+
+def _cte_names(statements):
+    from sqlglot import exp
+
+    return {
+        cte.alias_or_name.lower()
+        for statement in statements
+        for cte in statement.find_all(exp.CTE)
+    }
+
+
+def _ancestors(node):
+    while node.parent is not None:
+        node = node.parent
+        yield node
+
+
+def _materialize(fragment, table, columns):
+    """Return the statements that materialize the fragment into the table."""
+    from sqlglot import exp
+
+    select = exp.select(*map(exp.column, columns)).from_(
+        fragment.copy().subquery("fragment")
+    )
+    select.set("into", exp.Into(this=exp.to_table(table, dialect="tsql")))
+    index = exp.Create(
+        this=exp.Index(
+            this=exp.to_identifier(f"ix_{table.lstrip('#')}"),
+            table=exp.to_table(table, dialect="tsql"),
+            params=exp.IndexParameters(
+                columns=[
+                    exp.Ordered(
+                        this=exp.column(_index_column(columns)), nulls_first=True
+                    )
+                ]
+            ),
+        ),
+        kind="CLUSTERED INDEX",
+    )
+    return [select, index]
+
+
+def _index_column(columns):
+    # Fragments are mostly joined to, or tested for membership of, on a patient's ID
+    for column in columns:
+        if column.lower() == "patient_id":
+            return column
+    for column in columns:
+        if column.lower().endswith("_id"):
+            return column
+    return columns[0]
+
+
+def _select_from(table, columns):
+    from sqlglot import exp
+
+    return exp.select(*map(exp.column, columns)).from_(
+        exp.to_table(table, dialect="tsql")
+    )
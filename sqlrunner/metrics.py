@@ -0,0 +1,158 @@
+"""Throughput and resource metrics for a run.
+
+While a run is being collected, we log a progress heartbeat every so many rows or
+seconds, and, at the end of the run, a summary: timings for each phase, the number of
+rows, the number of bytes written before and after compression, and peak memory use.
+All are structured fields, so that they can be charted from the log file.
+"""
+
+import contextlib
+import contextvars
+import resource
+import sys
+import threading
+import time
+
+import structlog
+
+
+log = structlog.get_logger()
+
+# Log a progress heartbeat after at least this many rows, or this many seconds, since
+# the last heartbeat, whichever comes first
+HEARTBEAT_ROWS = 1_000_000
+HEARTBEAT_SECONDS = 60
+
+# The metrics for the current run. This is a context variable, so that concurrent runs
+# (see `daemon`) each have their own metrics; a thread that a run starts must be given
+# a copy of the run's context (see `utils.submit`).
+_current = contextvars.ContextVar("metrics", default=None)
+
+
+class Metrics:
+    def __init__(self, *, every_rows=HEARTBEAT_ROWS, every_seconds=HEARTBEAT_SECONDS):
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        self.start = time.perf_counter()
+        self.rows = 0
+        # Seconds from the start of the run until the first column headers (that is,
+        # until the query has executed) and until the first row
+        self.execute_seconds = None
+        self.first_row_seconds = None
+        # Seconds spent waiting for results, and seconds spent writing them
+        self.fetch_seconds = 0.0
+        self.write_seconds = 0.0
+        self.uncompressed_bytes = 0
+        self.compressed_bytes = 0
+        self._last_heartbeat = (self.start, 0)
+        self._lock = threading.Lock()
+
+    def track(self, results):
+        """Pass through the results, recording metrics and logging heartbeats."""
+        is_headers = True
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(results)
+            except StopIteration:
+                self.fetch_seconds += time.perf_counter() - start
+                return
+            fetched = time.perf_counter()
+            self.fetch_seconds += fetched - start
+
+            if is_headers:
+                is_headers = False
+                if self.execute_seconds is None:
+                    self.execute_seconds = fetched - self.start
+            else:
+                if self.first_row_seconds is None:
+                    self.first_row_seconds = fetched - self.start
+                self.rows += len(item)
+                self._heartbeat(fetched)
+
+            yield item
+            self.write_seconds += time.perf_counter() - fetched
+
+    def add_output(self, uncompressed_bytes, compressed_bytes):
+        """Record the number of bytes written to an output file, before and after
+        compression."""
+        with self._lock:
+            self.uncompressed_bytes += uncompressed_bytes
+            self.compressed_bytes += compressed_bytes
+
+    def summary(self):
+        total_seconds = time.perf_counter() - self.start
+        return {
+            "rows": self.rows,
+            "total_seconds": _round(total_seconds),
+            "execute_seconds": _round(self.execute_seconds),
+            "first_row_seconds": _round(self.first_row_seconds),
+            "fetch_seconds": _round(self.fetch_seconds),
+            "write_seconds": _round(self.write_seconds),
+            "rows_per_second": _rate(self.rows, total_seconds),
+            "uncompressed_bytes": self.uncompressed_bytes,
+            "compressed_bytes": self.compressed_bytes,
+            "compression_ratio": (
+                round(self.uncompressed_bytes / self.compressed_bytes, 3)
+                if self.compressed_bytes
+                else None
+            ),
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+
+    def _heartbeat(self, now):
+        last_time, last_rows = self._last_heartbeat
+        if (
+            self.rows - last_rows < self.every_rows
+            and now - last_time < self.every_seconds
+        ):
+            return
+        self._last_heartbeat = (now, self.rows)
+        log.info(
+            "progress",
+            rows=self.rows,
+            seconds=_round(now - self.start),
+            rows_per_second=_rate(self.rows - last_rows, now - last_time),
+            peak_rss_bytes=peak_rss_bytes(),
+        )
+
+
+@contextlib.contextmanager
+def collect(**kwargs):
+    """Collect metrics for a run, and log a summary at the end of the run."""
+    run_metrics = Metrics(**kwargs)
+    token = _current.set(run_metrics)
+    try:
+        yield run_metrics
+        log.info("run_summary", **run_metrics.summary())
+    finally:
+        _current.reset(token)
+
+
+def track(results):
+    """Track the results with the metrics for the current run, if they are being
+    collected."""
+    run_metrics = _current.get()
+    if run_metrics is None:
+        return results
+    return run_metrics.track(results)
+
+
+def current():
+    """Return the metrics for the current run, or None if they aren't being
+    collected."""
+    return _current.get()
+
+
+def peak_rss_bytes():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def _round(seconds):
+    return None if seconds is None else round(seconds, 3)
+
+
+def _rate(rows, seconds):
+    return round(rows / seconds) if seconds > 0 else None
@@ -0,0 +1,208 @@
+"""Run a query as several partitions, each on its own connection, and merge the results.
+
+The final SELECT of the query is rewritten into one query per partition, by adding a
+predicate on a partition column (typically `Patient_ID`) to its WHERE clause. With the
+modulo method, partition `i` of `n` has the rows where `ABS(column % n) = i`. With the
+range method, the range of values of the column is split into `n` equal ranges. Either
+way, rows where the column is NULL go to the first partition.
+
+Temporary tables belong to a session, so each partition runs the statements that come
+before the final SELECT for itself. Rows from different partitions are interleaved, so
+an ORDER BY in the final SELECT only orders rows within each partition.
+"""
+
+import concurrent.futures
+import math
+import queue
+import threading
+import time
+
+import structlog
+
+from sqlrunner import rewriting, utils
+
+
+log = structlog.get_logger()
+
+METHODS = ["modulo", "range"]
+
+# The maximum number of batches of rows that can wait to be merged
+QUEUE_SIZE = 8
+
+
+def partition_query(sql_query, column, num_partitions, *, bounds=None):
+    """Return one query per partition.
+
+    If `bounds` is None, then partition by modulo; otherwise, `bounds` is the minimum
+    and maximum values of the column, and partition by range.
+    """
+    from sqlglot import exp
+
+    prelude, final = rewriting.parse_final_select(sql_query, "partitioned")
+    column = rewriting.parse_column(column)
+    _check_can_partition(final, column)
+
+    if bounds is None:
+        predicates = [
+            exp.EQ(
+                this=exp.Abs(
+                    this=exp.Mod(
+                        this=column.copy(),
+                        expression=exp.Literal.number(num_partitions),
+                    )
+                ),
+                expression=exp.Literal.number(i),
+            )
+            for i in range(num_partitions)
+        ]
+    else:
+        low, high = bounds
+        step = max(math.ceil((high - low + 1) / num_partitions), 1)
+        predicates = []
+        for i in range(num_partitions):
+            predicate = exp.GTE(
+                this=column.copy(), expression=exp.Literal.number(low + i * step)
+            )
+            if i < num_partitions - 1:
+                predicate = exp.and_(
+                    predicate,
+                    exp.LT(
+                        this=column.copy(),
+                        expression=exp.Literal.number(low + (i + 1) * step),
+                    ),
+                )
+            predicates.append(predicate)
+
+    # Rows where the column is NULL don't satisfy any predicate, so we send them to
+    # the first partition
+    predicates[0] = exp.or_(
+        predicates[0], exp.Is(this=column.copy(), expression=exp.Null())
+    )
+
+    return [
+        rewriting.to_sql(sql_query, prelude + [final.where(predicate)])
+        for predicate in predicates
+    ]
+
+
+def bounds_query(sql_query, column):
+    """Return a query for the minimum and maximum values of the column, over the rows
+    that the final SELECT selects from."""
+    from sqlglot import exp
+
+    prelude, final = rewriting.parse_final_select(sql_query, "partitioned")
+    column = rewriting.parse_column(column)
+    _check_can_partition(final, column)
+
+    bounds = final.copy()
+    for arg in ["group", "having", "order", "distinct"]:
+        bounds.set(arg, None)
+    bounds.set(
+        "expressions",
+        [
+            exp.alias_(exp.Min(this=column.copy()), "low"),
+            exp.alias_(exp.Max(this=column.copy()), "high"),
+        ],
+    )
+    return rewriting.to_sql(sql_query, prelude + [bounds])
+
+
+def _check_can_partition(final, column):
+    """Raise an error if the final SELECT combines rows, so that each partition would
+    return partial results: for example, partial counts.
+
+    Rows are only combined within a partition if the final SELECT groups by the
+    partition column.
+    """
+    from sqlglot import exp
+
+    if _groups_by(final, column):
+        return
+    if final.args.get("group") or final.args.get("having"):
+        reason = "a GROUP BY or a HAVING"
+    elif final.args.get("distinct"):
+        reason = "a DISTINCT"
+    elif any(
+        # Aggregate and window functions in subqueries are run in full by each
+        # partition, so only the final SELECT's own functions combine rows
+        isinstance(node, (exp.AggFunc, exp.Window))
+        for node in final.walk(
+            prune=lambda node: isinstance(node, exp.Query) and node is not final
+        )
+    ):
+        reason = "an aggregate or window function"
+    else:
+        return
+    raise RuntimeError(
+        f"Queries whose final SELECT has {reason} can't be partitioned, unless it "
+        f"groups by the partition column {column.sql(dialect='tsql')}"
+    )
+
+
+def _groups_by(final, column):
+    from sqlglot import exp
+
+    group = final.args.get("group")
+    return group is not None and any(
+        isinstance(expression, exp.Column)
+        and expression.name.lower() == column.name.lower()
+        and (not column.table or expression.table.lower() == column.table.lower())
+        for expression in group.expressions
+    )
+
+
+def merge(all_results, *, queue_size=QUEUE_SIZE):
+    """Fetch each partition's results on its own thread, and yield column headers
+    followed by batches of rows from every partition, as they arrive."""
+    items = queue.Queue(queue_size)
+    stop = threading.Event()
+    headers = None
+    remaining = len(all_results)
+
+    with concurrent.futures.ThreadPoolExecutor(len(all_results)) as executor:
+        for partition, results in enumerate(all_results):
+            executor.submit(_fetch_partition, partition, results, items, stop)
+        try:
+            while remaining:
+                kind, value = items.get()
+                if kind == "headers":
+                    if headers is None:
+                        headers = value
+                        yield headers
+                elif kind == "batch":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    remaining -= 1
+        finally:
+            # Stop any partitions that are still running; for example, because
+            # another partition failed
+            stop.set()
+
+
+def _fetch_partition(partition, results, items, stop):
+    start = time.perf_counter()
+    num_rows = 0
+    try:
+        for i, item in enumerate(results):
+            if stop.is_set():
+                return
+            if i == 0:
+                utils.put(items, ("headers", item), stop=stop)
+            else:
+                num_rows += len(item)
+                utils.put(items, ("batch", item), stop=stop)
+    except Exception as e:
+        utils.put(items, ("error", e), stop=stop)
+        return
+
+    seconds = time.perf_counter() - start
+    log.info(
+        "finish_partition",
+        partition=partition,
+        rows=num_rows,
+        seconds=round(seconds, 3),
+        rows_per_second=round(num_rows / seconds) if seconds else None,
+    )
+    utils.put(items, ("done", partition), stop=stop)
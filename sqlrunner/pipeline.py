@@ -0,0 +1,173 @@
+"""Write results with a pipeline of stages that run concurrently.
+
+`write_results` in `main` fetches, serializes, and writes (and compresses) each batch
+of rows one after another, on a single thread. Here, each of these stages runs on its
+own thread, so that, for example, we can serialize one batch whilst waiting for the
+database to return the next. The stages are joined by bounded queues, so that a fast
+stage can't get too far ahead of a slow stage, and memory use stays capped.
+"""
+
+import csv
+import io
+import itertools
+import queue
+import threading
+import time
+
+import structlog
+
+from sqlrunner import codecs, formatting, utils
+from sqlrunner.utils import POLL_INTERVAL
+
+
+log = structlog.get_logger()
+
+# The maximum number of items (batches of rows, or chunks of serialized text) that can
+# wait between two stages.
+QUEUE_SIZE = 8
+
+
+class _Stopped(Exception):
+    """Raised when a stage stops because another stage failed."""
+
+
+class _Stage:
+    """Records how long a stage waited for input and for space for its output."""
+
+    def __init__(self, name, stop):
+        self.name = name
+        self.stop = stop
+        self.input_wait = 0.0
+        self.output_wait = 0.0
+        self.error = None
+
+    def next(self, iterator):
+        start = time.perf_counter()
+        try:
+            return next(iterator, utils.DONE)
+        finally:
+            self.input_wait += time.perf_counter() - start
+
+    def get(self, q):
+        start = time.perf_counter()
+        try:
+            while True:
+                try:
+                    return q.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    if self.stop.is_set():
+                        raise _Stopped
+        finally:
+            self.input_wait += time.perf_counter() - start
+
+    def put(self, q, item):
+        start = time.perf_counter()
+        try:
+            if not utils.put(q, item, stop=self.stop):
+                raise _Stopped
+        finally:
+            self.output_wait += time.perf_counter() - start
+
+    def run(self, target, *args):
+        try:
+            target(self, *args)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            self.error = e
+            self.stop.set()
+
+    def log(self):
+        log.info(
+            "finish_pipeline_stage",
+            stage=self.name,
+            input_wait=round(self.input_wait, 3),
+            output_wait=round(self.output_wait, 3),
+        )
+
+
+def _fetch(stage, results, batches):
+    while (batch := stage.next(results)) is not utils.DONE:
+        stage.put(batches, batch)
+    stage.put(batches, utils.DONE)
+
+
+def _serialize(stage, batches, chunks, format_batch):
+    buffer = io.StringIO(newline="")
+    writer = csv.writer(buffer)
+    while (batch := stage.get(batches)) is not utils.DONE:
+        writer.writerows(format_batch(batch))
+        stage.put(chunks, buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+    stage.put(chunks, utils.DONE)
+
+
+def _write(stage, chunks, f):
+    while (chunk := stage.get(chunks)) is not utils.DONE:
+        f.write(chunk)
+
+
+def write_results(
+    results,
+    f_path,
+    *,
+    compression_level=None,
+    compression_threads=1,
+    queue_size=QUEUE_SIZE,
+    append=False,
+):
+    # As with `main.write_results`, we always touch the output file, and we only write
+    # column headers if there is at least one batch of rows (and we aren't appending).
+    if f_path is not None and not append:
+        utils.touch(f_path)
+
+    try:
+        headers = next(results)
+        first_batch = next(results)
+    except StopIteration:
+        return
+
+    stop = threading.Event()
+    fetcher = _Stage("fetch", stop)
+    serializer = _Stage("serialize", stop)
+    writer = _Stage("write", stop)
+    batches = queue.Queue(queue_size)
+    chunks = queue.Queue(queue_size)
+
+    threads = [
+        threading.Thread(
+            target=fetcher.run,
+            args=(_fetch, itertools.chain([first_batch], results), batches),
+        ),
+        threading.Thread(
+            target=serializer.run,
+            args=(
+                _serialize,
+                batches,
+                chunks,
+                formatting.make_formatter(headers, first_batch),
+            ),
+        ),
+    ]
+
+    with codecs.open_output(
+        f_path, level=compression_level, threads=compression_threads, append=append
+    ) as f:
+        log.info("start_writing_results")
+        if not append:
+            csv.writer(f).writerow(headers)
+        for thread in threads:
+            thread.start()
+        # The write stage runs on this thread, because it owns the output file.
+        writer.run(_write, chunks, f)
+        for thread in threads:
+            thread.join()
+
+    for stage in [fetcher, serializer, writer]:
+        if stage.error is not None:
+            raise stage.error
+
+    for stage in [fetcher, serializer, writer]:
+        stage.log()
+    log.info("finish_writing_results")
@@ -0,0 +1,183 @@
+"""Pools of open connections to the database, so that a long-running process (see
+`daemon`) doesn't log in to the database for every query.
+
+Each pool holds connections to one database, up to a maximum number; when they are
+all in use, a query waits for one to be returned. When a connection is returned, its
+transaction is rolled back. pymssql doesn't autocommit, so this discards the query's
+uncommitted work, including temporary tables that it built in the transaction.
+
+A rollback doesn't undo everything that a query can do to its session, though: session
+settings, such as SET DATEFORMAT or SET TRANSACTION ISOLATION LEVEL, and temporary
+tables that the query committed, outlive it. Such changes would silently change the
+results of the next query on the connection. So, if the pool is given a
+`session_state(conn)` function (see `backends.Backend.session_state`), then it records
+the state of each connection's session when the connection is opened, and closes,
+rather than reuses, a returned connection whose session state has changed.
+
+A connection that has been idle for a while is health-checked before it is reused, and
+one that has been idle for longer than that is closed.
+"""
+
+import collections
+import contextlib
+import functools
+import threading
+import time
+
+import structlog
+
+
+log = structlog.get_logger()
+
+# The maximum number of connections to each database
+POOL_SIZE = 4
+
+# Health-check a connection that has been idle for more than this many seconds
+CHECK_AFTER = 30
+
+# Close a connection that has been idle for more than this many seconds
+MAX_IDLE = 600
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        connect,
+        *,
+        session_state=None,
+        size=POOL_SIZE,
+        check_after=CHECK_AFTER,
+        max_idle=MAX_IDLE,
+    ):
+        # `connect()` opens a new connection, and `session_state(conn)` returns the
+        # state of its session
+        self._connect = connect
+        self._session_state = session_state
+        self._slots = threading.BoundedSemaphore(size)
+        self.check_after = check_after
+        self.max_idle = max_idle
+        # Idle connections, with the states of their sessions when they were opened,
+        # and the times at which they were returned
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Return a context manager for a connection from the pool."""
+        with self._slots:
+            conn, state = self._get()
+            try:
+                yield conn
+            except GeneratorExit:
+                # The results weren't consumed; for example, because only the first
+                # result set was wanted. Rolling back discards the rest.
+                self._put(conn, state)
+                raise
+            except BaseException:
+                # The connection may be in a bad state, so we don't reuse it
+                _close(conn)
+                raise
+            else:
+                self._put(conn, state)
+
+    def close(self):
+        """Close the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, collections.deque()
+        for conn, _, _ in idle:
+            _close(conn)
+
+    def _get(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                # The most recently returned connection is the least likely to have
+                # been dropped by the server
+                conn, state, returned = self._idle.pop()
+            idle_seconds = time.monotonic() - returned
+            if idle_seconds > self.max_idle:
+                log.info("recycle_connection", idle_seconds=round(idle_seconds))
+                _close(conn)
+            elif idle_seconds > self.check_after and not _is_healthy(conn):
+                log.info("discard_unhealthy_connection")
+                _close(conn)
+            else:
+                return conn, state
+        log.info("open_connection")
+        conn = self._connect()
+        if self._session_state is None:
+            return conn, None
+        try:
+            return conn, self._session_state(conn)
+        except BaseException:
+            _close(conn)
+            raise
+
+    def _put(self, conn, state):
+        try:
+            conn.rollback()
+            changed = (
+                self._session_state is not None and self._session_state(conn) != state
+            )
+        except Exception:
+            _close(conn)
+            return
+        if changed:
+            log.info("discard_changed_connection")
+            _close(conn)
+            return
+        with self._lock:
+            self._idle.append((conn, state, time.monotonic()))
+
+
+class Pools:
+    """A connection pool for each database."""
+
+    def __init__(self, connect, *, session_state=None, **kwargs):
+        # `connect(dsn)` opens a new connection (see `main.connect_to_database`), and
+        # `session_state(dsn, conn)` returns the state of its session (see
+        # `main.session_state`)
+        self._connect = connect
+        self._session_state = session_state
+        self._kwargs = kwargs
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def connect(self, dsn):
+        """Return a context manager for a connection to the database, from its pool.
+        This can be passed to `main.main` as `connect`."""
+        with self._lock:
+            if dsn not in self._pools:
+                if self._session_state is None:
+                    session_state = None
+                else:
+                    session_state = functools.partial(self._session_state, dsn)
+                self._pools[dsn] = ConnectionPool(
+                    functools.partial(self._connect, dsn),
+                    session_state=session_state,
+                    **self._kwargs,
+                )
+            pool = self._pools[dsn]
+        return pool.connection()
+
+    def close(self):
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
+
+
+def _is_healthy(conn):
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        return True
+    except Exception:
+        return False
+
+
+def _close(conn):
+    with contextlib.suppress(Exception):
+        conn.close()
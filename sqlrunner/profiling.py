@@ -0,0 +1,159 @@
+"""Profile a run by sampling the stacks of its threads.
+
+Every so often, a sampler thread records the stack of each of the process's other
+threads. The stacks are written, when the run finishes, in the collapsed format that
+flame graph tools read (for example, `flamegraph.pl` or speedscope): one line per
+distinct stack, with its frames from outermost to innermost separated by semicolons,
+followed by the number of times that it was sampled. The first frame is the thread's
+name, so that the pipeline's threads (see `pipeline`) can be told apart.
+
+Each sample is also attributed to a phase of the run (fetching results, transforming,
+formatting and serializing them, compressing and writing them, or computing column
+statistics) by the innermost frame that belongs to a phase. For each phase, we log the
+wall-clock seconds that threads spent in it and the CPU seconds that they used in it,
+from each thread's CPU clock. A phase that takes much more wall-clock time than CPU
+time is waiting: for fetching, that is usually waiting for the database.
+
+Sampling a hundred times a second costs much less than one percent of a run, so
+profiles can be recorded for production runs.
+"""
+
+import collections
+import contextlib
+import sys
+import threading
+import time
+
+import structlog
+
+
+log = structlog.get_logger()
+
+# Seconds between samples
+INTERVAL = 0.01
+
+# The phase of a frame, by its module and function (or by its module alone, if the
+# function is None). Samples whose frames don't belong to a phase are "other".
+PHASES = {
+    ("sqlrunner.main", "_fetch_result_set"): "fetch",
+    ("sqlrunner.main", "read_dummy_data_file"): "fetch",
+    ("sqlrunner.backends", None): "fetch",
+    ("sqlrunner.synthetic", None): "fetch",
+    ("pymssql", None): "fetch",
+    ("sqlrunner.transforms", None): "transform",
+    ("sqlrunner.formatting", None): "format",
+    ("sqlrunner.main", "write_results"): "serialize",
+    ("sqlrunner.pipeline", "_serialize"): "serialize",
+    ("sqlrunner.sharding", "_serialize"): "serialize",
+    ("sqlrunner.checkpoints", "write_results"): "serialize",
+    ("sqlrunner.columnar", None): "serialize",
+    ("sqlrunner.codecs", None): "compress",
+    ("gzip", None): "compress",
+    ("sqlrunner.column_stats", None): "column_stats",
+}
+
+
+def profile_path(log_file):
+    """Return the path of the profile for the given log file."""
+    return log_file.with_name(f"{log_file.name}.collapsed")
+
+
+@contextlib.contextmanager
+def profile(f_path, *, interval=INTERVAL):
+    """Sample the process's threads until the context exits, and then write the
+    profile to the given path and log a summary of the phases."""
+    sampler = Sampler()
+    stop = threading.Event()
+
+    def run():
+        last = time.perf_counter()
+        while not stop.wait(interval):
+            now = time.perf_counter()
+            sampler.sample(now - last)
+            last = now
+
+    thread = threading.Thread(target=run, name="sqlrunner-profiler", daemon=True)
+    thread.start()
+    try:
+        yield sampler
+    finally:
+        # A profile of a run that fails is as useful as one of a run that succeeds
+        stop.set()
+        thread.join()
+        sampler.write(f_path)
+
+
+class Sampler:
+    def __init__(self):
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self.wall_seconds = collections.Counter()
+        self.cpu_seconds = collections.Counter()
+        self._cpu_clocks = {}
+
+    def sample(self, elapsed):
+        """Record the stack of each of the process's threads, except the current
+        thread, attributing `elapsed` seconds to each."""
+        current = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == current:
+                continue
+            phase = _phase(frame)
+            # Semicolons and spaces separate frames and counts in the collapsed format
+            name = names.get(ident, str(ident)).replace(" ", "_").replace(";", "_")
+            self.stacks[(name, *_labels(frame))] += 1
+            self.wall_seconds[phase] += elapsed
+            self.cpu_seconds[phase] += self._cpu_delta(ident)
+        self.samples += 1
+
+    def _cpu_delta(self, ident):
+        # Not every platform has a CPU clock for each thread
+        if not hasattr(time, "pthread_getcpuclockid"):
+            return 0.0
+        try:
+            seconds = time.clock_gettime(time.pthread_getcpuclockid(ident))
+        except OSError:
+            # The thread has finished
+            return 0.0
+        # A thread's CPU time before its first sample isn't attributed to a phase
+        previous = self._cpu_clocks.get(ident, seconds)
+        self._cpu_clocks[ident] = seconds
+        return seconds - previous
+
+    def write(self, f_path):
+        with open(f_path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{';'.join(stack)} {count}\n")
+        log.info(
+            "profile_summary",
+            path=str(f_path),
+            samples=self.samples,
+            wall_seconds=_round(self.wall_seconds),
+            cpu_seconds=_round(self.cpu_seconds),
+        )
+
+
+def _labels(frame):
+    """Return the labels of the frames of the stack, from outermost to innermost."""
+    labels = []
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "?")
+        labels.append(f"{module}:{frame.f_code.co_qualname}")
+        frame = frame.f_back
+    return reversed(labels)
+
+
+def _phase(frame):
+    """Return the phase of the innermost frame of the stack that belongs to one."""
+    while frame is not None:
+        module = frame.f_globals.get("__name__")
+        phase = PHASES.get((module, frame.f_code.co_name)) or PHASES.get((module, None))
+        if phase is not None:
+            return phase
+        frame = frame.f_back
+    return "other"
+
+
+def _round(seconds):
+    return {phase: round(value, 3) for phase, value in sorted(seconds.items())}
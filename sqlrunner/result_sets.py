@@ -0,0 +1,64 @@
+"""Write each result set from a query to its own output file.
+
+A query that builds temporary tables and then runs several SELECTs returns several
+result sets. If the output path is a template, such as `results_{n}.csv.gz`, then
+result set `n` (counting from zero) is written to `results_0.csv.gz`, and so on.
+
+Result sets share a cursor, so they are fetched one after another. However, each result
+set is written (serialized and compressed) by a worker thread, so that writing one
+result set overlaps with fetching the next.
+"""
+
+import concurrent.futures
+import pathlib
+import queue
+
+import structlog
+
+from sqlrunner import utils
+
+
+log = structlog.get_logger()
+
+# The number of result sets that can be written at once
+WORKERS = 2
+
+# The maximum number of batches of rows that can wait to be written to a result set's
+# output file
+QUEUE_SIZE = 8
+
+
+def is_template(f_path):
+    """Return True if the given output path is a template for one path per result
+    set."""
+    return f_path is not None and "{n}" in str(f_path)
+
+
+def write_result_sets(
+    all_results, template, write, *, workers=WORKERS, queue_size=QUEUE_SIZE
+):
+    """Write each result set with `write(results, f_path)`, where `f_path` is given by
+    the template."""
+    futures = []
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        for n, results in enumerate(all_results):
+            f_path = pathlib.Path(str(template).format(n=n))
+            batches = queue.Queue(queue_size)
+            future = utils.submit(executor, write, utils.iter_queue(batches), f_path)
+            futures.append(future)
+            log.info("start_fetching_result_set", result_set=n)
+            try:
+                for item in results:
+                    utils.put(batches, item, future)
+            finally:
+                # Let the worker finish, whether or not we have finished fetching
+                # this result set
+                utils.put(batches, utils.DONE, future)
+            log.info("finish_fetching_result_set", result_set=n)
+
+        for future in futures:
+            future.result()
+
+    if not futures:
+        # job-runner expects the output file to exist (see `main.write_results`)
+        utils.touch(pathlib.Path(str(template).format(n=0)))
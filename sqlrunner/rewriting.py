@@ -0,0 +1,64 @@
+"""Helpers for rewriting the final SELECT of a query with sqlglot.
+
+sqlglot is slow to import, so it is imported by the functions that need it, rather than
+by the modules that use these helpers.
+"""
+
+import re
+
+from sqlrunner import analysis
+
+
+def parse_final_select(sql_query, action):
+    """Parse the query, and return the statements that come before the final SELECT,
+    and the final SELECT.
+
+    `action` describes what we want to do with the final SELECT, for the error that's
+    raised if we can't.
+
+    The statements are shared (see `analysis.parse`), so they mustn't be modified.
+    """
+    from sqlglot import exp
+
+    *prelude, final = analysis.parse(sql_query)
+    if not isinstance(final, exp.Select) or final.args.get("into"):
+        raise RuntimeError(
+            f"Only queries whose final statement is a SELECT can be {action}"
+        )
+    if final.args.get("limit"):
+        raise RuntimeError(f"Queries whose final SELECT has a TOP can't be {action}")
+    return prelude, final
+
+
+def parse_column(column):
+    """Parse a column name, which may be qualified with a table name."""
+    from sqlglot import exp
+
+    return exp.column(*reversed(column.split(".")))
+
+
+def literal(value):
+    """Return a literal for a value that was recorded as JSON: a number for an int, and
+    a string for anything else (for example, a date)."""
+    from sqlglot import exp
+
+    if isinstance(value, int):
+        return exp.Literal.number(value)
+    return exp.Literal.string(value)
+
+
+def to_sql(sql_query, statements):
+    """Generate SQL for the statements, which were parsed from the query."""
+    # sqlglot turns comments into block comments, which the T1OO check doesn't
+    # recognise, so we drop them and instead carry over the original query's line
+    # comments, including those that follow code on the same line
+    comments = [m[1] for m in _LINE_COMMENT.finditer(sql_query) if m[1]]
+    sql = ";\n".join(s.sql(dialect="tsql", comments=False) for s in statements)
+    return "\n".join([*(c.strip() for c in comments), sql])
+
+
+# A line comment, or a string, quoted identifier or block comment (which may contain
+# "--" that doesn't start a line comment)
+_LINE_COMMENT = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\[[^\]]*\]|/\*.*?\*/|(--[^\r\n]*)", re.DOTALL
+)
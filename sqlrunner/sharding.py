@@ -0,0 +1,197 @@
+"""Write results to numbered shards, rather than to a single output file.
+
+A new shard is started once the current shard reaches a number of rows, or a number of
+bytes (of uncompressed CSV), whichever comes first. Each shard has its own column
+headers, and so can be read on its own. Shards are written (and compressed) by a pool
+of worker threads, so that several shards can be compressed at once.
+
+A JSON manifest lists the shards, with the number of rows, the number of bytes, and
+the SHA-256 checksum of each.
+"""
+
+import concurrent.futures
+import csv
+import hashlib
+import io
+import itertools
+import json
+import queue
+
+import structlog
+
+from sqlrunner import codecs, columnar, formatting, utils
+
+
+log = structlog.get_logger()
+
+# The number of shards that can be written at once
+WORKERS = 4
+
+# The maximum number of chunks of serialized text that can wait to be written to a
+# shard
+QUEUE_SIZE = 8
+
+
+def shard_path(f_path, index):
+    """Return the path of the shard with the given index.
+
+    The index goes before the suffixes that select the codec, so that the shard is
+    written with the same codec as the output file. For example, the first shard of
+    `results.csv.gz` is `results-00000.csv.gz`.
+    """
+    suffix = "".join(f_path.suffixes[-2:])
+    base = f_path.name.removesuffix(suffix)
+    return f_path.with_name(f"{base}-{index:05}{suffix}")
+
+
+def manifest_path(f_path):
+    """Return the path of the manifest for the given output file."""
+    suffix = "".join(f_path.suffixes[-2:])
+    base = f_path.name.removesuffix(suffix)
+    return f_path.with_name(f"{base}.manifest.json")
+
+
+def write_results(
+    results,
+    f_path,
+    *,
+    max_rows=None,
+    max_bytes=None,
+    workers=WORKERS,
+    compression_level=None,
+    compression_threads=1,
+    queue_size=QUEUE_SIZE,
+    append=False,
+):
+    """Write results to shards, and list them in the manifest.
+
+    If `append` is True, then the rows are written to new shards, after the shards
+    that the manifest already lists (see `incremental`).
+    """
+    if f_path is None or columnar.get_format(f_path) is not None:
+        raise RuntimeError("Only CSV output files can be sharded")
+
+    if append:
+        previous_shards = _read_manifest(f_path)["shards"]
+    else:
+        # Otherwise, if there were more shards last time, some would be left behind
+        _remove_shards(f_path)
+        previous_shards = []
+    headers = []
+    try:
+        headers = next(results)
+        first_batch = next(results)
+    except StopIteration:
+        if append:
+            return
+        # As with an output file, we always touch the first shard
+        first_shard = shard_path(f_path, 0)
+        utils.touch(first_shard)
+        _write_manifest(
+            f_path, headers=list(headers), shards=[_describe(first_shard, 0)]
+        )
+        return
+
+    f_path.parent.mkdir(parents=True, exist_ok=True)
+    header = _serialize([headers])
+    format_batch = formatting.make_formatter(headers, first_batch)
+    shards = []
+    chunks = None  # The queue for the current shard, if there is one
+    rows_in_shard = bytes_in_shard = 0
+
+    log.info("start_writing_results")
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        try:
+            for batch in itertools.chain([first_batch], results):
+                while batch:
+                    if chunks is None:
+                        chunks = queue.Queue(queue_size)
+                        shards.append(
+                            utils.submit(
+                                executor,
+                                _write_shard,
+                                shard_path(f_path, len(previous_shards) + len(shards)),
+                                chunks,
+                                header,
+                                compression_level,
+                                compression_threads,
+                            )
+                        )
+                    if max_rows is None:
+                        rows, batch = batch, []
+                    else:
+                        split = max_rows - rows_in_shard
+                        rows, batch = batch[:split], batch[split:]
+                    text = _serialize(format_batch(rows))
+                    utils.put(chunks, (text, len(rows)), shards[-1])
+                    rows_in_shard += len(rows)
+                    bytes_in_shard += len(text.encode("utf-8"))
+                    if (max_rows is not None and rows_in_shard >= max_rows) or (
+                        max_bytes is not None and bytes_in_shard >= max_bytes
+                    ):
+                        utils.put(chunks, utils.DONE, shards[-1])
+                        chunks = None
+                        rows_in_shard = bytes_in_shard = 0
+        finally:
+            # Let the worker for the current shard finish, whether or not we have
+            # finished fetching results
+            if chunks is not None:
+                utils.put(chunks, utils.DONE, shards[-1])
+
+        descriptions = [shard.result() for shard in shards]
+
+    _write_manifest(
+        f_path, headers=list(headers), shards=previous_shards + descriptions
+    )
+    log.info("finish_writing_results", shards=len(descriptions))
+
+
+def _serialize(rows):
+    buffer = io.StringIO(newline="")
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _write_shard(f_path, chunks, header, compression_level, compression_threads):
+    num_rows = 0
+    with codecs.open_output(
+        f_path, level=compression_level, threads=compression_threads
+    ) as f:
+        f.write(header)
+        for text, chunk_rows in utils.iter_queue(chunks):
+            f.write(text)
+            num_rows += chunk_rows
+    return _describe(f_path, num_rows)
+
+
+def _describe(f_path, num_rows):
+    sha256 = hashlib.sha256()
+    with open(f_path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            sha256.update(block)
+    return {
+        "path": f_path.name,
+        "rows": num_rows,
+        "bytes": f_path.stat().st_size,
+        "sha256": sha256.hexdigest(),
+    }
+
+
+def _read_manifest(f_path):
+    return json.loads(manifest_path(f_path).read_text(encoding="utf-8"))
+
+
+def _remove_shards(f_path):
+    if not manifest_path(f_path).exists():
+        return
+    for shard in _read_manifest(f_path)["shards"]:
+        f_path.with_name(shard["path"]).unlink(missing_ok=True)
+
+
+def _write_manifest(f_path, *, headers, shards):
+    manifest = {
+        "headers": headers,
+        "rows": sum(shard["rows"] for shard in shards),
+        "shards": shards,
+    }
+    manifest_path(f_path).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
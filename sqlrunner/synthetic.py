@@ -0,0 +1,283 @@
+"""Generate typed, synthetic dummy data for a query.
+
+The type of each column is inferred from the query: from CASTs and literals, and from
+the schemas of OpenSAFELY tables that we know about (including temporary tables that
+the query builds from them with SELECT INTO). Columns whose types can't be inferred
+are treated as strings.
+
+Values are drawn from a pool of realistic values for each column, which includes
+NULLs at a realistic rate. Rows are generated a batch at a time, column by column, so
+that generating a batch costs a few calls to `random.choices` rather than a call per
+value.
+"""
+
+import datetime
+import decimal
+import itertools
+import random
+import string
+
+from sqlrunner import analysis, utils
+
+
+# The schemas of OpenSAFELY tables that we know about
+SCHEMAS = {
+    "Patient": {
+        "Patient_ID": "BIGINT",
+        "DateOfBirth": "DATE",
+        "DateOfDeath": "DATE",
+        "Sex": "VARCHAR(1)",
+    },
+    "PatientsWithTypeOneDissent": {"Patient_ID": "BIGINT"},
+    "AllowedPatientsWithTypeOneDissent": {"Patient_ID": "BIGINT"},
+    "CodedEvent": {
+        "Patient_ID": "BIGINT",
+        "CodedEvent_ID": "BIGINT",
+        "CTV3Code": "VARCHAR(50)",
+        "ConsultationDate": "DATETIME",
+        "NumericValue": "REAL",
+    },
+    "CodedEvent_SNOMED": {
+        "Patient_ID": "BIGINT",
+        "CodedEvent_ID": "BIGINT",
+        "ConceptID": "VARCHAR(50)",
+        "ConsultationDate": "DATETIME",
+        "NumericValue": "REAL",
+    },
+    "MedicationIssue": {
+        "Patient_ID": "BIGINT",
+        "MedicationIssue_ID": "BIGINT",
+        "MultilexDrug_ID": "VARCHAR(50)",
+        "ConsultationDate": "DATETIME",
+        "Quantity": "VARCHAR(200)",
+    },
+    "Appointment": {
+        "Patient_ID": "BIGINT",
+        "Appointment_ID": "BIGINT",
+        "BookedDate": "DATETIME",
+        "SeenDate": "DATETIME",
+        "Status": "INT",
+    },
+    "APCS": {
+        "Patient_ID": "BIGINT",
+        "APCS_Ident": "BIGINT",
+        "Admission_Date": "DATE",
+        "Discharge_Date": "DATE",
+        "Der_Diagnosis_All": "VARCHAR(1000)",
+    },
+    "ONS_Deaths": {
+        "Patient_ID": "BIGINT",
+        "dod": "DATE",
+        "icd10u": "VARCHAR(10)",
+    },
+}
+
+# The fraction of values that are NULL, in columns that aren't keys or literals
+NULL_RATE = 0.05
+
+# The number of values in each column's pool
+POOL_SIZE = 4096
+
+# Map sqlglot's data types onto the kinds of value that we generate
+_KINDS = {
+    "TINYINT": "int",
+    "SMALLINT": "int",
+    "INT": "int",
+    "BIGINT": "int",
+    "FLOAT": "float",
+    "DOUBLE": "float",
+    "DECIMAL": "decimal",
+    "MONEY": "decimal",
+    "SMALLMONEY": "decimal",
+    "BIT": "bool",
+    "BOOLEAN": "bool",
+    "DATE": "date",
+    "DATETIME": "datetime",
+    "DATETIME2": "datetime",
+    "SMALLDATETIME": "datetime",
+    "TIMESTAMP": "datetime",
+    "CHAR": "str",
+    "NCHAR": "str",
+    "VARCHAR": "str",
+    "NVARCHAR": "str",
+    "TEXT": "str",
+}
+
+_TYPE_CODES = {
+    "int": utils.NUMBER,
+    "float": utils.NUMBER,
+    "bool": utils.NUMBER,
+    "decimal": utils.DECIMAL,
+    "date": utils.DATETIME,
+    "datetime": utils.DATETIME,
+    "str": utils.STRING,
+}
+
+
+def infer_column_types(sql_query):
+    """Return the type of each column in the final SELECT of the query.
+
+    Each type is a dict with a `kind` (for example, "int" or "str"), and, for some
+    kinds, details such as a string's maximum length or a literal's value.
+    """
+    column_types = analysis.load(sql_query, "column_types")
+    if column_types is not None:
+        return column_types
+
+    from sqlglot import exp
+    from sqlglot.optimizer.annotate_types import annotate_types
+    from sqlglot.optimizer.qualify import qualify
+    from sqlglot.schema import MappingSchema
+
+    schema = MappingSchema(SCHEMAS, dialect="tsql")
+    column_types = []
+    for statement in analysis.parse(sql_query):
+        if not isinstance(statement, exp.Select):
+            continue
+        # qualify and annotate_types modify the statement, and the parsed statements
+        # are shared, so we copy it first
+        annotated = annotate_types(
+            qualify(
+                statement.copy(),
+                schema=schema,
+                dialect="tsql",
+                quote_identifiers=False,
+                validate_qualify_columns=False,
+            ),
+            schema=schema,
+        )
+        into = annotated.args.get("into")
+        if into is not None:
+            # Record the schema of the temporary table, so that later statements can
+            # select from it
+            schema.add_table(
+                into.this.sql(dialect="tsql"),
+                {e.alias_or_name: e.type for e in annotated.expressions},
+                dialect="tsql",
+            )
+        column_types = [_column_type(e) for e in annotated.expressions]
+
+    analysis.store(sql_query, "column_types", column_types)
+    return column_types
+
+
+def _column_type(expression):
+    from sqlglot import exp
+
+    value = expression.unalias()
+    if isinstance(value, exp.Null):
+        return {"kind": "null"}
+    if isinstance(value, exp.Literal):
+        if value.is_string:
+            return {"kind": "literal", "value": value.this}
+        if value.this.isdigit():
+            return {"kind": "literal", "value": int(value.this)}
+        # Column types are cached as JSON, which doesn't have decimals
+        return {"kind": "literal", "value": float(value.this)}
+
+    data_type = expression.type
+    kind = _KINDS.get(data_type.this.name, "str") if data_type else "str"
+    params = [p.name for p in data_type.expressions] if data_type else []
+    column_type = {"kind": kind}
+    if kind == "decimal":
+        if len(params) > 1:
+            column_type["scale"] = int(params[1])
+        else:
+            # DECIMAL and DECIMAL(p) have no decimal places; MONEY and SMALLMONEY
+            # have four
+            column_type["scale"] = 0 if data_type.this.name == "DECIMAL" else 4
+    elif kind == "str" and params and params[0].isdigit():
+        column_type["length"] = int(params[0])
+    return column_type
+
+
+def generate(headers, column_types, num_rows, *, batch_size, seed=0):
+    """Yield column headers followed by batches of `num_rows` rows in total.
+
+    The headers are given the type codes that pymssql would have reported for each
+    column, so that columnar output files have the right types.
+    """
+    if len(column_types) != len(headers):
+        # For example, the query selects * from a table whose schema we don't know
+        column_types = [{"kind": "str"}] * len(headers)
+
+    rng = random.Random(seed)
+    generators = [
+        _make_generator(name, column_type, rng)
+        for name, column_type in zip(headers, column_types)
+    ]
+    yield utils.Headers(
+        headers,
+        [_TYPE_CODES.get(t["kind"]) for t in column_types],
+    )
+    for start in range(0, num_rows, batch_size):
+        size = min(batch_size, num_rows - start)
+        yield list(zip(*(make_values(start, size) for make_values in generators)))
+
+
+def _make_generator(name, column_type, rng):
+    """Return a function that generates `size` values of the column, starting at row
+    `start`."""
+    kind = column_type["kind"]
+    if kind == "null":
+        return lambda start, size: itertools.repeat(None, size)
+    if kind == "literal":
+        value = column_type["value"]
+        return lambda start, size: itertools.repeat(value, size)
+    if kind == "int" and (name.lower() == "id" or name.lower().endswith("_id")):
+        # Keys, such as Patient_ID, are unique and not NULL
+        return lambda start, size: range(start + 1, start + size + 1)
+
+    if name.lower() == "sex":
+        pool = rng.choices(["F", "M", "U"], weights=[50, 49, 1], k=POOL_SIZE)
+    else:
+        make_value = _VALUE_MAKERS[kind]
+        pool = [make_value(rng, column_type) for _ in range(POOL_SIZE)]
+    # Replace a fraction of the pool with NULLs
+    for i in rng.sample(range(POOL_SIZE), round(POOL_SIZE * NULL_RATE)):
+        pool[i] = None
+    return lambda start, size: rng.choices(pool, k=size)
+
+
+def _make_int(rng, column_type):
+    # Small values are more common than large values
+    return int(rng.expovariate(1 / 20))
+
+
+def _make_float(rng, column_type):
+    return round(rng.gauss(50, 20), 2)
+
+
+def _make_decimal(rng, column_type):
+    scale = column_type["scale"]
+    return decimal.Decimal(f"{rng.gauss(100, 50):.{scale}f}")
+
+
+def _make_bool(rng, column_type):
+    return int(rng.random() < 0.2)
+
+
+def _make_date(rng, column_type):
+    return datetime.date(1920, 1, 1) + datetime.timedelta(days=rng.randrange(38_000))
+
+
+def _make_datetime(rng, column_type):
+    return datetime.datetime(1920, 1, 1) + datetime.timedelta(
+        seconds=rng.randrange(38_000 * 86_400)
+    )
+
+
+def _make_str(rng, column_type):
+    length = rng.randint(1, min(column_type.get("length", 16), 16))
+    return "".join(rng.choices(string.ascii_uppercase + string.digits, k=length))
+
+
+_VALUE_MAKERS = {
+    "int": _make_int,
+    "float": _make_float,
+    "decimal": _make_decimal,
+    "bool": _make_bool,
+    "date": _make_date,
+    "datetime": _make_datetime,
+    "str": _make_str,
+}
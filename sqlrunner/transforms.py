@@ -0,0 +1,113 @@
+"""Transform results as they stream from the source to the writer.
+
+Outputs that contain counts must go through statistical disclosure control before they
+are released: small counts are redacted, and counts are rounded. Rather than rewrite
+the output file afterwards, the rows are transformed batch by batch, on their way to
+the writer, so the untransformed rows are never written.
+
+A transform is declared as a rule: the kind of rule, the columns that it applies to,
+and its argument. For example:
+
+    --transform redact:count:7        Redact counts at or below 7
+    --transform round:count,total:5   Round counts and totals to the nearest 5
+
+Rules are applied in the order that they are declared. Redacted values are written as
+NULLs, which are empty in a CSV file. Other kinds of rule can be added to `RULES`.
+"""
+
+import decimal
+
+
+def redact(values, threshold):
+    """Redact values at or below the threshold."""
+    return [None if v is not None and v <= threshold else v for v in values]
+
+
+def round_to(values, multiple):
+    """Round values to the nearest multiple, rounding halves away from zero.
+
+    Values keep their types: for example, a rounded float is a float.
+    """
+    return [None if v is None else _round_to(v, multiple) for v in values]
+
+
+def _round_to(value, multiple):
+    # Dividing a Decimal is exact, where dividing a float may not be, so a value half
+    # way between two multiples is always rounded away from zero
+    quotient = decimal.Decimal(value) / multiple
+    rounded = quotient.quantize(1, rounding=decimal.ROUND_HALF_UP) * multiple
+    return type(value)(rounded)
+
+
+# Each kind of rule is a function that takes a column's values in a batch, and the
+# rule's argument, and returns the transformed values
+RULES = {
+    "redact": redact,
+    "round": round_to,
+}
+
+
+def parse_rules(specs):
+    """Parse rules from their declarations, as `kind:column,...:argument`.
+
+    Return a list of (kind, columns, argument) tuples.
+    """
+    rules = []
+    for spec in specs:
+        try:
+            kind, rule_columns, argument = spec.split(":")
+            argument = int(argument)
+        except ValueError:
+            raise RuntimeError(
+                f"Invalid transform {spec!r}: expected kind:column,...:number"
+            ) from None
+        if kind not in RULES:
+            raise RuntimeError(f"Unsupported transform: {kind}")
+        if argument <= 0:
+            raise RuntimeError(
+                f"Invalid transform {spec!r}: expected a positive number"
+            )
+        rules.append((kind, rule_columns.split(","), argument))
+    return rules
+
+
+def columns(rules):
+    """Return the names of the columns that the rules apply to."""
+    return {column for _, rule_columns, _ in rules for column in rule_columns}
+
+
+def apply(results, rules):
+    """Pass through the results, applying the rules to each batch."""
+    headers = next(results, None)
+    if headers is None:
+        return
+    yield headers
+
+    names = list(headers)
+    steps = []
+    for kind, rule_columns, argument in rules:
+        for column in rule_columns:
+            if column not in names:
+                raise RuntimeError(f"The transformed column {column} isn't selected")
+            steps.append((names.index(column), column, RULES[kind], argument))
+
+    for batch in results:
+        # Transforming a column's values at a time, rather than a row's, means that
+        # each rule is a single list comprehension over a batch
+        values = list(zip(*batch))
+        for index, column, rule, argument in steps:
+            values[index] = rule(_to_numbers(column, values[index]), argument)
+        yield list(zip(*values))
+
+
+def _to_numbers(column, values):
+    # The values in a dummy data file are strings, and its NULLs are empty strings
+    if not any(isinstance(v, str) for v in values):
+        return values
+    try:
+        return [
+            (decimal.Decimal(v) if v else None) if isinstance(v, str) else v
+            for v in values
+        ]
+    except decimal.InvalidOperation:
+        raise RuntimeError(f"The transformed column {column} isn't numeric") from None
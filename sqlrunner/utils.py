@@ -1,4 +1,112 @@
+import contextvars
+import datetime
+import json
+import os
+import pathlib
+import queue
+
+
+# How often, in seconds, a thread that is waiting checks whether another thread failed
+POLL_INTERVAL = 0.1
+
+# The type codes that pymssql reports in `cursor.description` (see `Headers`). They
+# are defined here so that we don't have to import pymssql to use them.
+STRING, BINARY, NUMBER, DATETIME, DECIMAL = 1, 2, 3, 4, 5
+
+
 def touch(f_path):
     """Touch the file at the given path, making any parent directories as required."""
     f_path.parent.mkdir(parents=True, exist_ok=True)
     f_path.touch()
+
+
+def key_to_json(value):
+    """Return the value of a key column (see `checkpoints` and `incremental`) as a
+    value that can be written to JSON, and later written as a literal in a query."""
+    if isinstance(value, int | str):
+        return value
+    if isinstance(value, datetime.datetime):
+        # SQL Server reads an ISO 8601 datetime, with a T, the same way whatever the
+        # DATEFORMAT, but its datetime type only accepts three decimal places, which
+        # is all that it records.
+        timespec = "milliseconds" if value.microsecond % 1000 == 0 else "microseconds"
+        return value.isoformat(timespec=timespec)
+    # For example, a date
+    return str(value)
+
+
+def write_json(f_path, value):
+    """Write the value to the file at the given path as JSON.
+
+    We write to a temporary file and then rename it, so that a failure part-way through
+    writing doesn't leave a corrupt file.
+    """
+    tmp_path = f_path.with_name(f"{f_path.name}.tmp")
+    tmp_path.write_text(json.dumps(value), encoding="utf-8")
+    os.replace(tmp_path, f_path)
+
+
+def resolve_paths(args, directory):
+    """Resolve the relative paths in the given args against the given directory."""
+    return {name: _resolve_path(value, directory) for name, value in args.items()}
+
+
+def _resolve_path(value, directory):
+    if isinstance(value, list):
+        # For example, the extra output files
+        return [_resolve_path(v, directory) for v in value]
+    if isinstance(value, pathlib.Path) and not value.is_absolute():
+        return directory / value
+    return value
+
+
+class Headers(tuple):
+    """Column headers.
+
+    As well as the name of each column, records the type code for each column that
+    was reported by the database (see `cursor.description` in PEP 249), or None if
+    the type code isn't known.
+    """
+
+    def __new__(cls, names, type_codes=None):
+        headers = super().__new__(cls, names)
+        if type_codes is None:
+            type_codes = [None] * len(headers)
+        headers.type_codes = tuple(type_codes)
+        return headers
+
+
+def submit(executor, fn, *args):
+    """Submit the function to the executor, to be run in a copy of the current
+    context, so that it sees the same context variables (such as the current run's
+    metrics) as the caller."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+# Put on a queue after the last item (see `iter_queue`)
+DONE = object()
+
+
+def iter_queue(q):
+    """Yield items from the queue until DONE."""
+    while (item := q.get()) is not DONE:
+        yield item
+
+
+def put(q, item, future=None, stop=None):
+    """Put the item on the queue, and return True.
+
+    If the queue's consumer fails, then it stops taking items from the queue. Rather
+    than wait forever for space in the queue: if the consumer is the given future's
+    worker, then we raise the worker's exception; if the consumer sets the given `stop`
+    event, then we return False.
+    """
+    while True:
+        try:
+            q.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            if future is not None and future.done():
+                future.result()
+            if stop is not None and stop.is_set():
+                return False
@@ -39,3 +39,68 @@ def log_output():
 @pytest.fixture(autouse=True)
 def configure_structlog(log_output):
     structlog.configure(processors=[log_output])
+
+
+class FakeCursor:
+    description = [("Patient_ID", 3)]
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def execute(self, sql_query):
+        if not self.conn.healthy:
+            raise ConnectionError("connection dropped")
+        self.conn.queries.append(sql_query)
+        self.rows = [(1,), (2,)]
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows))
+
+
+class FakeConnection:
+    """A connection to a database whose every query returns two rows of Patient_ID.
+
+    The connection records the queries that it runs, and can be dropped by setting
+    `healthy` to False.
+    """
+
+    def __init__(self, dsn=None):
+        self.dsn = dsn
+        self.healthy = True
+        self.queries = []
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        if not self.healthy:
+            raise ConnectionError("connection dropped")
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_connections():
+    return []
+
+
+@pytest.fixture
+def fake_connect(fake_connections):
+    """Return a function that opens a fake connection to the database, and records it
+    in `fake_connections`."""
+
+    def connect(dsn=None):
+        conn = FakeConnection(dsn)
+        fake_connections.append(conn)
+        return conn
+
+    return connect
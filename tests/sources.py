@@ -0,0 +1,55 @@
+from sqlrunner import T1OOS_TABLE, __main__
+
+
+def make_results(num_batches, batch_size, columns=("id", "name"), fetched=None):
+    """Return results with the given columns, of batches of rows numbered from zero.
+
+    The first column holds the row's number, and any others hold the column's name and
+    the row's number. If `fetched` is a list, then the number of each batch is appended
+    to it as the batch is fetched.
+    """
+    yield tuple(columns)
+    for i in range(num_batches):
+        if fetched is not None:
+            fetched.append(i)
+        yield [
+            (j, *(f"{column} {j}" for column in columns[1:]))
+            for j in range(i * batch_size, (i + 1) * batch_size)
+        ]
+
+
+def make_args(tmp_path, *argv, sql_query="SELECT 1 AS id"):
+    """Write the query to an input file, and parse the input file and `argv`."""
+    input_ = tmp_path / "query.sql"
+    input_.write_text(
+        f"-- {T1OOS_TABLE} intentionally not excluded\n{sql_query}", "utf-8"
+    )
+    return __main__.parse_args([str(input_), *argv], {})
+
+
+class Source:
+    """Returns the rows of a table after a given key, and can fail after a given number
+    of batches.
+
+    The table can gain rows, by setting `num_rows`.
+    """
+
+    def __init__(self, num_rows, batch_size=2, fail_after=None):
+        self.num_rows = num_rows
+        self.batch_size = batch_size
+        self.fail_after = fail_after
+        self.calls = []
+
+    def __call__(self, last_key):
+        self.calls.append(last_key)
+        start = 0 if last_key is None else last_key + 1
+        rows = [(i, f"name {i}") for i in range(start, self.num_rows)]
+        yield ("id", "name")
+        for n, i in enumerate(range(0, len(rows), self.batch_size)):
+            if self.fail_after is not None and n == self.fail_after:
+                raise ConnectionError("connection dropped")
+            yield rows[i : i + self.batch_size]
+
+
+def expected_text(num_rows):
+    return "id,name\r\n" + "".join(f"{i},name {i}\r\n" for i in range(num_rows))
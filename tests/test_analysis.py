@@ -0,0 +1,110 @@
+import contextvars
+
+import pytest
+
+from sqlrunner import analysis, main
+
+
+SQL_QUERY = "SELECT a INTO #t FROM t;\nSELECT a AS b FROM #t"
+
+
+@pytest.fixture(autouse=True)
+def reset_analysis():
+    analysis._parse.cache_clear()
+    analysis._derived.clear()
+    yield
+    analysis._parse.cache_clear()
+    analysis._derived.clear()
+
+
+def events(log_output, event):
+    return [e for e in log_output.entries if e["event"] == event]
+
+
+def test_parse_once(log_output):
+    statements = analysis.parse(SQL_QUERY)
+    assert analysis.parse(SQL_QUERY) is statements
+    assert [s.sql(dialect="tsql") for s in statements] == [
+        "SELECT a INTO #t FROM t",
+        "SELECT a AS b FROM #t",
+    ]
+    assert len(events(log_output, "start_parsing_sql_query")) == 1
+
+
+def test_parse_with_cache_dir(tmp_path, log_output):
+    with analysis.cache_dir(tmp_path):
+        statements = analysis.parse(SQL_QUERY)
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # A new run doesn't parse the query, but loads the statements from the cache
+    analysis._parse.cache_clear()
+    with analysis.cache_dir(tmp_path):
+        cached_statements = analysis.parse(SQL_QUERY)
+    assert cached_statements == statements
+    assert len(events(log_output, "start_parsing_sql_query")) == 1
+    assert len(events(log_output, "parse_cache_hit")) == 1
+
+
+def test_query_key():
+    assert analysis.query_key(SQL_QUERY) == analysis.query_key(SQL_QUERY)
+    assert analysis.query_key(SQL_QUERY) != analysis.query_key(SQL_QUERY + " ")
+
+
+def test_load_and_store(tmp_path):
+    assert analysis.load(SQL_QUERY, "headers") is None
+    analysis.store(SQL_QUERY, "headers", ["b"])
+    assert analysis.load(SQL_QUERY, "headers") == ["b"]
+
+    with analysis.cache_dir(tmp_path):
+        analysis.store(SQL_QUERY, "headers", ["b"])
+        analysis._derived.clear()
+        assert analysis.load(SQL_QUERY, "headers") == ["b"]
+        assert analysis.load(SQL_QUERY, "other") is None
+
+
+def test_load_and_store_least_recently_used(monkeypatch):
+    monkeypatch.setattr(analysis, "DERIVED_SIZE", 2)
+    analysis.store(SQL_QUERY, "a", 1)
+    analysis.store(SQL_QUERY, "b", 2)
+    assert analysis.load(SQL_QUERY, "a") == 1
+    analysis.store(SQL_QUERY, "c", 3)
+
+    # "b" was the least recently used, and there's no cache directory to load it from
+    assert analysis.load(SQL_QUERY, "b") is None
+    assert analysis.load(SQL_QUERY, "a") == 1
+    assert analysis.load(SQL_QUERY, "c") == 3
+
+
+def test_cache_dir_is_per_context(tmp_path):
+    # For example, concurrent runs in the daemon's threads
+    with analysis.cache_dir(tmp_path):
+        context = contextvars.copy_context()
+    with analysis.cache_dir(None):
+        context.run(analysis.parse, SQL_QUERY)
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_get_column_headers_with_cache_dir(tmp_path, log_output):
+    with analysis.cache_dir(tmp_path):
+        assert main.get_column_headers(SQL_QUERY) == ["b"]
+
+    # A new run doesn't parse the query, or even load the statements
+    analysis._parse.cache_clear()
+    analysis._derived.clear()
+    with analysis.cache_dir(tmp_path):
+        assert main.get_column_headers(SQL_QUERY) == ["b"]
+    assert len(events(log_output, "start_parsing_sql_query")) == 1
+    assert events(log_output, "parse_cache_hit") == [
+        {
+            "event": "parse_cache_hit",
+            "key": analysis.query_key(SQL_QUERY),
+            "name": "headers",
+            "log_level": "info",
+        }
+    ]
+
+
+def test_evict(tmp_path):
+    with analysis.cache_dir(tmp_path, max_bytes=0):
+        analysis.parse(SQL_QUERY)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from sqlrunner import cache
+
+
+@pytest.mark.parametrize(
+    "sql_query",
+    [
+        "SELECT a FROM t",
+        "select a\n  from t",
+        "-- a comment\nSELECT a FROM t -- another comment",
+        "SELECT a /* a block comment */ FROM t",
+    ],
+)
+def test_normalize_query(sql_query):
+    assert cache.normalize_query(sql_query) == "SELECT a FROM t"
+
+
+def test_normalize_query_that_cant_be_parsed():
+    assert cache.normalize_query("SELECT (a\n  FROM t") == "SELECT (a FROM t"
+
+
+def test_make_key():
+    key = cache.make_key("SELECT a FROM t", "host:1433/db", "2024-01-01", ".csv.gz")
+    assert key == cache.make_key(
+        "select a from t -- comment", "host:1433/db", "2024-01-01", ".csv.gz"
+    )
+    assert key != cache.make_key(
+        "SELECT b FROM t", "host:1433/db", "2024-01-01", ".csv.gz"
+    )
+    assert key != cache.make_key(
+        "SELECT a FROM t", "host:1433/db2", "2024-01-01", ".csv.gz"
+    )
+    assert key != cache.make_key(
+        "SELECT a FROM t", "host:1433/db", "2024-01-02", ".csv.gz"
+    )
+    assert key != cache.make_key(
+        "SELECT a FROM t", "host:1433/db", "2024-01-01", ".csv"
+    )
+
+
+def test_get_and_put(tmp_path, log_output):
+    result_cache = cache.ResultCache(tmp_path / "cache")
+    output = tmp_path / "output.csv"
+    output.write_text("id\n1\n")
+
+    copy = tmp_path / "subdir" / "copy.csv"
+    assert not result_cache.get("key", copy)
+    result_cache.put("key", output)
+    assert result_cache.get("key", copy)
+    assert copy.read_text() == "id\n1\n"
+
+    assert [entry["event"] for entry in log_output.entries] == [
+        "cache_miss",
+        "cache_put",
+        "cache_hit",
+    ]
+
+
+def test_evict_least_recently_used(tmp_path):
+    result_cache = cache.ResultCache(tmp_path / "cache", max_bytes=10)
+    output = tmp_path / "output.csv"
+    output.write_bytes(b"12345")
+
+    result_cache.put("a", output)
+    result_cache.put("b", output)
+    # Make "a" the least recently used, and then use it
+    os.utime(tmp_path / "cache" / "a", (0, 0))
+    os.utime(tmp_path / "cache" / "b", (1, 1))
+    assert result_cache.get("a", tmp_path / "copy.csv")
+
+    result_cache.put("c", output)
+
+    assert sorted(p.name for p in (tmp_path / "cache").iterdir()) == ["a", "c"]
@@ -0,0 +1,253 @@
+import datetime
+import json
+
+import pytest
+
+from sqlrunner import OLD_T1OOS_TABLE, __main__, checkpoints, codecs, main
+
+from .sources import Source, expected_text
+
+
+def test_checkpoint_path(tmp_path):
+    assert (
+        checkpoints.checkpoint_path(tmp_path / "results.csv.gz")
+        == tmp_path / "results.csv.gz.checkpoint.json"
+    )
+
+
+@pytest.mark.parametrize(
+    "last_key,predicate",
+    [
+        (None, ""),
+        (10, "WHERE Patient_ID > 10 "),
+        ("abc", "WHERE Patient_ID > 'abc' "),
+    ],
+)
+def test_keyset_query(last_key, predicate):
+    sql_query = (
+        f"-- {OLD_T1OOS_TABLE} intentionally not excluded\n"
+        "SELECT Patient_ID FROM Patient ORDER BY Sex"
+    )
+    query = checkpoints.keyset_query(sql_query, "Patient_ID", last_key)
+    assert query.splitlines() == [
+        f"-- {OLD_T1OOS_TABLE} intentionally not excluded",
+        f"SELECT Patient_ID FROM Patient {predicate}ORDER BY Patient_ID",
+    ]
+    assert main.are_t1oos_handled(query)
+
+
+def test_keyset_query_with_existing_predicate():
+    query = checkpoints.keyset_query(
+        "SELECT p.Patient_ID FROM Patient p WHERE p.Sex = 'F'", "p.Patient_ID", 10
+    )
+    assert query == (
+        "SELECT p.Patient_ID FROM Patient AS p "
+        "WHERE p.Sex = 'F' AND p.Patient_ID > 10 ORDER BY p.Patient_ID"
+    )
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".csv.gz"])
+def test_write_results_resumes_after_failure(tmp_path, suffix):
+    f_path = tmp_path / f"results{suffix}"
+    kwargs = {"column": "id", "fingerprint": "abc", "every_rows": 3}
+
+    source = Source(10, 2, fail_after=3)
+    with pytest.raises(ConnectionError):
+        checkpoints.write_results(source, f_path, **kwargs)
+
+    # Two batches of two rows were written before the checkpoint, and one after
+    checkpoint = json.loads(checkpoints.checkpoint_path(f_path).read_text())
+    assert checkpoint["last_key"] == 3
+    assert checkpoint["rows"] == 4
+
+    source = Source(10, 2)
+    checkpoints.write_results(source, f_path, **kwargs)
+
+    assert source.calls == [3]
+    with codecs.open_input(f_path) as f:
+        assert f.read() == expected_text(10)
+    assert not checkpoints.checkpoint_path(f_path).exists()
+
+
+def test_write_results_checkpoints_by_time(tmp_path, log_output):
+    f_path = tmp_path / "results.csv"
+    checkpoints.write_results(
+        Source(4, 2), f_path, column="id", fingerprint="abc", every_seconds=0
+    )
+
+    events = [e for e in log_output.entries if e["event"] == "write_checkpoint"]
+    assert [e["last_key"] for e in events] == [1, 3]
+    assert f_path.read_text() == expected_text(4).replace("\r\n", "\n")
+
+
+def test_write_results_ignores_checkpoint_for_another_query(tmp_path):
+    f_path = tmp_path / "results.csv"
+    with pytest.raises(ConnectionError):
+        checkpoints.write_results(
+            Source(10, 2, fail_after=2),
+            f_path,
+            column="id",
+            fingerprint="abc",
+            every_rows=1,
+        )
+
+    source = Source(10, 2)
+    checkpoints.write_results(source, f_path, column="id", fingerprint="def")
+
+    assert source.calls == [None]
+    assert f_path.read_bytes() == expected_text(10).encode()
+
+
+def test_write_results_ignores_checkpoint_for_truncated_output(tmp_path):
+    f_path = tmp_path / "results.csv"
+    with pytest.raises(ConnectionError):
+        checkpoints.write_results(
+            Source(10, 2, fail_after=2),
+            f_path,
+            column="id",
+            fingerprint="abc",
+            every_rows=1,
+        )
+    f_path.write_bytes(b"")
+
+    source = Source(10, 2)
+    checkpoints.write_results(source, f_path, column="id", fingerprint="abc")
+
+    assert source.calls == [None]
+    assert f_path.read_bytes() == expected_text(10).encode()
+
+
+def test_write_results_removes_checkpoint_without_results(tmp_path):
+    f_path = tmp_path / "results.csv"
+    with pytest.raises(ConnectionError):
+        checkpoints.write_results(
+            Source(10, 2, fail_after=2),
+            f_path,
+            column="id",
+            fingerprint="abc",
+            every_rows=1,
+        )
+
+    # For example, the query now returns no result set
+    checkpoints.write_results(
+        lambda last_key: iter([]), f_path, column="id", fingerprint="abc"
+    )
+    assert not checkpoints.checkpoint_path(f_path).exists()
+
+
+def test_write_results_with_non_integer_key(tmp_path):
+    def get_results(last_key):
+        yield ("name",)
+        yield [("a",), ("b",)]
+
+    f_path = tmp_path / "results.csv"
+    checkpoints.write_results(
+        get_results, f_path, column="name", fingerprint="abc", every_rows=1
+    )
+    assert f_path.read_text() == "name\na\nb\n"
+
+
+def test_write_results_with_date_key(tmp_path, log_output):
+    def get_results(last_key):
+        yield ("date",)
+        yield [(datetime.date(2020, 1, 1),)]
+
+    checkpoints.write_results(
+        get_results,
+        tmp_path / "results.csv",
+        column="date",
+        fingerprint="abc",
+        every_rows=1,
+    )
+    events = [e for e in log_output.entries if e["event"] == "write_checkpoint"]
+    assert events[0]["last_key"] == "2020-01-01"
+
+
+@pytest.mark.parametrize(
+    "key,last_key",
+    [
+        (datetime.datetime(2020, 1, 2, 3, 4, 5), "2020-01-02T03:04:05.000"),
+        (datetime.datetime(2020, 1, 2, 3, 4, 5, 7000), "2020-01-02T03:04:05.007"),
+        # For example, from a datetime2 column
+        (datetime.datetime(2020, 1, 2, 3, 4, 5, 7), "2020-01-02T03:04:05.000007"),
+    ],
+)
+def test_write_results_with_datetime_key(tmp_path, key, last_key):
+    calls = []
+
+    def get_results(last_key):
+        calls.append(last_key)
+        yield ("datetime",)
+        yield [(key,)]
+        raise ConnectionError("connection dropped")
+
+    f_path = tmp_path / "results.csv"
+    kwargs = {"column": "datetime", "fingerprint": "abc", "every_rows": 1}
+    with pytest.raises(ConnectionError):
+        checkpoints.write_results(get_results, f_path, **kwargs)
+    with pytest.raises(ConnectionError):
+        checkpoints.write_results(get_results, f_path, **kwargs)
+
+    assert calls == [None, last_key]
+    assert checkpoints.keyset_query("SELECT datetime FROM t", "datetime", last_key) == (
+        f"SELECT datetime FROM t WHERE datetime > '{last_key}' ORDER BY datetime"
+    )
+
+
+@pytest.mark.parametrize("results", [[], [("id",)]])
+def test_write_zero_results(tmp_path, results):
+    f_path = tmp_path / "subdir" / "results.csv"
+    checkpoints.write_results(
+        lambda last_key: iter(results), f_path, column="id", fingerprint="abc"
+    )
+    assert f_path.read_bytes() == b""
+
+
+def test_write_results_without_ordering_column(tmp_path):
+    with pytest.raises(RuntimeError, match="ordering column id isn't selected"):
+        checkpoints.write_results(
+            lambda last_key: iter([("name",)]),
+            tmp_path / "results.csv",
+            column="t.id",
+            fingerprint="abc",
+        )
+
+
+@pytest.mark.parametrize("name", [None, "results.parquet"])
+def test_write_results_to_unresumable_output(tmp_path, name):
+    f_path = None if name is None else tmp_path / name
+    with pytest.raises(RuntimeError, match="Only CSV output files can be resumed"):
+        checkpoints.write_results(Source(1, 1), f_path, column="id", fingerprint="a")
+
+
+@pytest.mark.parametrize(
+    "output,argv,match",
+    [
+        ("results-{n}.csv", [], "single output file"),
+        ("results.parquet", [], "Only CSV output files"),
+        ("results.csv", ["--shard-rows", "10"], "written to shards"),
+        ("results.csv", ["--shard-bytes", "10"], "written to shards"),
+        ("results.csv", ["--partition-column", "id"], "partitioned or extracted"),
+        ("results.csv", ["--watermark-column", "id"], "partitioned or extracted"),
+        ("results.csv", ["--pipeline"], "written by a pipeline"),
+    ],
+)
+def test_main_with_resume_column_and_invalid_args(tmp_path, output, argv, match):
+    (tmp_path / "query.sql").write_text(
+        f"-- {OLD_T1OOS_TABLE} intentionally not excluded\nSELECT 1 AS id", "utf-8"
+    )
+    args = __main__.parse_args(
+        [
+            str(tmp_path / "query.sql"),
+            "--dsn",
+            f"sqlite:///{tmp_path / 'database.sqlite'}",
+            "--output",
+            str(tmp_path / output),
+            "--resume-column",
+            "id",
+            *argv,
+        ],
+        {},
+    )
+    with pytest.raises(RuntimeError, match=match):
+        main.main(args)
@@ -0,0 +1,130 @@
+import gzip
+
+import pytest
+
+from sqlrunner import codecs
+
+
+def require(codec_suffix):
+    if codec_suffix == ".csv.zst":
+        pytest.importorskip("compression.zstd")
+
+
+@pytest.mark.parametrize("suffix", list(codecs.CODECS))
+@pytest.mark.parametrize("level", [None, 1])
+@pytest.mark.parametrize("threads", [1, 2])
+def test_round_trip(tmp_path, suffix, level, threads):
+    require(suffix)
+    f_path = tmp_path / f"results{suffix}"
+    text = "id,name\r\n" + "".join(f"{i},name {i}\r\n" for i in range(10_000))
+
+    with codecs.open_output(f_path, level=level, threads=threads) as f:
+        f.write(text)
+    with codecs.open_input(f_path) as f:
+        assert f.read() == text
+
+
+@pytest.mark.parametrize("suffix", list(codecs.CODECS))
+@pytest.mark.parametrize("threads", [1, 2])
+def test_append(tmp_path, suffix, threads):
+    require(suffix)
+    f_path = tmp_path / f"results{suffix}"
+
+    with codecs.open_output(f_path, threads=threads) as f:
+        f.write("id\r\n1\r\n")
+    with codecs.open_output(f_path, threads=threads, append=True) as f:
+        f.write("2\r\n")
+    with codecs.open_input(f_path) as f:
+        assert f.read() == "id\r\n1\r\n2\r\n"
+
+
+@pytest.mark.parametrize("src_suffix", list(codecs.CODECS))
+@pytest.mark.parametrize("dst_suffix", [".csv", ".csv.gz"])
+def test_copy(tmp_path, src_suffix, dst_suffix):
+    require(src_suffix)
+    src_path = tmp_path / f"src{src_suffix}"
+    dst_path = tmp_path / f"dst{dst_suffix}"
+    text = "id\r\n" + "".join(f"{i}\r\n" for i in range(10_000))
+    with codecs.open_output(src_path) as f:
+        f.write(text)
+
+    codecs.copy(src_path, dst_path, level=1)
+
+    if src_suffix == dst_suffix:
+        assert dst_path.read_bytes() == src_path.read_bytes()
+    with codecs.open_input(dst_path) as f:
+        assert f.read() == text
+
+
+@pytest.mark.parametrize(
+    "name,codec_class",
+    [
+        ("results.csv", codecs.Uncompressed),
+        ("results.csv.gz", codecs.Gzip),
+        ("my.results.csv.gz", codecs.Gzip),
+        ("results.csv.zst", codecs.Zstd),
+        ("results.csv.lz4", codecs.Lz4),
+        ("results.txt", codecs.Uncompressed),
+        ("results", codecs.Uncompressed),
+    ],
+)
+def test_get_codec(tmp_path, name, codec_class):
+    assert isinstance(codecs.get_codec(tmp_path / name), codec_class)
+
+
+def test_open_output_to_stdout(capsys):
+    with codecs.open_output(None) as f:
+        f.write("id\r\n")
+    out, _ = capsys.readouterr()
+    assert out == "id\r\n"
+
+
+def test_gzip_compression_level(tmp_path):
+    text = "".join(f"{i},name {i}\r\n" for i in range(10_000))
+    sizes = []
+    for level in [0, 9]:
+        f_path = tmp_path / f"results_{level}.csv.gz"
+        with codecs.open_output(f_path, level=level) as f:
+            f.write(text)
+        sizes.append(f_path.stat().st_size)
+    assert sizes[0] > sizes[1]
+
+
+@pytest.mark.parametrize("size", [0, 1, codecs.ParallelGzipFile.BLOCK_SIZE * 5 + 1])
+@pytest.mark.parametrize("threads", [0, 2, 4])
+def test_parallel_gzip_file(tmp_path, size, threads):
+    # Incompressible-ish, but repetitive enough to test the dictionary
+    data = bytes(i * 7 % 251 for i in range(size))
+    f_path = tmp_path / "results.csv.gz"
+
+    with codecs.ParallelGzipFile(f_path, level=6, threads=threads or 1) as f:
+        # Write in chunks that don't line up with blocks
+        for i in range(0, size, 10_000):
+            f.write(data[i : i + 10_000])
+
+    assert gzip.decompress(f_path.read_bytes()) == data
+
+
+def test_parallel_gzip_file_compresses_like_gzip(tmp_path):
+    data = "".join(f"{i},name {i}\r\n" for i in range(100_000)).encode()
+    f_path = tmp_path / "results.csv.gz"
+
+    with codecs.ParallelGzipFile(f_path, level=6, threads=4) as f:
+        f.write(data)
+
+    # Priming each block with the end of the previous block keeps the compression
+    # ratio close to that of a single thread
+    assert f_path.stat().st_size < len(gzip.compress(data, 6)) * 1.05
+
+
+def test_parallel_gzip_file_is_closed_once(tmp_path):
+    f = codecs.ParallelGzipFile(tmp_path / "results.csv.gz", level=6, threads=2)
+    f.close()
+    f.close()
+    with pytest.raises(ValueError, match="closed file"):
+        f.write(b"data")
+
+
+def test_codec_is_abstract(tmp_path):
+    with pytest.raises(NotImplementedError):
+        codecs.Codec().open(tmp_path / "results", "wb")
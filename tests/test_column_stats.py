@@ -0,0 +1,154 @@
+import datetime
+import decimal
+import gzip
+import hashlib
+import json
+
+import pytest
+
+from sqlrunner import T1OOS_TABLE, __main__, column_stats, main, utils
+
+
+def read_stats(f_path):
+    return json.loads(column_stats.stats_path(f_path).read_text("utf-8"))
+
+
+def test_stats_path(tmp_path):
+    f_path = tmp_path / "results.csv.gz"
+    assert column_stats.stats_path(f_path) == tmp_path / "results.csv.gz.stats.json"
+
+
+def test_track(tmp_path):
+    f_path = tmp_path / "results.csv"
+    headers = utils.Headers(
+        ["id", "date", "value", "data"],
+        [utils.NUMBER, utils.DATETIME, utils.DECIMAL, utils.BINARY],
+    )
+    batches = [
+        [
+            (2, datetime.date(2020, 2, 1), decimal.Decimal("1E-7"), b"\x01"),
+            (1, None, None, None),
+        ],
+        [(3, datetime.date(2020, 1, 1), decimal.Decimal("0.5"), b"\xff")],
+    ]
+    results = column_stats.track(iter([headers, *batches]), f_path)
+    # The results pass through unchanged
+    assert list(results) == [headers, *batches]
+
+    stats = read_stats(f_path)
+    assert stats["rows"] == 3
+    assert stats["columns"] == [
+        {"name": "id", "nulls": 0, "min": 1, "max": 3, "distinct": 3},
+        {
+            "name": "date",
+            "nulls": 1,
+            "min": "2020-01-01",
+            "max": "2020-02-01",
+            "distinct": 2,
+        },
+        {
+            "name": "value",
+            "nulls": 1,
+            "min": "0.0000001",
+            "max": "0.5",
+            "distinct": 2,
+        },
+        {"name": "data", "nulls": 1, "min": "0x01", "max": "0xFF", "distinct": 2},
+    ]
+
+
+def test_track_with_incomparable_values(tmp_path):
+    f_path = tmp_path / "results.csv"
+    batches = [[(1,)], [("a",)], [(None,)], [(2,)]]
+    list(column_stats.track(iter([["value"], *batches]), f_path))
+    (column,) = read_stats(f_path)["columns"]
+    assert column == {
+        "name": "value",
+        "nulls": 1,
+        "min": None,
+        "max": None,
+        "distinct": 3,
+    }
+
+
+def test_track_with_dummy_data_strings(tmp_path):
+    # The values in a dummy data file are strings, and its NULLs are empty strings
+    f_path = tmp_path / "results.csv"
+    batches = [[("9", "b"), ("10", "")], [("", "a"), ("1.5", "a")]]
+    list(column_stats.track(iter([["value", "name"], *batches]), f_path))
+    assert read_stats(f_path)["columns"] == [
+        {"name": "value", "nulls": 1, "min": "1.5", "max": 10, "distinct": 3},
+        {"name": "name", "nulls": 1, "min": "a", "max": "b", "distinct": 2},
+    ]
+
+
+@pytest.mark.parametrize("results", [[], [["id"]]])
+def test_track_without_rows(tmp_path, results):
+    f_path = tmp_path / "results.csv"
+    list(column_stats.track(iter(results), f_path))
+    stats = read_stats(f_path)
+    assert stats["rows"] == 0
+    assert stats["checksum"] == f"sha256:{hashlib.sha256().hexdigest()}"
+
+
+@pytest.mark.parametrize("num_values", [10, 1_000, 100_000])
+def test_hyperloglog(num_values):
+    sketch = column_stats.HyperLogLog()
+    sketch.update(range(num_values))
+    # Duplicates don't change the estimate
+    sketch.update(range(num_values))
+    # The standard error is about 1.6%
+    assert sketch.estimate() == pytest.approx(num_values, rel=0.05)
+
+
+def test_main_with_column_stats(tmp_path):
+    dummy_data_file = tmp_path / "dummy_data.csv"
+    dummy_data_file.write_text("id,name\n2,b\n1,a\n1,a\n", "utf-8")
+    output = tmp_path / "results.csv.gz"
+    args = __main__.parse_args(
+        [
+            str(tmp_path / "query.sql"),
+            "--dummy-data-file",
+            str(dummy_data_file),
+            "--output",
+            str(output),
+            "--column-stats",
+        ],
+        {},
+    )
+    args["input"].write_text(
+        f"-- {T1OOS_TABLE} intentionally not excluded\nSELECT 1 AS id", "utf-8"
+    )
+    main.main(args)
+
+    stats = read_stats(output)
+    assert stats["rows"] == 3
+    # The checksum is of the uncompressed output file
+    assert stats["checksum"] == (
+        f"sha256:{hashlib.sha256(gzip.decompress(output.read_bytes())).hexdigest()}"
+    )
+    assert stats["columns"] == [
+        {"name": "id", "nulls": 0, "min": 1, "max": 2, "distinct": 2},
+        {"name": "name", "nulls": 0, "min": "a", "max": "b", "distinct": 2},
+    ]
+
+
+@pytest.mark.parametrize(
+    "argv,match",
+    [
+        ([], "next to the output file"),
+        (
+            ["--output", "results.csv", "--dsn", "sqlite:///db", "--resume-column=id"],
+            "resumed run",
+        ),
+    ],
+)
+def test_main_with_column_stats_and_invalid_args(tmp_path, argv, match):
+    args = __main__.parse_args(
+        [str(tmp_path / "query.sql"), "--column-stats", *argv], {}
+    )
+    args["input"].write_text(
+        f"-- {T1OOS_TABLE} intentionally not excluded\nSELECT 1 AS id", "utf-8"
+    )
+    with pytest.raises(RuntimeError, match=match):
+        main.main(args)
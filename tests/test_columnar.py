@@ -0,0 +1,194 @@
+import datetime
+import decimal
+
+import pyarrow
+import pytest
+
+from sqlrunner import columnar, utils
+
+
+def read_table(f_path):
+    if f_path.suffix == ".parquet":
+        from pyarrow import parquet
+
+        return parquet.read_table(f_path)
+    with pyarrow.ipc.open_file(f_path) as f:
+        return f.read_all()
+
+
+@pytest.fixture(params=[".parquet", ".arrow"])
+def suffix(request):
+    return request.param
+
+
+def make_results():
+    yield utils.Headers(["id", "name", "dob", "value", "data"], [3, 1, 4, 5, 2])
+    yield [
+        (1, "a", datetime.datetime(2020, 1, 1), decimal.Decimal("1.5"), b"\x00"),
+        (2, None, None, None, None),
+    ]
+    yield [(3, "c", datetime.datetime(2020, 1, 3), decimal.Decimal("3.5"), b"\x01")]
+
+
+@pytest.mark.parametrize("row_group_size", [1, 2, 100])
+def test_write_results(tmp_path, suffix, row_group_size):
+    f_path = tmp_path / "subdir" / f"results{suffix}"
+    columnar.write_results(make_results(), f_path, row_group_size=row_group_size)
+
+    table = read_table(f_path)
+    assert table.column_names == ["id", "name", "dob", "value", "data"]
+    assert table.schema.field("id").type == pyarrow.int64()
+    assert table.schema.field("dob").type == pyarrow.timestamp("us")
+    assert table.column("id").to_pylist() == [1, 2, 3]
+    assert table.column("name").to_pylist() == ["a", None, "c"]
+
+
+def test_write_results_in_row_groups(tmp_path):
+    from pyarrow import parquet
+
+    f_path = tmp_path / "results.parquet"
+    columnar.write_results(make_results(), f_path, row_group_size=2)
+
+    assert parquet.ParquetFile(f_path).metadata.num_row_groups == 2
+
+
+@pytest.mark.parametrize("compression", ["none", "lz4", "zstd"])
+def test_write_results_with_compression(tmp_path, suffix, compression):
+    f_path = tmp_path / f"results{suffix}"
+    columnar.write_results(make_results(), f_path, compression=compression)
+    assert read_table(f_path).num_rows == 3
+
+
+def test_write_results_infers_types_from_type_codes(tmp_path, suffix):
+    # When the values in the first row group are all NULL, the type comes from the
+    # type code that was reported by the database
+    results = iter(
+        [
+            utils.Headers(["a", "b", "c", "d", "e", "f"], [1, 2, 3, 4, 5, None]),
+            [(None, None, None, None, None, None)],
+            [("a", b"b", 1, datetime.datetime(2020, 1, 1), decimal.Decimal(1), "f")],
+        ]
+    )
+    f_path = tmp_path / f"results{suffix}"
+    columnar.write_results(results, f_path, row_group_size=1)
+
+    assert read_table(f_path).schema.types == [
+        pyarrow.string(),
+        pyarrow.binary(),
+        pyarrow.float64(),
+        pyarrow.timestamp("us"),
+        pyarrow.decimal128(38, 18),
+        pyarrow.string(),
+    ]
+
+
+def test_write_results_widens_decimals(tmp_path, suffix):
+    results = iter(
+        [
+            utils.Headers(["a"], [utils.DECIMAL]),
+            [(decimal.Decimal("1.25"),)],
+            [(decimal.Decimal("123456789.5"),)],
+        ]
+    )
+    f_path = tmp_path / f"results{suffix}"
+    columnar.write_results(results, f_path, row_group_size=1)
+
+    table = read_table(f_path)
+    assert table.schema.types == [pyarrow.decimal128(38, 2)]
+    assert table.column("a").to_pylist() == [
+        decimal.Decimal("1.25"),
+        decimal.Decimal("123456789.50"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        [1, 1.5],
+        [1, "a"],
+        [decimal.Decimal("1.25"), decimal.Decimal("1.125")],
+    ],
+)
+def test_write_results_with_values_that_dont_fit(tmp_path, suffix, values):
+    # Values in later row groups that don't fit the inferred type aren't truncated
+    results = iter([utils.Headers(["a"], [utils.NUMBER]), *([(v,)] for v in values)])
+    f_path = tmp_path / f"results{suffix}"
+    with pytest.raises(RuntimeError, match="values of column a don't fit its type"):
+        columnar.write_results(results, f_path, row_group_size=1)
+
+
+def test_write_results_with_whole_floats_in_integers(tmp_path, suffix):
+    results = iter([utils.Headers(["a"], [utils.NUMBER]), [(1,)], [(2.0,)]])
+    f_path = tmp_path / f"results{suffix}"
+    columnar.write_results(results, f_path, row_group_size=1)
+    assert read_table(f_path).column("a").to_pylist() == [1, 2]
+
+
+@pytest.mark.parametrize("headers", [["id"], utils.Headers(["id"])])
+def test_write_results_with_dummy_data(tmp_path, suffix, headers):
+    # Headers without type codes, as from a dummy data file
+    f_path = tmp_path / f"results{suffix}"
+    columnar.write_results(iter([headers, (["1"], ["2"])]), f_path)
+
+    table = read_table(f_path)
+    assert table.schema.types == [pyarrow.string()]
+    assert table.column("id").to_pylist() == ["1", "2"]
+
+
+def test_write_zero_rows(tmp_path, suffix):
+    # The file still has a schema
+    f_path = tmp_path / f"results{suffix}"
+    columnar.write_results(iter([utils.Headers(["id"], [3])]), f_path)
+
+    table = read_table(f_path)
+    assert table.num_rows == 0
+    assert table.schema.field("id").type == pyarrow.float64()
+
+
+def test_write_results_with_error_before_first_row_group(tmp_path, suffix):
+    def results():
+        yield utils.Headers(["id"], [3])
+        raise ConnectionError("connection dropped")
+
+    f_path = tmp_path / f"results{suffix}"
+    with pytest.raises(ConnectionError):
+        columnar.write_results(results(), f_path)
+    # The file was touched, but never opened for writing
+    assert f_path.read_bytes() == b""
+
+
+def test_write_zero_results(tmp_path, suffix):
+    f_path = tmp_path / f"results{suffix}"
+    columnar.write_results(iter([]), f_path)
+    assert f_path.read_bytes() == b""
+
+
+def test_write_results_logs(tmp_path, log_output):
+    columnar.write_results(make_results(), tmp_path / "results.parquet")
+    assert log_output.entries == [
+        {"event": "start_writing_results", "log_level": "info"},
+        {"event": "finish_writing_results", "log_level": "info"},
+    ]
+
+
+@pytest.mark.parametrize(
+    "name,format_class",
+    [
+        ("results.parquet", columnar.Parquet),
+        ("results.arrow", columnar.ArrowIPC),
+        ("results.csv", type(None)),
+    ],
+)
+def test_get_format(tmp_path, name, format_class):
+    assert isinstance(columnar.get_format(tmp_path / name), format_class)
+
+
+def test_get_format_without_path():
+    assert columnar.get_format(None) is None
+
+
+def test_format_is_abstract(tmp_path):
+    with pytest.raises(NotImplementedError):
+        columnar.Format().open(
+            tmp_path / "results", None, compression=None, compression_level=None
+        )
@@ -0,0 +1,126 @@
+import gzip
+import threading
+import time
+
+import pytest
+
+from sqlrunner import fanout, main
+
+from .sources import make_args, make_results
+
+
+def test_write_results(tmp_path):
+    expected = tmp_path / "expected.csv"
+    main.write_results(make_results(5, 10), expected)
+
+    f_paths = [tmp_path / "results.csv", tmp_path / "results.csv.gz"]
+    fanout.write_results(make_results(5, 10), f_paths, main.write_results)
+
+    assert f_paths[0].read_bytes() == expected.read_bytes()
+    assert gzip.decompress(f_paths[1].read_bytes()) == expected.read_bytes()
+
+
+def test_write_results_with_backpressure():
+    fetched = []
+    written = []
+    release = threading.Event()
+
+    def write(results, f_path):
+        for item in results:
+            if f_path == "slow":
+                release.wait()
+            written.append((f_path, item))
+
+    thread = threading.Thread(
+        target=fanout.write_results,
+        args=(make_results(100, 1, fetched=fetched), ["fast", "slow"], write),
+        kwargs={"queue_size": 2},
+    )
+    thread.start()
+    time.sleep(0.2)
+    # The slow worker has taken the column headers, and its queue is full, so
+    # fetching waits for it
+    assert len(fetched) <= 4
+    release.set()
+    thread.join()
+
+    assert len(fetched) == 100
+    assert len([f_path for f_path, _ in written if f_path == "slow"]) == 101
+
+
+@pytest.mark.parametrize("queue_size", [1, fanout.QUEUE_SIZE])
+def test_write_results_when_writing_fails(tmp_path, queue_size):
+    def write(results, f_path):
+        if f_path.suffix == ".fail":
+            next(results)
+            raise ValueError("disk full")
+        main.write_results(results, f_path)
+
+    f_paths = [tmp_path / "results.csv", tmp_path / "results.fail"]
+    with pytest.raises(ValueError, match="disk full"):
+        fanout.write_results(make_results(20, 1), f_paths, write, queue_size=queue_size)
+    # The other worker isn't left waiting
+    assert f_paths[0].exists()
+
+
+def test_write_results_when_fetching_fails(tmp_path):
+    def results():
+        yield from make_results(2, 1)
+        raise ConnectionError("connection dropped")
+
+    f_paths = [tmp_path / "results.csv", tmp_path / "results.csv.gz"]
+    with pytest.raises(ConnectionError):
+        fanout.write_results(results(), f_paths, main.write_results)
+
+
+def test_parse_args_with_several_outputs(tmp_path):
+    args = make_args(tmp_path, "--output", "a.csv", "--output", "a.csv.gz")
+    assert str(args["output"]) == "a.csv"
+    assert [str(f_path) for f_path in args["extra_outputs"]] == ["a.csv.gz"]
+
+
+def test_main_with_several_outputs(tmp_path):
+    dummy_data_file = tmp_path / "dummy_data.csv"
+    dummy_data_file.write_text("id,name\n1,a\n2,b\n", "utf-8")
+    args = make_args(
+        tmp_path,
+        "--dummy-data-file",
+        str(dummy_data_file),
+        "--output",
+        str(tmp_path / "results.csv"),
+        "--output",
+        str(tmp_path / "results.csv.gz"),
+    )
+    main.main(args)
+
+    assert (tmp_path / "results.csv").read_text() == "id,name\n1,a\n2,b\n"
+    assert (
+        gzip.decompress((tmp_path / "results.csv.gz").read_bytes())
+        == b"id,name\r\n1,a\r\n2,b\r\n"
+    )
+
+
+@pytest.mark.parametrize(
+    "argv,match",
+    [
+        (["--output", "results.csv", "--output", "results-{n}.csv"], "templates"),
+        (["--output", "results.csv", "--output", "results.csv"], "different file"),
+        (["--output", "results.csv", "--output", "./results.csv"], "different file"),
+        (
+            [
+                "--output",
+                "results.csv",
+                "--output",
+                "results.csv.gz",
+                "--dsn",
+                "sqlite:///db",
+                "--resume-column",
+                "id",
+            ],
+            "Resumed and incremental",
+        ),
+    ],
+)
+def test_main_with_several_outputs_and_invalid_args(tmp_path, argv, match):
+    with pytest.raises(RuntimeError, match=match):
+        main.main(make_args(tmp_path, *argv))
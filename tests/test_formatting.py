@@ -0,0 +1,73 @@
+import decimal
+
+import pytest
+
+from sqlrunner import formatting, main, utils
+
+
+@pytest.mark.parametrize(
+    "value,formatted",
+    [
+        (decimal.Decimal("1E-7"), "0.0000001"),
+        (decimal.Decimal("1E+3"), "1000"),
+        (decimal.Decimal("-1.50"), "-1.50"),
+        (b"\x00\xff", "0x00FF"),
+        (bytearray(b"\x0a"), "0x0A"),
+        ("text", "text"),
+        (1, 1),
+    ],
+)
+def test_format_any(value, formatted):
+    assert formatting.format_any(value) == formatted
+
+
+def test_make_formatter_from_type_codes():
+    headers = utils.Headers(
+        ["id", "value", "data", "name"],
+        [utils.NUMBER, utils.DECIMAL, utils.BINARY, utils.STRING],
+    )
+    # The values in the first batch are NULL, so the formatters are chosen from the
+    # type codes
+    format_batch = formatting.make_formatter(headers, [(1, None, None, None)])
+    assert format_batch(
+        [(1, None, None, None), (2, decimal.Decimal("1E-8"), b"\x01", "a")]
+    ) == [[1, None, None, None], [2, "0.00000001", "0x01", "a"]]
+
+
+def test_make_formatter_from_values():
+    headers = ["value", "data", "unknown", "name"]
+    first_batch = [(decimal.Decimal("0.00000001"), b"\x01", None, "a")]
+    format_batch = formatting.make_formatter(headers, first_batch)
+    assert format_batch(first_batch + [(None, None, b"\x02", "b")]) == [
+        ["0.00000001", "0x01", None, "a"],
+        [None, None, "0x02", "b"],
+    ]
+
+
+@pytest.mark.parametrize(
+    "headers,first_batch",
+    [
+        # Dummy data
+        (["id", "name"], [("1", "a")]),
+        # A scale of at most six, which `str` doesn't format in scientific notation
+        (utils.Headers(["value"], [utils.DECIMAL]), [(decimal.Decimal("0.000001"),)]),
+    ],
+)
+def test_make_formatter_without_formatting(headers, first_batch):
+    format_batch = formatting.make_formatter(headers, first_batch)
+    assert format_batch(first_batch) is first_batch
+
+
+def test_write_results(tmp_path):
+    f_path = tmp_path / "results.csv"
+    results = iter(
+        [
+            utils.Headers(["value", "data"], [utils.DECIMAL, utils.BINARY]),
+            [(decimal.Decimal("1E-7"), b"\xab")],
+        ]
+    )
+    main.write_results(results, f_path)
+    assert f_path.read_text(encoding="utf-8").splitlines() == [
+        "value,data",
+        "0.0000001,0xAB",
+    ]
@@ -0,0 +1,310 @@
+import datetime
+import functools
+import json
+import sqlite3
+
+import pytest
+
+from sqlrunner import OLD_T1OOS_TABLE, __main__, codecs, incremental, main, sharding
+
+from .sources import Source, expected_text
+
+
+def test_state_path(tmp_path):
+    assert (
+        incremental.state_path(tmp_path / "results.csv.gz")
+        == tmp_path / "results.csv.gz.watermark.json"
+    )
+
+
+@pytest.mark.parametrize(
+    "watermark,predicate",
+    [
+        (10, " WHERE Patient_ID > 10"),
+        ("2020-01-01", " WHERE Patient_ID > '2020-01-01'"),
+    ],
+)
+def test_delta_query(watermark, predicate):
+    sql_query = (
+        f"-- {OLD_T1OOS_TABLE} intentionally not excluded\n"
+        "SELECT Patient_ID FROM Patient"
+    )
+    query = incremental.delta_query(sql_query, "Patient_ID", watermark)
+    assert query.splitlines() == [
+        f"-- {OLD_T1OOS_TABLE} intentionally not excluded",
+        f"SELECT Patient_ID FROM Patient{predicate}",
+    ]
+    assert main.are_t1oos_handled(query)
+
+
+def test_delta_query_without_watermark():
+    assert incremental.delta_query("SELECT 1 AS id", "id") == "SELECT 1 AS id"
+
+
+def test_delta_query_with_existing_predicate():
+    query = incremental.delta_query(
+        "SELECT p.Patient_ID FROM Patient p WHERE p.Sex = 'F'", "p.Patient_ID", 10
+    )
+    assert query == (
+        "SELECT p.Patient_ID FROM Patient AS p WHERE p.Sex = 'F' AND p.Patient_ID > 10"
+    )
+
+
+def write_csv(results, f_path, append):
+    main.write_results(results, f_path, append=append)
+
+
+def read_state(f_path):
+    return json.loads(incremental.state_path(f_path).read_text("utf-8"))
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".csv.gz"])
+def test_write_results_appends_new_rows(tmp_path, suffix):
+    f_path = tmp_path / f"results{suffix}"
+    write = functools.partial(
+        incremental.write_results, column="id", fingerprint="abc", write=write_csv
+    )
+
+    source = Source(5)
+    write(source, f_path)
+    assert read_state(f_path)["watermark"] == 4
+
+    # The table gains rows
+    source.num_rows = 8
+    write(source, f_path)
+    # No new rows
+    write(source, f_path)
+
+    assert source.calls == [None, 4, 7]
+    with codecs.open_input(f_path) as f:
+        assert f.read() == expected_text(8)
+    state = read_state(f_path)
+    assert state["watermark"] == 7
+    assert state["rows"] == 8
+    assert state["headers"] == ["id", "name"]
+
+
+def test_write_results_after_failure(tmp_path):
+    f_path = tmp_path / "results.csv.gz"
+    write = functools.partial(
+        incremental.write_results, column="id", fingerprint="abc", write=write_csv
+    )
+
+    source = Source(4)
+    write(source, f_path)
+    source.num_rows = 10
+    source.fail_after = 2
+    with pytest.raises(ConnectionError):
+        write(source, f_path)
+
+    # The rows that were appended by the failed run are discarded
+    source.fail_after = None
+    write(source, f_path)
+
+    assert source.calls == [None, 3, 3]
+    with codecs.open_input(f_path) as f:
+        assert f.read() == expected_text(10)
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"full_refresh": True},
+        {"fingerprint": "def"},
+    ],
+)
+def test_write_results_rewrites_output(tmp_path, kwargs):
+    f_path = tmp_path / "results.csv"
+    write = functools.partial(
+        incremental.write_results, column="id", fingerprint="abc", write=write_csv
+    )
+
+    source = Source(4)
+    write(source, f_path)
+    write(source, f_path, **kwargs)
+
+    assert source.calls == [None, None]
+    assert f_path.read_text() == expected_text(4).replace("\r\n", "\n")
+
+
+def test_write_results_ignores_state_without_output(tmp_path):
+    f_path = tmp_path / "results.csv"
+    write = functools.partial(
+        incremental.write_results, column="id", fingerprint="abc", write=write_csv
+    )
+
+    source = Source(4)
+    write(source, f_path)
+    f_path.unlink()
+    write(source, f_path)
+
+    assert source.calls == [None, None]
+
+
+def test_write_results_to_new_shards(tmp_path):
+    f_path = tmp_path / "results.csv.gz"
+    write = functools.partial(
+        incremental.write_results,
+        column="id",
+        fingerprint="abc",
+        write=lambda results, f_path, append: sharding.write_results(
+            results, f_path, max_rows=3, append=append
+        ),
+    )
+
+    source = Source(4)
+    write(source, f_path)
+    source.num_rows = 6
+    write(source, f_path)
+    write(source, f_path)
+
+    assert source.calls == [None, 3, 5]
+    manifest = json.loads(sharding.manifest_path(f_path).read_text())
+    assert manifest["rows"] == 6
+    assert [shard["path"] for shard in manifest["shards"]] == [
+        "results-00000.csv.gz",
+        "results-00001.csv.gz",
+        "results-00002.csv.gz",
+    ]
+    assert [shard["rows"] for shard in manifest["shards"]] == [3, 1, 2]
+    assert read_state(f_path)["bytes"] is None
+
+
+def test_write_results_without_rows(tmp_path):
+    f_path = tmp_path / "results.csv"
+    write = functools.partial(
+        incremental.write_results, column="id", fingerprint="abc", write=write_csv
+    )
+
+    source = Source(0)
+    write(source, f_path)
+    # Without a watermark, the next run fetches all the rows
+    source.num_rows = 2
+    write(source, f_path)
+
+    assert source.calls == [None, None]
+    assert f_path.read_text() == expected_text(2).replace("\r\n", "\n")
+
+
+def test_write_results_with_changed_columns(tmp_path):
+    f_path = tmp_path / "results.csv"
+    write = functools.partial(
+        incremental.write_results, column="id", fingerprint="abc", write=write_csv
+    )
+    write(Source(2), f_path)
+
+    with pytest.raises(RuntimeError, match="columns have changed"):
+        write(lambda watermark: iter([("name", "id"), [("name 2", 2)]]), f_path)
+
+
+@pytest.mark.parametrize(
+    "high,low,watermark",
+    [
+        (datetime.date(2020, 1, 2), datetime.date(2020, 1, 1), "2020-01-02"),
+        (
+            datetime.datetime(2020, 1, 2, 3, 4, 5),
+            datetime.datetime(2020, 1, 1),
+            "2020-01-02T03:04:05.000",
+        ),
+    ],
+)
+def test_write_results_with_dates(tmp_path, high, low, watermark):
+    f_path = tmp_path / "results.csv"
+    batches = [[(None,)], [(high,), (low,)]]
+    incremental.write_results(
+        lambda watermark: iter([("date",), *batches]),
+        f_path,
+        column="date",
+        fingerprint="abc",
+        write=write_csv,
+    )
+    # NULLs are ignored
+    assert read_state(f_path)["watermark"] == watermark
+
+
+def test_write_results_without_results(tmp_path):
+    f_path = tmp_path / "results.csv"
+    incremental.write_results(
+        lambda watermark: iter([]),
+        f_path,
+        column="id",
+        fingerprint="abc",
+        write=write_csv,
+    )
+    assert f_path.read_text() == ""
+    assert read_state(f_path)["watermark"] is None
+
+
+def test_write_results_without_output_file():
+    with pytest.raises(RuntimeError, match="Only output files"):
+        incremental.write_results(
+            Source(2), None, column="id", fingerprint="abc", write=write_csv
+        )
+
+
+def test_write_results_without_watermark_column(tmp_path):
+    with pytest.raises(RuntimeError, match="watermark column other isn't selected"):
+        incremental.write_results(
+            Source(2),
+            tmp_path / "results.csv",
+            column="t.other",
+            fingerprint="abc",
+            write=write_csv,
+        )
+
+
+def run_main(tmp_path, *argv, output="results.csv"):
+    args = __main__.parse_args(
+        [
+            str(tmp_path / "query.sql"),
+            "--dsn",
+            f"sqlite:///{tmp_path / 'database.sqlite'}",
+            "--output",
+            str(tmp_path / output),
+            "--watermark-column",
+            "id",
+            *argv,
+        ],
+        {},
+    )
+    main.main(args)
+
+
+def test_main_with_watermark_column(tmp_path):
+    (tmp_path / "query.sql").write_text(
+        f"-- {OLD_T1OOS_TABLE} intentionally not excluded\n"
+        "SELECT id, name FROM t WHERE id > 0",
+        "utf-8",
+    )
+    conn = sqlite3.connect(tmp_path / "database.sqlite")
+    with conn:
+        conn.execute("CREATE TABLE t (id INTEGER, name TEXT)")
+        conn.execute("INSERT INTO t VALUES (1, 'a'), (2, 'b')")
+    run_main(tmp_path)
+    with conn:
+        conn.execute("INSERT INTO t VALUES (3, 'c')")
+    run_main(tmp_path)
+    conn.close()
+
+    assert (tmp_path / "results.csv").read_text() == "id,name\n1,a\n2,b\n3,c\n"
+    assert read_state(tmp_path / "results.csv")["watermark"] == 3
+
+    run_main(tmp_path, "--full-refresh")
+    assert (tmp_path / "results.csv").read_text() == "id,name\n1,a\n2,b\n3,c\n"
+
+
+@pytest.mark.parametrize(
+    "output,argv,match",
+    [
+        ("results-{n}.csv", [], "single output file"),
+        ("results.parquet", [], "Only CSV output files"),
+        ("results.csv", ["--partition-column", "id"], "resumed or partitioned"),
+        ("results.csv", ["--column-stats"], "Column statistics"),
+    ],
+)
+def test_main_with_watermark_column_and_invalid_args(tmp_path, output, argv, match):
+    (tmp_path / "query.sql").write_text(
+        f"-- {OLD_T1OOS_TABLE} intentionally not excluded\nSELECT 1 AS id", "utf-8"
+    )
+    with pytest.raises(RuntimeError, match=match):
+        run_main(tmp_path, *argv, output=output)
@@ -0,0 +1,119 @@
+import pytest
+
+from sqlrunner import T1OOS_TABLE, materialization
+
+
+def test_materialize():
+    sql_query = f"""
+        -- A comment
+        SELECT Patient_ID INTO #cohort FROM Patient
+        WHERE Patient_ID NOT IN (SELECT Patient_ID FROM {T1OOS_TABLE});
+        WITH reg AS (SELECT Patient_ID, StartDate FROM RegistrationHistory)
+        SELECT c.Patient_ID FROM #cohort c JOIN reg r ON r.Patient_ID = c.Patient_ID
+        WHERE c.Patient_ID NOT IN (SELECT Patient_ID FROM {T1OOS_TABLE});
+        WITH reg AS (SELECT Patient_ID, StartDate FROM RegistrationHistory)
+        SELECT Patient_ID, StartDate FROM reg
+    """
+    assert materialization.materialize(sql_query).splitlines() == [
+        "-- A comment",
+        "SELECT Patient_ID INTO #sqlrunner_shared_1 "
+        f"FROM (SELECT Patient_ID AS Patient_ID FROM {T1OOS_TABLE}) AS fragment;",
+        "CREATE CLUSTERED INDEX ix_sqlrunner_shared_1 "
+        "ON #sqlrunner_shared_1(Patient_ID);",
+        "SELECT Patient_ID, StartDate INTO #sqlrunner_shared_2 "
+        "FROM (SELECT Patient_ID AS Patient_ID, StartDate AS StartDate "
+        "FROM RegistrationHistory) AS fragment;",
+        "CREATE CLUSTERED INDEX ix_sqlrunner_shared_2 "
+        "ON #sqlrunner_shared_2(Patient_ID);",
+        "SELECT Patient_ID INTO #cohort FROM Patient "
+        "WHERE NOT Patient_ID IN (SELECT Patient_ID FROM #sqlrunner_shared_1);",
+        "WITH reg AS (SELECT Patient_ID AS Patient_ID, StartDate AS StartDate "
+        "FROM #sqlrunner_shared_2) "
+        "SELECT c.Patient_ID FROM #cohort AS c JOIN reg AS r "
+        "ON r.Patient_ID = c.Patient_ID "
+        "WHERE NOT c.Patient_ID IN (SELECT Patient_ID FROM #sqlrunner_shared_1);",
+        "WITH reg AS (SELECT Patient_ID AS Patient_ID, StartDate AS StartDate "
+        "FROM #sqlrunner_shared_2) "
+        "SELECT Patient_ID, StartDate FROM reg",
+    ]
+
+
+def test_materialize_nested_fragments():
+    sql_query = """
+        SELECT x.a FROM (SELECT b.a FROM (SELECT c AS a FROM t) b) x;
+        SELECT y.a FROM (SELECT b.a FROM (SELECT c AS a FROM t) b) y;
+        SELECT z.a FROM (SELECT c AS a FROM t) z
+    """
+    # The inner fragment is materialized first, because the outer fragment is
+    # materialized from it
+    assert materialization.materialize(sql_query).splitlines() == [
+        "SELECT a INTO #sqlrunner_shared_2 FROM (SELECT c AS a FROM t) AS fragment;",
+        "CREATE CLUSTERED INDEX ix_sqlrunner_shared_2 ON #sqlrunner_shared_2(a);",
+        "SELECT a INTO #sqlrunner_shared_1 "
+        "FROM (SELECT b.a AS a FROM (SELECT a AS a FROM #sqlrunner_shared_2) AS b) "
+        "AS fragment;",
+        "CREATE CLUSTERED INDEX ix_sqlrunner_shared_1 ON #sqlrunner_shared_1(a);",
+        "SELECT x.a FROM (SELECT a AS a FROM #sqlrunner_shared_1) AS x;",
+        "SELECT y.a FROM (SELECT a AS a FROM #sqlrunner_shared_1) AS y;",
+        "SELECT z.a FROM (SELECT a AS a FROM #sqlrunner_shared_2) AS z",
+    ]
+
+
+@pytest.mark.parametrize(
+    "fragment",
+    [
+        # Selects from a temporary table, whose contents may change
+        "SELECT Patient_ID FROM #t",
+        "SELECT Patient_ID FROM ##t",
+        "SELECT Patient_ID FROM @t",
+        # Selects from a table that the query writes to
+        "SELECT Patient_ID FROM Written",
+        # Selects from a CTE, which may differ from statement to statement
+        "SELECT Patient_ID FROM cte",
+        # References an outer query
+        "SELECT e.Patient_ID FROM CodedEvent e WHERE e.Patient_ID = p.Patient_ID",
+        # Is nondeterministic
+        "SELECT NEWID() AS id FROM Patient",
+        "SELECT CRYPT_GEN_RANDOM(4) AS id FROM Patient",
+        # Has columns without names
+        "SELECT COUNT(*) FROM Patient",
+        "SELECT * FROM Patient",
+        "SELECT a, a FROM Patient",
+    ],
+)
+def test_materialize_unsafe_fragment(fragment):
+    sql_query = f"""
+        SET NOCOUNT ON;
+        INSERT INTO Written SELECT 1;
+        WITH cte AS (SELECT 1 AS Patient_ID) SELECT * FROM cte;
+        SELECT p.Patient_ID FROM Patient p WHERE p.Patient_ID IN ({fragment});
+        SELECT p.Patient_ID FROM Patient p WHERE p.Patient_ID IN ({fragment})
+    """
+    assert materialization.materialize(sql_query) == sql_query
+
+
+def test_materialize_is_cached():
+    sql_query = "SELECT * FROM (SELECT a FROM t) x; SELECT * FROM (SELECT a FROM t) y"
+    rewritten = materialization.materialize(sql_query)
+    assert materialization.materialize(sql_query) is rewritten
+
+
+def test_materialize_without_repeated_fragments():
+    sql_query = f"SELECT Patient_ID FROM (SELECT Patient_ID FROM {T1OOS_TABLE}) t"
+    assert materialization.materialize(sql_query) == sql_query
+
+
+@pytest.mark.parametrize(
+    "columns,index_column",
+    [
+        ("a, Patient_ID", "Patient_ID"),
+        ("a, Event_ID", "Event_ID"),
+        ("a, b", "a"),
+    ],
+)
+def test_materialize_index_column(columns, index_column):
+    fragment = f"SELECT {columns} FROM t"
+    sql_query = f"SELECT * FROM ({fragment}) x; SELECT * FROM ({fragment}) y"
+    assert f"ON #sqlrunner_shared_1({index_column})" in materialization.materialize(
+        sql_query
+    )
@@ -0,0 +1,79 @@
+import gzip
+
+import pytest
+
+from sqlrunner import codecs, metrics
+
+
+def test_track(log_output):
+    run_metrics = metrics.Metrics(every_rows=2, every_seconds=60)
+    results = iter([("a",), [(1,), (2,)], [(3,)]])
+    assert list(run_metrics.track(results)) == [("a",), [(1,), (2,)], [(3,)]]
+
+    assert run_metrics.rows == 3
+    assert run_metrics.execute_seconds <= run_metrics.first_row_seconds
+    # One heartbeat, after the first batch; the second batch has only one row
+    heartbeats = [e for e in log_output.entries if e["event"] == "progress"]
+    assert len(heartbeats) == 1
+    assert heartbeats[0]["rows"] == 2
+    assert heartbeats[0]["peak_rss_bytes"] > 0
+
+
+def test_track_every_seconds(log_output):
+    run_metrics = metrics.Metrics(every_rows=100, every_seconds=0)
+    list(run_metrics.track(iter([("a",), [(1,)], [(2,)]])))
+    heartbeats = [e for e in log_output.entries if e["event"] == "progress"]
+    assert [e["rows"] for e in heartbeats] == [1, 2]
+
+
+def test_track_without_rows():
+    run_metrics = metrics.Metrics()
+    assert list(run_metrics.track(iter([("a",)]))) == [("a",)]
+    summary = run_metrics.summary()
+    assert summary["rows"] == 0
+    assert summary["first_row_seconds"] is None
+    assert summary["compression_ratio"] is None
+
+
+def test_track_without_collecting():
+    results = iter([("a",)])
+    assert metrics.track(results) is results
+
+
+def test_collect(tmp_path, log_output):
+    f_path = tmp_path / "results.csv.gz"
+    with metrics.collect() as run_metrics:
+        assert metrics.current() is run_metrics
+        results = metrics.track(iter([("a",), [(1,)] * 1_000]))
+        with codecs.open_output(f_path) as f:
+            for batch in results:
+                f.write("".join(f"{row[0]}\n" for row in batch))
+    assert metrics.current() is None
+
+    summary = next(e for e in log_output.entries if e["event"] == "run_summary")
+    assert summary["rows"] == 1_000
+    assert summary["uncompressed_bytes"] == len(gzip.decompress(f_path.read_bytes()))
+    assert summary["compressed_bytes"] == f_path.stat().st_size
+    assert summary["compression_ratio"] > 1
+    assert summary["peak_rss_bytes"] > 0
+
+
+def test_collect_with_error(log_output):
+    with pytest.raises(ValueError):
+        with metrics.collect():
+            raise ValueError
+    assert metrics.current() is None
+    assert not [e for e in log_output.entries if e["event"] == "run_summary"]
+
+
+def test_counting_file_when_appending(tmp_path):
+    f_path = tmp_path / "results.csv"
+    f_path.write_bytes(b"a\n")
+    with metrics.collect() as run_metrics:
+        with codecs.open_output(f_path, append=True) as f:
+            f.write("1\n2\n")
+        # Closing the file again doesn't count its bytes again. (Closing the text
+        # wrapper again wouldn't close the counting file.)
+        f.buffer.close()
+    assert run_metrics.uncompressed_bytes == 4
+    assert run_metrics.compressed_bytes == 4
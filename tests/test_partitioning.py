@@ -0,0 +1,170 @@
+import pytest
+
+from sqlrunner import OLD_T1OOS_TABLE, T1OOS_TABLE, main, partitioning
+
+from .sources import make_results
+
+
+QUERY = f"""
+-- {OLD_T1OOS_TABLE} intentionally not excluded
+SELECT Patient_ID, COUNT(*) AS n INTO #t FROM Patient GROUP BY Patient_ID;
+SELECT t.Patient_ID, t.n FROM #t t WHERE t.n > 1 ORDER BY t.Patient_ID
+"""
+
+
+def test_partition_query_by_modulo():
+    queries = partitioning.partition_query(QUERY, "t.Patient_ID", 2)
+    assert [q.splitlines()[-1] for q in queries] == [
+        "SELECT t.Patient_ID, t.n FROM #t AS t WHERE t.n > 1 "
+        "AND (ABS(t.Patient_ID % 2) = 0 OR t.Patient_ID IS NULL) "
+        "ORDER BY t.Patient_ID",
+        "SELECT t.Patient_ID, t.n FROM #t AS t WHERE t.n > 1 "
+        "AND ABS(t.Patient_ID % 2) = 1 "
+        "ORDER BY t.Patient_ID",
+    ]
+
+
+def test_partition_query_by_range():
+    queries = partitioning.partition_query(
+        "SELECT Patient_ID FROM Patient", "Patient_ID", 3, bounds=(1, 10)
+    )
+    assert queries == [
+        "SELECT Patient_ID FROM Patient "
+        "WHERE (Patient_ID >= 1 AND Patient_ID < 5) OR Patient_ID IS NULL",
+        "SELECT Patient_ID FROM Patient WHERE Patient_ID >= 5 AND Patient_ID < 9",
+        "SELECT Patient_ID FROM Patient WHERE Patient_ID >= 9",
+    ]
+
+
+def test_partition_query_by_range_with_more_partitions_than_values():
+    queries = partitioning.partition_query(
+        "SELECT Patient_ID FROM Patient", "Patient_ID", 3, bounds=(0, 0)
+    )
+    assert queries[0] == (
+        "SELECT Patient_ID FROM Patient "
+        "WHERE (Patient_ID >= 0 AND Patient_ID < 1) OR Patient_ID IS NULL"
+    )
+
+
+def test_partition_query_keeps_prelude_and_line_comments():
+    for query in partitioning.partition_query(QUERY, "Patient_ID", 4):
+        lines = query.splitlines()
+        assert lines[0] == f"-- {OLD_T1OOS_TABLE} intentionally not excluded"
+        assert lines[1].startswith("SELECT Patient_ID, COUNT(*) AS n INTO #t")
+        assert main.are_t1oos_handled(query)
+
+
+def test_partition_query_keeps_trailing_line_comments():
+    query = (
+        "SELECT Patient_ID FROM Patient  "
+        f"-- {OLD_T1OOS_TABLE} intentionally not excluded\n"
+        "WHERE Sex = '--F' /* -- */"
+    )
+    for partitioned in partitioning.partition_query(query, "Patient_ID", 2):
+        lines = partitioned.splitlines()
+        assert lines[0] == f"-- {OLD_T1OOS_TABLE} intentionally not excluded"
+        assert lines[1].startswith("SELECT Patient_ID FROM Patient WHERE Sex = '--F'")
+        assert len(lines) == 2
+        assert main.are_t1oos_handled(partitioned)
+
+
+def test_partition_query_keeps_t1oo_exclusion():
+    query = (
+        "SELECT Patient_ID FROM Patient "
+        f"WHERE Patient_ID NOT IN (SELECT Patient_ID FROM {T1OOS_TABLE})"
+    )
+    for partitioned in partitioning.partition_query(query, "Patient_ID", 2):
+        assert main.are_t1oos_handled(partitioned)
+
+
+@pytest.mark.parametrize(
+    "query,message",
+    [
+        ("SELECT a FROM t UNION SELECT b FROM u", "final statement is a SELECT"),
+        ("SELECT a INTO #t FROM t", "final statement is a SELECT"),
+        ("SELECT TOP 10 a FROM t", "has a TOP"),
+        ("SELECT b, COUNT(*) AS n FROM t GROUP BY b", "has a GROUP BY"),
+        ("SELECT b FROM t GROUP BY b HAVING COUNT(*) > 1", "has a GROUP BY"),
+        ("SELECT DISTINCT b FROM t", "has a DISTINCT"),
+        ("SELECT COUNT(*) AS n FROM t", "has an aggregate"),
+        ("SELECT a, ROW_NUMBER() OVER (ORDER BY b) AS r FROM t", "window function"),
+    ],
+)
+def test_partition_query_with_unpartitionable_query(query, message):
+    with pytest.raises(RuntimeError, match=message):
+        partitioning.partition_query(query, "a", 2)
+
+
+@pytest.mark.parametrize(
+    "query,column",
+    [
+        # Groups don't span partitions
+        ("SELECT a, COUNT(*) AS n FROM t GROUP BY a", "a"),
+        ("SELECT t.a, COUNT(*) AS n FROM t GROUP BY t.a, t.b", "t.a"),
+        # Aggregates in subqueries are run in full by each partition
+        ("SELECT a FROM t WHERE b = (SELECT MAX(b) FROM u)", "a"),
+    ],
+)
+def test_partition_query_with_aggregates_within_partitions(query, column):
+    assert len(partitioning.partition_query(query, column, 2)) == 2
+
+
+def test_bounds_query_with_aggregates():
+    with pytest.raises(RuntimeError, match="can't be partitioned"):
+        partitioning.bounds_query("SELECT COUNT(*) AS n FROM t", "a")
+
+
+def test_bounds_query():
+    query = partitioning.bounds_query(QUERY, "Patient_ID")
+    assert query.splitlines()[-1] == (
+        "SELECT MIN(Patient_ID) AS low, MAX(Patient_ID) AS high "
+        "FROM #t AS t WHERE t.n > 1"
+    )
+
+
+def test_merge():
+    merged = list(partitioning.merge([make_results(n, 1, ["a"]) for n in [2, 0, 2, 0]]))
+    assert merged[0] == ("a",)
+    assert sorted(merged[1:]) == [[(0,)], [(0,)], [(1,)], [(1,)]]
+
+
+def test_merge_without_result_sets():
+    assert list(partitioning.merge([iter([]), iter([])])) == []
+
+
+def test_merge_logs_throughput(log_output):
+    list(partitioning.merge([make_results(2, 1, ["a"]), make_results(1, 1, ["a"])]))
+
+    entries = sorted(log_output.entries, key=lambda entry: entry["partition"])
+    assert [(e["event"], e["partition"], e["rows"]) for e in entries] == [
+        ("finish_partition", 0, 2),
+        ("finish_partition", 1, 1),
+    ]
+    for entry in entries:
+        assert entry["seconds"] >= 0
+
+
+def test_merge_when_a_partition_fails():
+    def failing():
+        yield ("a",)
+        raise ValueError("connection dropped")
+
+    def endless():
+        yield ("a",)
+        while True:
+            yield [("a",)]
+
+    with pytest.raises(ValueError, match="connection dropped"):
+        list(partitioning.merge([endless(), failing()], queue_size=1))
+
+
+def test_merge_when_closed_early():
+    def endless():
+        yield ("a",)
+        while True:
+            yield [("a",)]
+
+    merged = partitioning.merge([endless(), endless()], queue_size=1)
+    assert next(merged) == ("a",)
+    assert next(merged) == [("a",)]
+    merged.close()
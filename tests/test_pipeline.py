@@ -0,0 +1,129 @@
+import csv
+import gzip
+import io
+import time
+
+import pytest
+
+from sqlrunner import main, pipeline
+
+from .sources import make_results
+
+
+@pytest.mark.parametrize("queue_size", [1, pipeline.QUEUE_SIZE])
+def test_write_results_uncompressed(tmp_path, queue_size):
+    expected = tmp_path / "expected.csv"
+    main.write_results(make_results(10, 100), expected)
+
+    f_path = tmp_path / "results.csv"
+    pipeline.write_results(make_results(10, 100), f_path, queue_size=queue_size)
+
+    assert f_path.read_bytes() == expected.read_bytes()
+
+
+def test_write_results_compressed(tmp_path):
+    expected = tmp_path / "expected.csv.gz"
+    main.write_results(make_results(10, 100), expected)
+
+    f_path = tmp_path / "results.csv.gz"
+    pipeline.write_results(make_results(10, 100), f_path)
+
+    with gzip.open(f_path) as f, gzip.open(expected) as g:
+        assert f.read() == g.read()
+
+
+def test_write_results_appended(tmp_path):
+    expected = tmp_path / "expected.csv.gz"
+    main.write_results(make_results(2, 100), expected)
+    main.write_results(make_results(1, 100), expected, append=True)
+
+    f_path = tmp_path / "results.csv.gz"
+    pipeline.write_results(make_results(2, 100), f_path)
+    pipeline.write_results(make_results(1, 100), f_path, append=True)
+
+    with gzip.open(f_path) as f, gzip.open(expected) as g:
+        assert f.read() == g.read()
+
+
+def test_write_results_to_stdout(capsys):
+    pipeline.write_results(make_results(1, 2), None)
+    out, _ = capsys.readouterr()
+    assert out == "id,name\r\n0,name 0\r\n1,name 1\r\n"
+
+
+@pytest.mark.parametrize("results", [[], [("id",)]])
+def test_write_zero_results(tmp_path, results):
+    f_path = tmp_path / "subdir" / "results.csv"
+    pipeline.write_results(iter(results), f_path)
+    assert f_path.read_text(encoding="utf-8") == ""
+
+
+def test_write_results_logs_stage_waits(tmp_path, log_output):
+    pipeline.write_results(make_results(2, 2), tmp_path / "results.csv")
+
+    events = [entry["event"] for entry in log_output.entries]
+    assert events == [
+        "start_writing_results",
+        "finish_pipeline_stage",
+        "finish_pipeline_stage",
+        "finish_pipeline_stage",
+        "finish_writing_results",
+    ]
+    stages = log_output.entries[1:4]
+    assert [stage["stage"] for stage in stages] == ["fetch", "serialize", "write"]
+    for stage in stages:
+        assert stage["input_wait"] >= 0
+        assert stage["output_wait"] >= 0
+
+
+def test_write_results_when_fetching_fails(tmp_path):
+    def results():
+        yield ("id",)
+        yield [(1,)]
+        raise ValueError("connection dropped")
+
+    with pytest.raises(ValueError, match="connection dropped"):
+        pipeline.write_results(results(), tmp_path / "results.csv", queue_size=1)
+
+
+def test_write_results_when_serializing_fails(tmp_path):
+    # A row that isn't a sequence can't be serialized
+    results = iter([("id",), [(1,)], [1]] + [[(i,)] for i in range(100)])
+
+    with pytest.raises(csv.Error):
+        pipeline.write_results(results, tmp_path / "results.csv", queue_size=1)
+
+
+def test_write_results_when_writing_fails(tmp_path, monkeypatch):
+    def open_output(f_path, **kwargs):
+        return open(f_path, "w", encoding="ascii", newline="")
+
+    monkeypatch.setattr("sqlrunner.codecs.open_output", open_output)
+    results = iter([("id",), [("é",)]] + [[(i,)] for i in range(100)])
+
+    with pytest.raises(UnicodeEncodeError):
+        pipeline.write_results(results, tmp_path / "results.csv", queue_size=1)
+
+
+def test_write_results_with_slow_stages(tmp_path, monkeypatch):
+    # A slow source starves the downstream stages, and a slow output file blocks the
+    # upstream stages, so each stage waits for longer than the poll interval.
+    def results():
+        yield ("id",)
+        for i in range(3):
+            time.sleep(pipeline.POLL_INTERVAL * 1.5)
+            yield [(i,)]
+        yield from ([(i,)] for i in range(3, 6))
+
+    class SlowFile(io.StringIO):
+        def write(self, s):
+            time.sleep(pipeline.POLL_INTERVAL * 1.5)
+            return super().write(s)
+
+    f = SlowFile(newline="")
+    monkeypatch.setattr("sqlrunner.codecs.open_output", lambda f_path, **kwargs: f)
+    monkeypatch.setattr(f, "close", lambda: None)
+
+    pipeline.write_results(results(), None, queue_size=1)
+
+    assert f.getvalue() == "id\r\n0\r\n1\r\n2\r\n3\r\n4\r\n5\r\n"
@@ -0,0 +1,209 @@
+import datetime
+import sqlite3
+import threading
+
+import pytest
+
+from sqlrunner import main, pool
+
+
+def test_connection_is_reused(fake_connect, fake_connections):
+    connection_pool = pool.ConnectionPool(fake_connect)
+    with connection_pool.connection() as conn_1:
+        pass
+    with connection_pool.connection() as conn_2:
+        pass
+    assert conn_1 is conn_2
+    assert len(fake_connections) == 1
+    # The connection's transaction is rolled back when it's returned
+    assert conn_1.rollbacks == 2
+
+
+def test_connection_is_closed_after_error(fake_connect, fake_connections):
+    connection_pool = pool.ConnectionPool(fake_connect)
+    with pytest.raises(ValueError):
+        with connection_pool.connection():
+            raise ValueError
+    with connection_pool.connection():
+        pass
+    assert len(fake_connections) == 2
+    assert fake_connections[0].closed
+
+
+def test_connection_is_reused_after_generator_exit(fake_connect, fake_connections):
+    connection_pool = pool.ConnectionPool(fake_connect)
+
+    def results():
+        with connection_pool.connection():
+            yield 1
+
+    gen = results()
+    next(gen)
+    gen.close()
+    with connection_pool.connection():
+        pass
+    assert len(fake_connections) == 1
+    assert not fake_connections[0].closed
+
+
+def test_connection_is_closed_if_rollback_fails(fake_connect, fake_connections):
+    connection_pool = pool.ConnectionPool(fake_connect)
+    with connection_pool.connection() as conn:
+        conn.healthy = False
+    assert conn.closed
+    with connection_pool.connection() as conn:
+        pass
+    assert len(fake_connections) == 2
+
+
+def test_connection_with_changed_session_is_closed(
+    fake_connect, fake_connections, log_output
+):
+    def session_state(conn):
+        return getattr(conn, "dateformat", "mdy")
+
+    connection_pool = pool.ConnectionPool(fake_connect, session_state=session_state)
+    with connection_pool.connection() as conn:
+        # For example, SET DATEFORMAT dmy
+        conn.dateformat = "dmy"
+    assert conn.closed
+    with connection_pool.connection() as conn:
+        assert session_state(conn) == "mdy"
+    with connection_pool.connection():
+        pass
+    assert len(fake_connections) == 2
+    events = [e["event"] for e in log_output.entries]
+    assert events.count("discard_changed_connection") == 1
+
+
+def test_connection_is_closed_if_session_state_fails(fake_connect, fake_connections):
+    def session_state(conn):
+        raise ConnectionError
+
+    connection_pool = pool.ConnectionPool(fake_connect, session_state=session_state)
+    with pytest.raises(ConnectionError):
+        connection_pool.connection().__enter__()
+    assert fake_connections[0].closed
+
+
+def test_pools_dont_leak_temporary_tables(tmp_path):
+    pools = pool.Pools(main.connect_to_database, session_state=main.session_state)
+    dsn = f"sqlite:///{tmp_path / 'database.sqlite'}"
+
+    def run_sql(sql_query):
+        return list(main.run_sql(dsn=dsn, sql_query=sql_query, connect=pools.connect))
+
+    assert run_sql("SELECT 1 AS a INTO #t; SELECT a FROM #t") == [("a",), [(1,)]]
+    with pytest.raises(sqlite3.OperationalError, match="no such table"):
+        run_sql("SELECT a FROM #t")
+    pools.close()
+
+
+@pytest.mark.parametrize(
+    "sql_query,next_sql_query,results",
+    [
+        (
+            "SET DATEFORMAT dmy; SELECT 1 AS a",
+            "SELECT CAST('02/01/2020' AS DATETIME) AS a",
+            [(datetime.datetime(2020, 2, 1),)],
+        ),
+        (
+            "SET ROWCOUNT 1; SELECT 1 AS a",
+            "SELECT a FROM (VALUES (1), (2)) AS t (a)",
+            [(1,), (2,)],
+        ),
+        (
+            "SET TRANSACTION ISOLATION LEVEL READ UNCOMMITTED; SELECT 1 AS a",
+            "SELECT transaction_isolation_level AS a FROM sys.dm_exec_sessions "
+            "WHERE session_id = @@SPID",
+            [(2,)],
+        ),
+        (
+            "CREATE TABLE #t (a INT); COMMIT; SELECT 1 AS a",
+            "SELECT OBJECT_ID('tempdb..#t') AS a",
+            [(None,)],
+        ),
+    ],
+)
+def test_pools_dont_leak_session_state(dsn, sql_query, next_sql_query, results):
+    pools = pool.Pools(main.connect_to_database, session_state=main.session_state)
+
+    def run_sql(sql_query):
+        return list(main.run_sql(dsn=dsn, sql_query=sql_query, connect=pools.connect))
+
+    run_sql(sql_query)
+    assert run_sql(next_sql_query)[1:] == [results]
+    pools.close()
+
+
+def test_idle_connection_is_health_checked(fake_connect, fake_connections, log_output):
+    connection_pool = pool.ConnectionPool(fake_connect, check_after=0)
+    with connection_pool.connection() as conn:
+        pass
+    # The connection is dropped whilst it's idle
+    conn.healthy = False
+    with connection_pool.connection() as new_conn:
+        pass
+    assert new_conn is not conn
+    assert conn.closed
+    assert "discard_unhealthy_connection" in [e["event"] for e in log_output.entries]
+
+
+def test_healthy_idle_connection_is_reused(fake_connect, fake_connections):
+    connection_pool = pool.ConnectionPool(fake_connect, check_after=0)
+    with connection_pool.connection():
+        pass
+    with connection_pool.connection():
+        pass
+    assert len(fake_connections) == 1
+
+
+def test_idle_connection_is_recycled(fake_connect, fake_connections, log_output):
+    connection_pool = pool.ConnectionPool(fake_connect, max_idle=0)
+    with connection_pool.connection():
+        pass
+    with connection_pool.connection():
+        pass
+    assert len(fake_connections) == 2
+    assert fake_connections[0].closed
+    assert "recycle_connection" in [e["event"] for e in log_output.entries]
+
+
+def test_size_is_bounded(fake_connect, fake_connections):
+    connection_pool = pool.ConnectionPool(fake_connect, size=1)
+    acquired = threading.Event()
+
+    def acquire():
+        with connection_pool.connection():
+            acquired.set()
+
+    with connection_pool.connection():
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        # The pool is full, so the thread waits
+        assert not acquired.wait(0.1)
+    thread.join()
+    assert acquired.is_set()
+    assert len(fake_connections) == 1
+
+
+def test_close(fake_connect, fake_connections):
+    connection_pool = pool.ConnectionPool(fake_connect)
+    with connection_pool.connection():
+        pass
+    connection_pool.close()
+    assert fake_connections[0].closed
+
+
+def test_pools(fake_connect, fake_connections):
+    pools = pool.Pools(fake_connect, size=1)
+    with pools.connect("dsn_1") as conn:
+        assert conn.dsn == "dsn_1"
+    with pools.connect("dsn_1"):
+        pass
+    with pools.connect("dsn_2") as conn:
+        assert conn.dsn == "dsn_2"
+    assert len(fake_connections) == 2
+
+    pools.close()
+    assert all(conn.closed for conn in fake_connections)
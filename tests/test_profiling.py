@@ -0,0 +1,131 @@
+import time
+import types
+
+import pytest
+
+from sqlrunner import T1OOS_TABLE, __main__, main, profiling
+
+
+def make_frame(module, function, back=None):
+    return types.SimpleNamespace(
+        f_globals={"__name__": module},
+        f_code=types.SimpleNamespace(co_name=function, co_qualname=function),
+        f_back=back,
+    )
+
+
+def test_profile_path(tmp_path):
+    assert (
+        profiling.profile_path(tmp_path / "sqlrunner.log")
+        == tmp_path / "sqlrunner.log.collapsed"
+    )
+
+
+@pytest.mark.parametrize(
+    "frames,phase",
+    [
+        # From outermost to innermost
+        (
+            [("sqlrunner.main", "_run"), ("sqlrunner.main", "write_results")],
+            "serialize",
+        ),
+        (
+            [("sqlrunner.main", "write_results"), ("sqlrunner.codecs", "write")],
+            "compress",
+        ),
+        (
+            [
+                ("sqlrunner.main", "write_results"),
+                ("sqlrunner.metrics", "track"),
+                ("sqlrunner.main", "_fetch_result_set"),
+            ],
+            "fetch",
+        ),
+        ([("threading", "run"), ("queue", "get")], "other"),
+    ],
+)
+def test_phase(frames, phase):
+    frame = None
+    for module, function in frames:
+        frame = make_frame(module, function, frame)
+    assert profiling._phase(frame) == phase
+
+
+def test_labels():
+    frame = make_frame("sqlrunner.codecs", "write", make_frame("sqlrunner.main", "run"))
+    assert list(profiling._labels(frame)) == [
+        "sqlrunner.main:run",
+        "sqlrunner.codecs:write",
+    ]
+
+
+def test_profile(tmp_path, log_output):
+    f_path = tmp_path / "sqlrunner.log.collapsed"
+    results_path = tmp_path / "results.csv.gz"
+    with profiling.profile(f_path, interval=0.001) as sampler:
+        while sampler.samples < 5:
+            main.write_results(
+                iter([("id",), [(i,) for i in range(10_000)]]), results_path
+            )
+
+    lines = f_path.read_text("utf-8").splitlines()
+    stacks = dict(line.rsplit(" ", 1) for line in lines)
+    assert any(
+        stack.startswith("MainThread;") and "sqlrunner.main:write_results" in stack
+        for stack in stacks
+    )
+    assert sum(int(count) for count in stacks.values()) >= 5
+
+    (event,) = [e for e in log_output.entries if e["event"] == "profile_summary"]
+    assert event["samples"] >= 5
+    assert set(event["wall_seconds"]) <= {"serialize", "compress", "format", "other"}
+
+
+def test_cpu_delta(monkeypatch):
+    sampler = profiling.Sampler()
+    monkeypatch.setattr(time, "pthread_getcpuclockid", lambda ident: 0)
+    seconds = iter([1.0, 1.5])
+    monkeypatch.setattr(time, "clock_gettime", lambda clock: next(seconds))
+    # A thread's first sample has no previous CPU time
+    assert sampler._cpu_delta(1) == 0.0
+    assert sampler._cpu_delta(1) == 0.5
+
+
+def test_cpu_delta_when_thread_has_finished(monkeypatch):
+    def pthread_getcpuclockid(ident):
+        raise OSError("No such process")
+
+    monkeypatch.setattr(time, "pthread_getcpuclockid", pthread_getcpuclockid)
+    assert profiling.Sampler()._cpu_delta(1) == 0.0
+
+
+def test_cpu_delta_without_thread_clocks(monkeypatch):
+    monkeypatch.delattr(time, "pthread_getcpuclockid")
+    assert profiling.Sampler()._cpu_delta(1) == 0.0
+
+
+def test_main_with_profile(tmp_path):
+    input_ = tmp_path / "query.sql"
+    input_.write_text(
+        f"-- {T1OOS_TABLE} intentionally not excluded\nSELECT 1 AS id", "utf-8"
+    )
+    log_file = tmp_path / "sqlrunner.log"
+    args = __main__.parse_args(
+        [
+            str(input_),
+            "--output",
+            str(tmp_path / "results.csv"),
+            "--profile",
+            "--log-file",
+            str(log_file),
+        ],
+        {},
+    )
+    main.main(args)
+    assert profiling.profile_path(log_file).exists()
+
+
+def test_parse_args_with_profile_without_log_file(capsys):
+    with pytest.raises(SystemExit):
+        __main__.parse_args(["query.sql", "--profile"], {})
+    assert "--profile requires --log-file" in capsys.readouterr().err
@@ -0,0 +1,93 @@
+import functools
+import pathlib
+import threading
+
+import pytest
+
+from sqlrunner import main, result_sets
+
+from .sources import make_results
+
+
+@pytest.mark.parametrize(
+    "f_path,is_template",
+    [
+        (None, False),
+        (pathlib.Path("results.csv"), False),
+        (pathlib.Path("results_{n}.csv"), True),
+        (pathlib.Path("{n}/results.csv"), True),
+    ],
+)
+def test_is_template(f_path, is_template):
+    assert result_sets.is_template(f_path) == is_template
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_write_result_sets(tmp_path, workers):
+    all_results = iter([make_results(1, 2, ["a"]), make_results(1, 3, ["b"])])
+    template = tmp_path / "subdir" / "results_{n}.csv"
+
+    result_sets.write_result_sets(
+        all_results, template, main.write_results, workers=workers
+    )
+
+    assert (tmp_path / "subdir" / "results_0.csv").read_text() == "a\n0\n1\n"
+    assert (tmp_path / "subdir" / "results_1.csv").read_text() == "b\n0\n1\n2\n"
+
+
+def test_write_result_sets_overlaps_writing_and_fetching(tmp_path):
+    # The first result set can't finish being written until the second result set has
+    # started being fetched
+    fetching_second = threading.Event()
+
+    def write(results, f_path):
+        if f_path.name == "results_0.csv":
+            assert fetching_second.wait(timeout=5)
+        main.write_results(results, f_path)
+
+    def second_results():
+        fetching_second.set()
+        yield from make_results(1, 1, ["b"])
+
+    all_results = iter([make_results(1, 1, ["a"]), second_results()])
+    result_sets.write_result_sets(all_results, tmp_path / "results_{n}.csv", write)
+
+    assert (tmp_path / "results_0.csv").read_text() == "a\n0\n"
+    assert (tmp_path / "results_1.csv").read_text() == "b\n0\n"
+
+
+def test_write_zero_result_sets(tmp_path):
+    result_sets.write_result_sets(
+        iter([]), tmp_path / "results_{n}.csv", main.write_results
+    )
+    assert (tmp_path / "results_0.csv").read_text() == ""
+
+
+def test_write_result_sets_when_fetching_fails(tmp_path):
+    def results():
+        yield ("a",)
+        raise ValueError("connection dropped")
+
+    with pytest.raises(ValueError, match="connection dropped"):
+        result_sets.write_result_sets(
+            iter([results()]), tmp_path / "results_{n}.csv", main.write_results
+        )
+
+
+def test_write_result_sets_when_writing_fails(tmp_path):
+    def write(results, f_path):
+        raise ValueError("disk full")
+
+    all_results = iter([make_results(1, 1, ["a"])])
+    with pytest.raises(ValueError, match="disk full"):
+        result_sets.write_result_sets(
+            all_results, tmp_path / "results_{n}.csv", write, queue_size=1
+        )
+
+
+def test_write_result_sets_with_other_writers(tmp_path):
+    write = functools.partial(main.write_results, compression_threads=2)
+    result_sets.write_result_sets(
+        iter([make_results(1, 1, ["a"])]), tmp_path / "results_{n}.csv.gz", write
+    )
+    assert (tmp_path / "results_0.csv.gz").exists()
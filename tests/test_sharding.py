@@ -0,0 +1,145 @@
+import hashlib
+import json
+
+import pytest
+
+from sqlrunner import codecs, sharding
+
+from .sources import make_results
+
+
+def read_manifest(f_path):
+    return json.loads(sharding.manifest_path(f_path).read_text(encoding="utf-8"))
+
+
+def read_shards(f_path, manifest):
+    texts = []
+    for shard in manifest["shards"]:
+        with codecs.open_input(f_path.with_name(shard["path"])) as f:
+            texts.append(f.read())
+    return texts
+
+
+@pytest.mark.parametrize(
+    "name,index,expected",
+    [
+        ("results.csv", 0, "results-00000.csv"),
+        ("results.csv.gz", 12, "results-00012.csv.gz"),
+        ("my.results.csv.gz", 1, "my.results-00001.csv.gz"),
+    ],
+)
+def test_shard_path(tmp_path, name, index, expected):
+    assert sharding.shard_path(tmp_path / name, index) == tmp_path / expected
+
+
+def test_manifest_path(tmp_path):
+    assert (
+        sharding.manifest_path(tmp_path / "results.csv.gz")
+        == tmp_path / "results.manifest.json"
+    )
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".csv.gz"])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_write_results_by_rows(tmp_path, suffix, workers):
+    f_path = tmp_path / "subdir" / f"results{suffix}"
+    # Batches of 4 rows don't line up with shards of 3 rows
+    sharding.write_results(
+        make_results(3, 4, ["id"]), f_path, max_rows=3, workers=workers
+    )
+
+    manifest = read_manifest(f_path)
+    assert manifest["headers"] == ["id"]
+    assert manifest["rows"] == 12
+    assert [shard["rows"] for shard in manifest["shards"]] == [3, 3, 3, 3]
+    assert read_shards(f_path, manifest) == [
+        "id\r\n0\r\n1\r\n2\r\n",
+        "id\r\n3\r\n4\r\n5\r\n",
+        "id\r\n6\r\n7\r\n8\r\n",
+        "id\r\n9\r\n10\r\n11\r\n",
+    ]
+
+
+def test_write_results_by_bytes(tmp_path):
+    f_path = tmp_path / "results.csv"
+    # Each batch is 6 bytes ("0\r\n1\r\n"), so each shard gets two batches
+    sharding.write_results(make_results(5, 2, ["id"]), f_path, max_bytes=10)
+
+    manifest = read_manifest(f_path)
+    assert [shard["rows"] for shard in manifest["shards"]] == [4, 4, 2]
+    assert read_shards(f_path, manifest)[-1] == "id\r\n8\r\n9\r\n"
+
+
+def test_write_results_records_sizes_and_checksums(tmp_path):
+    f_path = tmp_path / "results.csv.gz"
+    sharding.write_results(make_results(2, 100, ["id"]), f_path, max_rows=150)
+
+    for shard in read_manifest(f_path)["shards"]:
+        data = (tmp_path / shard["path"]).read_bytes()
+        assert shard["bytes"] == len(data)
+        assert shard["sha256"] == hashlib.sha256(data).hexdigest()
+
+
+@pytest.mark.parametrize("results,headers", [([], []), ([("id",)], ["id"])])
+def test_write_zero_results(tmp_path, results, headers):
+    f_path = tmp_path / "subdir" / "results.csv"
+    sharding.write_results(iter(results), f_path, max_rows=10)
+
+    manifest = read_manifest(f_path)
+    assert manifest["rows"] == 0
+    assert manifest["headers"] == headers
+    assert manifest["shards"][0]["path"] == "results-00000.csv"
+    assert (tmp_path / "subdir" / "results-00000.csv").read_bytes() == b""
+
+
+@pytest.mark.parametrize("num_batches", [0, 1])
+def test_write_results_removes_previous_shards(tmp_path, num_batches):
+    f_path = tmp_path / "results.csv"
+    sharding.write_results(make_results(3, 1, ["id"]), f_path, max_rows=1)
+    sharding.write_results(make_results(num_batches, 1, ["id"]), f_path, max_rows=1)
+
+    manifest = read_manifest(f_path)
+    assert [shard["path"] for shard in manifest["shards"]] == ["results-00000.csv"]
+    assert sorted(p.name for p in tmp_path.glob("results-*.csv")) == [
+        "results-00000.csv"
+    ]
+
+
+@pytest.mark.parametrize("name", [None, "results.parquet"])
+def test_write_results_to_unshardable_output(tmp_path, name):
+    f_path = None if name is None else tmp_path / name
+    with pytest.raises(RuntimeError, match="Only CSV output files can be sharded"):
+        sharding.write_results(make_results(1, 1, ["id"]), f_path, max_rows=1)
+
+
+def test_write_results_when_fetching_fails(tmp_path):
+    def results():
+        yield ("id",)
+        yield [(1,)]
+        raise ValueError("connection dropped")
+
+    with pytest.raises(ValueError, match="connection dropped"):
+        sharding.write_results(results(), tmp_path / "results.csv", max_rows=10)
+
+
+def test_write_results_when_writing_fails(tmp_path, monkeypatch):
+    def open_output(f_path, **kwargs):
+        return open(f_path, "w", encoding="ascii", newline="")
+
+    monkeypatch.setattr("sqlrunner.codecs.open_output", open_output)
+    results = iter([("id",), [("é",)]] + [[(i,)] for i in range(100)])
+
+    with pytest.raises(UnicodeEncodeError):
+        sharding.write_results(
+            results, tmp_path / "results.csv", max_rows=1000, queue_size=1
+        )
+
+
+def test_write_results_logs(tmp_path, log_output):
+    sharding.write_results(
+        make_results(2, 2, ["id"]), tmp_path / "results.csv", max_rows=2
+    )
+    assert log_output.entries == [
+        {"event": "start_writing_results", "log_level": "info"},
+        {"event": "finish_writing_results", "log_level": "info", "shards": 2},
+    ]
@@ -0,0 +1,131 @@
+import datetime
+import decimal
+
+import pytest
+
+from sqlrunner import synthetic, utils
+
+
+def test_infer_column_types():
+    sql_query = """
+        SELECT Patient_ID, DateOfBirth INTO #patients FROM Patient;
+        SELECT
+            p.Patient_ID,
+            p.DateOfBirth AS dob,
+            e.CTV3Code,
+            e.ConsultationDate,
+            e.NumericValue,
+            CAST(e.NumericValue AS DECIMAL(10, 3)) AS value,
+            CAST(e.NumericValue AS MONEY) AS cost,
+            CAST(e.NumericValue AS BIT) AS flag,
+            1 AS one,
+            1.5 AS one_and_a_half,
+            'a' AS a,
+            NULL AS nothing,
+            x.Unknown
+        FROM #patients AS p
+        JOIN CodedEvent AS e ON e.Patient_ID = p.Patient_ID
+        JOIN Other AS x ON x.Patient_ID = p.Patient_ID
+    """
+    assert synthetic.infer_column_types(sql_query) == [
+        {"kind": "int"},
+        {"kind": "date"},
+        {"kind": "str", "length": 50},
+        {"kind": "datetime"},
+        {"kind": "float"},
+        {"kind": "decimal", "scale": 3},
+        {"kind": "decimal", "scale": 4},
+        {"kind": "bool"},
+        {"kind": "literal", "value": 1},
+        {"kind": "literal", "value": 1.5},
+        {"kind": "literal", "value": "a"},
+        {"kind": "null"},
+        {"kind": "str"},
+    ]
+
+
+@pytest.mark.parametrize(
+    "data_type,scale",
+    [("DECIMAL", 0), ("DECIMAL(10)", 0), ("NUMERIC(10, 3)", 3), ("SMALLMONEY", 4)],
+)
+def test_infer_column_types_of_decimals(data_type, scale):
+    sql_query = f"SELECT CAST(NumericValue AS {data_type}) AS value FROM CodedEvent"
+    assert synthetic.infer_column_types(sql_query) == [
+        {"kind": "decimal", "scale": scale}
+    ]
+
+
+def test_infer_column_types_without_select():
+    assert synthetic.infer_column_types("CREATE TABLE #t (a INT)") == []
+
+
+def test_generate():
+    headers = ["Patient_ID", "Sex", "dob", "value", "one", "nothing"]
+    column_types = [
+        {"kind": "int"},
+        {"kind": "str", "length": 1},
+        {"kind": "date"},
+        {"kind": "decimal", "scale": 3},
+        {"kind": "literal", "value": 1},
+        {"kind": "null"},
+    ]
+    results = synthetic.generate(headers, column_types, 25, batch_size=10)
+
+    generated_headers = next(results)
+    assert generated_headers == tuple(headers)
+    assert generated_headers.type_codes == (
+        utils.NUMBER,
+        utils.STRING,
+        utils.DATETIME,
+        utils.DECIMAL,
+        None,
+        None,
+    )
+
+    batches = list(results)
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    rows = [row for batch in batches for row in batch]
+    # Keys are unique and not NULL
+    assert [row[0] for row in rows] == list(range(1, 26))
+    assert {row[1] for row in rows} <= {"F", "M", "U", None}
+    for row in rows:
+        assert row[2] is None or isinstance(row[2], datetime.date)
+        assert row[3] is None or row[3].as_tuple().exponent == -3
+    assert {row[4] for row in rows} == {1}
+    assert {row[5] for row in rows} == {None}
+
+
+def test_generate_is_reproducible():
+    headers = ["a", "b"]
+    column_types = [{"kind": "str"}, {"kind": "datetime"}]
+    assert list(synthetic.generate(headers, column_types, 5, batch_size=5)) == list(
+        synthetic.generate(headers, column_types, 5, batch_size=5)
+    )
+
+
+@pytest.mark.parametrize(
+    "kind,type_",
+    [
+        ("int", int),
+        ("float", float),
+        ("bool", int),
+        ("datetime", datetime.datetime),
+        ("str", str),
+        ("decimal", decimal.Decimal),
+    ],
+)
+def test_generate_values(kind, type_):
+    results = synthetic.generate(
+        ["a"], [{"kind": kind, "scale": 2}], 1_000, batch_size=1_000
+    )
+    _, batch = results
+    values = [value for (value,) in batch]
+    assert all(isinstance(v, type_) for v in values if v is not None)
+    # Some, but not many, values are NULL
+    assert 0 < values.count(None) < 200
+
+
+def test_generate_with_mismatched_column_types():
+    # For example, the query selects * from a table whose schema we don't know
+    results = synthetic.generate(["a", "b"], [], 1, batch_size=1)
+    assert next(results).type_codes == (utils.STRING, utils.STRING)
@@ -0,0 +1,166 @@
+import decimal
+import sqlite3
+
+import pytest
+
+from sqlrunner import main, transforms
+
+from .sources import make_args
+
+
+def test_redact():
+    assert transforms.redact([None, 0, 7, 8, decimal.Decimal("7.5")], 7) == [
+        None,
+        None,
+        None,
+        8,
+        decimal.Decimal("7.5"),
+    ]
+
+
+def test_round_to():
+    assert transforms.round_to([None, 0, 2, 3, 7, 8, 10, 12.0], 5) == [
+        None,
+        0,
+        0,
+        5,
+        5,
+        10,
+        10,
+        10.0,
+    ]
+
+
+def test_round_to_with_fractions():
+    values = [decimal.Decimal("7.6"), decimal.Decimal("-7.5"), 7.4, 7.5, 2.5]
+    rounded = transforms.round_to(values, 5)
+    assert rounded == [decimal.Decimal(10), decimal.Decimal(-10), 5.0, 10.0, 5.0]
+    assert [type(v) for v in rounded] == [type(v) for v in values]
+
+
+def test_parse_rules():
+    assert transforms.parse_rules(["redact:count:7", "round:count,total:5"]) == [
+        ("redact", ["count"], 7),
+        ("round", ["count", "total"], 5),
+    ]
+
+
+@pytest.mark.parametrize(
+    "spec,match",
+    [
+        ("redact:count", "expected kind:column"),
+        ("redact:count:seven", "expected kind:column"),
+        ("suppress:count:7", "Unsupported transform: suppress"),
+        ("round:count:0", "expected a positive number"),
+    ],
+)
+def test_parse_rules_with_invalid_rule(spec, match):
+    with pytest.raises(RuntimeError, match=match):
+        transforms.parse_rules([spec])
+
+
+def test_apply():
+    rules = transforms.parse_rules(["redact:count:7", "round:count,total:5"])
+    results = iter(
+        [
+            ("code", "count", "total"),
+            [("a", 3, 101), ("b", 12, None)],
+            [("c", 8, 99)],
+        ]
+    )
+    assert list(transforms.apply(results, rules)) == [
+        ("code", "count", "total"),
+        [("a", None, 100), ("b", 10, None)],
+        [("c", 10, 100)],
+    ]
+
+
+def test_apply_to_strings():
+    rules = transforms.parse_rules(["redact:count:7"])
+    results = iter([("count",), [("3",), ("",), ("8",)]])
+    assert list(transforms.apply(results, rules))[1] == [
+        (None,),
+        (None,),
+        (decimal.Decimal(8),),
+    ]
+
+
+@pytest.mark.parametrize(
+    "results,match",
+    [
+        ([("total",), [(1,)]], "column count isn't selected"),
+        ([("count",), [("many",)]], "column count isn't numeric"),
+    ],
+)
+def test_apply_with_invalid_results(results, match):
+    rules = transforms.parse_rules(["redact:count:7"])
+    with pytest.raises(RuntimeError, match=match):
+        list(transforms.apply(iter(results), rules))
+
+
+def test_apply_without_results():
+    assert list(transforms.apply(iter([]), [])) == []
+
+
+def test_main_with_transform(tmp_path):
+    dummy_data_file = tmp_path / "dummy_data.csv"
+    dummy_data_file.write_text("code,count\na,3\nb,12\n", "utf-8")
+    output = tmp_path / "results.csv"
+    args = make_args(
+        tmp_path,
+        "--dummy-data-file",
+        str(dummy_data_file),
+        "--output",
+        str(output),
+        "--transform",
+        "redact:count:7",
+        "--transform",
+        "round:count:5",
+        sql_query="SELECT 1 AS count",
+    )
+    main.main(args)
+    # The dummy data file isn't copied, because it's transformed
+    assert output.read_text() == "code,count\na,\nb,10\n"
+
+
+@pytest.mark.parametrize("flag", ["--resume-column", "--watermark-column"])
+def test_main_with_transformed_key_column(tmp_path, flag):
+    args = make_args(
+        tmp_path,
+        "--dsn",
+        f"sqlite:///{tmp_path / 'database.sqlite'}",
+        "--output",
+        str(tmp_path / "results.csv"),
+        flag,
+        "t.count",
+        "--transform",
+        "round:count:5",
+        sql_query="SELECT 1 AS count",
+    )
+    with pytest.raises(RuntimeError, match="column t.count can't be transformed"):
+        main.main(args)
+
+
+@pytest.mark.parametrize("flag", ["--resume-column", "--watermark-column"])
+def test_main_with_transform_and_key_column(tmp_path, flag):
+    database = tmp_path / "database.sqlite"
+    conn = sqlite3.connect(database)
+    with conn:
+        conn.execute("CREATE TABLE t (id INTEGER, count INTEGER)")
+        conn.execute("INSERT INTO t VALUES (1, 3), (2, 12)")
+    conn.close()
+    output = tmp_path / "results.csv"
+    args = make_args(
+        tmp_path,
+        "--dsn",
+        f"sqlite:///{database}",
+        "--output",
+        str(output),
+        flag,
+        "id",
+        "--transform",
+        "redact:count:7",
+        sql_query="SELECT id, count FROM t",
+    )
+    main.main(args)
+    assert output.read_text() == "id,count\n1,\n2,12\n"